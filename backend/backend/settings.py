@@ -15,6 +15,8 @@ from pathlib import Path
 
 from dotenv import load_dotenv
 
+from backend.sqlite import REPLICA, sqlite_databases
+
 load_dotenv()
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -84,12 +86,15 @@ WSGI_APPLICATION = "backend.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
-    }
-}
+# "production" tunes SQLite for concurrent requests with WAL, pragmas, persistent connections and a read-only alias
+# reads outside transactions are sent to, see backend.sqlite
+DATABASE_PROFILE = os.environ.get("DATABASE_PROFILE", "development")
+DATABASES = sqlite_databases(
+    os.environ.get("DATABASE_NAME", BASE_DIR / "db.sqlite3"),
+    DATABASE_PROFILE,
+    conn_max_age=int(os.environ.get("DATABASE_CONN_MAX_AGE", 600)),
+)
+DATABASE_ROUTERS = ["backend.sqlite.router.ReplicaRouter"] if REPLICA in DATABASES else []
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -149,3 +154,34 @@ CSRF_TRUSTED_ORIGINS = [
 SESSION_COOKIE_SECURE = True
 CSRF_COOKIE_SECURE = True
 CSRF_COOKIE_SAMESITE = "None"
+
+# Seconds the formatted message history of a version is cached for, see chat.utils.history
+CHAT_HISTORY_CACHE_TIMEOUT = int(os.environ.get("CHAT_HISTORY_CACHE_TIMEOUT", 60 * 60))
+
+# Backend of the cache of branched conversation payloads, see chat.utils.payloads: "memory" (per process), "file" (a
+# directory shared by the processes of a host) or "sqlite" (a table of the database, created by `createcachetable`)
+CHAT_PAYLOAD_CACHE = os.environ.get("CHAT_PAYLOAD_CACHE", "memory")
+PAYLOAD_CACHE_BACKENDS = {
+    "memory": ("django.core.cache.backends.locmem.LocMemCache", "chat-payloads"),
+    "file": ("django.core.cache.backends.filebased.FileBasedCache", BASE_DIR / "cache" / "payloads"),
+    "sqlite": ("django.core.cache.backends.db.DatabaseCache", "chat_payload_cache"),
+}
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "payloads": {
+        "BACKEND": PAYLOAD_CACHE_BACKENDS[CHAT_PAYLOAD_CACHE][0],
+        "LOCATION": os.environ.get("CHAT_PAYLOAD_CACHE_LOCATION", PAYLOAD_CACHE_BACKENDS[CHAT_PAYLOAD_CACHE][1]),
+        "TIMEOUT": int(os.environ.get("CHAT_PAYLOAD_CACHE_TIMEOUT", 24 * 60 * 60)),
+        "OPTIONS": {"MAX_ENTRIES": int(os.environ.get("CHAT_PAYLOAD_CACHE_MAX_ENTRIES", 10000))},
+    },
+}
+
+# Titles of new conversations are generated in a background thread once their first answer is stored, batching up to
+# this many conversations in one GPT call, see chat.utils.titles. Off by default, as the frontend still asks for the
+# title itself after the first answer
+CHAT_BACKGROUND_TITLES = os.environ.get("CHAT_BACKGROUND_TITLES", "False") == "True"
+CHAT_TITLE_BATCH_SIZE = int(os.environ.get("CHAT_TITLE_BATCH_SIZE", 8))
+
+# Seconds between the writes of an answer stored by a streaming view while it is streamed, besides the write once it
+# ends, 0 writes it only then, see chat.utils.answers
+CHAT_ANSWER_FLUSH_INTERVAL = float(os.environ.get("CHAT_ANSWER_FLUSH_INTERVAL", 2))
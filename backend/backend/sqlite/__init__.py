@@ -0,0 +1,73 @@
+"""
+SQLite database engine tuned for concurrent requests.
+
+The stock `django.db.backends.sqlite3` engine is fine for development, but concurrent streams and writes make it fail
+with "database is locked": the rollback journal blocks reads while a write commits, and deferred transactions which
+read before writing cannot wait for the lock held by another writer. The production profile of `sqlite_databases`
+uses this engine with
+
+- the pragmas applied to every new connection, e.g. WAL journal mode, so that readers and a writer do not block each
+  other,
+- transactions started with `BEGIN IMMEDIATE`, so that writers queue for the lock up to `busy_timeout` instead of
+  failing,
+- persistent connections, instead of opening a connection on every request,
+- a second, read-only alias of the same file, which `ReplicaRouter` sends reads outside transactions to.
+
+The profile is chosen with the `DATABASE_PROFILE` environment variable, see the settings.
+"""
+
+__all__ = ["PRAGMAS", "REPLICA", "WRITER", "sqlite_databases"]
+
+WRITER = "default"
+REPLICA = "replica"
+
+PRAGMAS = {
+    "journal_mode": "WAL",
+    # durable once checkpointed, and never corrupted, with WAL
+    "synchronous": "NORMAL",
+    # in KiB when negative
+    "cache_size": -32000,
+    "mmap_size": 256 * 1024 * 1024,
+    # milliseconds a connection waits for a lock before failing
+    "busy_timeout": 5000,
+    "temp_store": "MEMORY",
+}
+
+
+def sqlite_databases(name, profile: str = "development", conn_max_age: int = 600) -> dict:
+    """
+    Returns the `DATABASES` setting of a SQLite database.
+
+    Parameters
+    ----------
+    name : str or Path
+        Path of the database file.
+    profile : str
+        "development" for the stock engine, "production" for the tuned engine with a read-only replica alias.
+    conn_max_age : int
+        Seconds the connections of the production profile are kept open for.
+
+    Returns
+    -------
+    dict
+        The databases by alias.
+    """
+    if profile == "development":
+        return {WRITER: {"ENGINE": "django.db.backends.sqlite3", "NAME": name}}
+    if profile != "production":
+        raise ValueError(f"Unknown database profile {profile!r}")
+
+    writer = {
+        "ENGINE": "backend.sqlite",
+        "NAME": name,
+        "CONN_MAX_AGE": conn_max_age,
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {"pragmas": PRAGMAS, "transaction_mode": "IMMEDIATE"},
+    }
+    replica = {
+        **writer,
+        "OPTIONS": {"pragmas": {**PRAGMAS, "query_only": "ON"}, "transaction_mode": "DEFERRED"},
+        # tests use the test database of the writer
+        "TEST": {"MIRROR": WRITER},
+    }
+    return {WRITER: writer, REPLICA: replica}
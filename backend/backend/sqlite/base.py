@@ -0,0 +1,31 @@
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ("DEFERRED", "IMMEDIATE", "EXCLUSIVE")
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    The stock SQLite engine, with two more `OPTIONS`: `pragmas` applied to every new connection, and the
+    `transaction_mode` transactions are started in.
+    """
+
+    pragmas = {}
+    transaction_mode = "DEFERRED"
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        # not arguments of sqlite3.connect
+        self.pragmas = conn_params.pop("pragmas", {})
+        self.transaction_mode = conn_params.pop("transaction_mode", "DEFERRED").upper()
+        if self.transaction_mode not in TRANSACTION_MODES:
+            raise ValueError(f"Unknown transaction mode {self.transaction_mode!r}")
+        return conn_params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for pragma, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f"BEGIN {self.transaction_mode}")
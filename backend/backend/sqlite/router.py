@@ -0,0 +1,23 @@
+from django.db import connections
+
+from backend.sqlite import REPLICA, WRITER
+
+
+class ReplicaRouter:
+    """
+    Sends writes to the writer alias and reads to the read-only replica alias of the same database file, so that reads
+    do not wait for the transactions of the writer connection. Reads within a transaction of the writer stay on it, as
+    they have to see its uncommitted writes.
+    """
+
+    def db_for_read(self, model, **hints):
+        return WRITER if connections[WRITER].in_atomic_block else REPLICA
+
+    def db_for_write(self, model, **hints):
+        return WRITER
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == WRITER
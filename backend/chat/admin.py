@@ -1,8 +1,10 @@
 from django.contrib import admin
+from django.db import transaction
 from django.utils import timezone
 from nested_admin.nested import NestedModelAdmin, NestedStackedInline, NestedTabularInline
 
 from chat.models import Conversation, Message, Role, Version
+from chat.utils.sync import record_changes
 
 
 class RoleAdmin(NestedModelAdmin):
@@ -51,17 +53,38 @@ class DeletedListFilter(admin.SimpleListFilter):
 class ConversationAdmin(NestedModelAdmin):
     actions = ["undelete_selected", "soft_delete_selected"]
     inlines = [VersionInline]
-    list_display = ("title", "id", "created_at", "modified_at", "deleted_at", "version_count", "is_deleted", "user")
+    list_display = (
+        "title",
+        "id",
+        "created_at",
+        "modified_at",
+        "deleted_at",
+        "version_count",
+        "message_count",
+        "is_deleted",
+        "user",
+    )
     list_filter = (DeletedListFilter,)
     ordering = ("-modified_at",)
 
+    @transaction.atomic
     def undelete_selected(self, request, queryset):
         queryset.update(deleted_at=None)
+        for conversation in queryset.only("id", "user"):
+            # the clients dropped the versions and messages of the conversation once told it was deleted
+            record_changes(
+                conversation,
+                conversation.versions.all(),
+                Message.objects.filter(version__conversation=conversation),
+            )
 
     undelete_selected.short_description = "Undelete selected conversations"
 
+    @transaction.atomic
     def soft_delete_selected(self, request, queryset):
         queryset.update(deleted_at=timezone.now())
+        for conversation in queryset.only("id", "user"):
+            record_changes(conversation, deleted=True)
 
     soft_delete_selected.short_description = "Soft delete selected conversations"
 
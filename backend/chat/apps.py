@@ -1,6 +1,27 @@
 from django.apps import AppConfig
+from django.db import connections
+from django.db.models.signals import post_migrate, pre_migrate
 
 
 class ChatConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "chat"
+
+    def ready(self):
+        pre_migrate.connect(_suspend_search_index, sender=self)
+        post_migrate.connect(_install_search_index, sender=self)
+
+
+def _suspend_search_index(using, plan, **kwargs):
+    """Drops the search index trigger which would stop migrations from rebuilding the conversation tables."""
+    from chat.utils.search import suspend_search_index  # imports the models
+
+    if plan:
+        suspend_search_index(connections[using])
+
+
+def _install_search_index(using, **kwargs):
+    """Restores the search index triggers, dropped before migrations and when a migration rebuilds the message table."""
+    from chat.utils.search import install_search_index  # imports the models
+
+    install_search_index(connections[using])
@@ -0,0 +1,53 @@
+import copy
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.models import Conversation
+from chat.serializers import ConversationSerializer
+from chat.utils.branch_metadata import build_branch_metadata, merge_branch_metadata
+from chat.utils.branching import make_branched_conversation
+
+
+class Command(BaseCommand):
+    help = "Backfills the stored branch metadata of conversations or verifies it against make_branched_conversation."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verify", action="store_true", help="Only compare the stored metadata, write nothing.")
+        parser.add_argument("--all", action="store_true", help="Rebuild the metadata of every conversation.")
+        parser.add_argument("--batch-size", type=int, default=100)
+
+    def handle(self, *args, **options):
+        conversations = Conversation.objects.order_by("pk")
+        if not options["verify"] and not options["all"]:
+            conversations = conversations.filter(branch_metadata__isnull=True)
+
+        counts = {"updated": 0, "missing": 0, "mismatched": 0, "unbranchable": 0}
+        for conversation in conversations.with_versions().iterator(chunk_size=options["batch_size"]):
+            conversation_data = ConversationSerializer(conversation).data
+            expected_data = copy.deepcopy(conversation_data)
+            try:
+                make_branched_conversation(expected_data)
+            except Exception as e:
+                counts["unbranchable"] += 1
+                self.stdout.write(self.style.WARNING(f"Conversation {conversation.pk} cannot be branched: {e}"))
+                continue
+
+            if options["verify"]:
+                if conversation.branch_metadata is None:
+                    counts["missing"] += 1
+                    continue
+                merge_branch_metadata(conversation_data, conversation.branch_metadata)
+                if json.dumps(conversation_data, default=str) != json.dumps(expected_data, default=str):
+                    counts["mismatched"] += 1
+                    self.stdout.write(self.style.ERROR(f"Conversation {conversation.pk} has stale branch metadata"))
+            else:
+                Conversation.objects.filter(pk=conversation.pk).update(
+                    branch_metadata=build_branch_metadata(conversation_data)
+                )
+                counts["updated"] += 1
+
+        summary = ", ".join(f"{count} {name}" for name, count in counts.items())
+        if options["verify"] and counts["mismatched"]:
+            raise CommandError(f"Branch metadata verification failed: {summary}")
+        self.stdout.write(self.style.SUCCESS(f"Successfully processed conversations: {summary}"))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from chat.models import Message
+
+
+class Command(BaseCommand):
+    help = "Backfills the token counts of messages."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Recount the tokens of every message.")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        messages = Message.objects.select_related("role").order_by("pk")
+        if not options["all"]:
+            messages = messages.filter(token_count__isnull=True)
+
+        messages_count, last_pk = 0, None
+        while True:
+            batch = list((messages if last_pk is None else messages.filter(pk__gt=last_pk))[: options["batch_size"]])
+            if not batch:
+                break
+            for message in batch:
+                message.token_count = message.count_tokens()
+            Message.objects.bulk_update(batch, ["token_count"])
+            messages_count += len(batch)
+            last_pk = batch[-1].pk
+
+        self.stdout.write(self.style.SUCCESS(f"Successfully counted tokens of {messages_count} messages"))
@@ -0,0 +1,49 @@
+import copy
+import json
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from chat.utils import legacy_branching
+from chat.utils.branching import make_branched_conversation
+from chat.utils.synthetic import make_synthetic_conversation_data
+
+
+class Command(BaseCommand):
+    help = "Compares make_branched_conversation with its previous implementation on synthetic version trees."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--versions", type=int, nargs="+", default=[10, 100, 1000])
+        parser.add_argument("--messages", type=int, default=6)
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'versions':>8} {'messages':>8} {'legacy [ms]':>12} {'indexed [ms]':>12} {'speedup':>8}")
+        for versions_count in options["versions"]:
+            conversation_data = make_synthetic_conversation_data(
+                versions_count, options["messages"], unique_roots=True, seed=options["seed"]
+            )
+            messages_count = sum(len(v["messages"]) for v in conversation_data["versions"])
+
+            legacy_time = self._time(legacy_branching.make_branched_conversation, conversation_data, options["repeat"])
+            indexed_time = self._time(make_branched_conversation, conversation_data, options["repeat"])
+            if not self._outputs_match(conversation_data):
+                self.stdout.write(self.style.ERROR(f"Outputs differ for {versions_count} versions"))
+
+            self.stdout.write(
+                f"{versions_count:>8} {messages_count:>8} {legacy_time * 1000:>12.2f} {indexed_time * 1000:>12.2f} "
+                f"{legacy_time / indexed_time:>7.1f}x"
+            )
+
+    @staticmethod
+    def _time(function, conversation_data, repeat):
+        copies = [copy.deepcopy(conversation_data) for _ in range(repeat)]
+        return min(timeit.repeat(lambda: function(copies.pop()), number=1, repeat=repeat))
+
+    @staticmethod
+    def _outputs_match(conversation_data):
+        legacy_data, indexed_data = copy.deepcopy(conversation_data), copy.deepcopy(conversation_data)
+        legacy_branching.make_branched_conversation(legacy_data)
+        make_branched_conversation(indexed_data)
+        return json.dumps(legacy_data, default=str) == json.dumps(indexed_data, default=str)
@@ -0,0 +1,131 @@
+import random
+import statistics
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, connections, transaction
+
+from authentication.models import CustomUser
+from chat.models import Conversation, Message, Role, Version
+from chat.serializers import ConversationSerializer
+from chat.utils.branch_metadata import update_branch_metadata
+from chat.utils.summary import add_messages_to_summary
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks a mixed load of conversation reads and message writes made by concurrent threads on the configured "
+        "database, e.g. a copy of it set with DATABASE_NAME, once with each DATABASE_PROFILE. The benchmark data is "
+        "deleted at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--readers", type=int, default=8, help="Threads reading conversations.")
+        parser.add_argument("--writers", type=int, default=4, help="Threads adding messages.")
+        parser.add_argument("--duration", type=float, default=10, help="Seconds the load is run for.")
+        parser.add_argument("--conversations", type=int, default=200)
+        parser.add_argument("--conversation-messages", type=int, default=20, help="Messages per conversation.")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            (journal_mode,) = cursor.fetchone()
+        self.stdout.write(
+            f"Profile {settings.DATABASE_PROFILE}: journal mode {journal_mode}, databases {', '.join(connections)}"
+        )
+
+        rng = random.Random(options["seed"])
+        user, versions = self._populate(rng, options)
+        try:
+            results = {"read": [], "write": []}
+            errors = {"read": 0, "write": 0}
+            deadline = time.perf_counter() + options["duration"]
+            threads = [
+                threading.Thread(target=self._run, args=(kind, operation, versions, deadline, idx, results, errors))
+                for kind, operation, count in (
+                    ("read", self._read, options["readers"]),
+                    ("write", self._write, options["writers"]),
+                )
+                for idx in range(count)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            user.delete()
+
+        self.stdout.write(f"{'':>6} {'ops':>7} {'ops/s':>8} {'p50':>8} {'p95':>8} {'max':>8} {'errors':>7}   [ms]")
+        for kind, latencies in results.items():
+            p50, p95 = _percentiles(latencies)
+            self.stdout.write(
+                f"{kind:>6} {len(latencies):>7} {len(latencies) / options['duration']:>8.1f} {p50 * 1000:>8.2f} "
+                f"{p95 * 1000:>8.2f} {max(latencies, default=0) * 1000:>8.2f} {errors[kind]:>7}"
+            )
+
+    @staticmethod
+    def _run(kind, operation, versions, deadline, idx, results, errors):
+        rng = random.Random(idx)
+        latencies, errors_count = [], 0
+        try:
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    operation(rng.choice(versions))
+                except OperationalError:  # e.g. "database is locked"
+                    errors_count += 1
+                else:
+                    latencies.append(time.perf_counter() - start)
+        finally:
+            connections.close_all()
+        # list.extend is atomic
+        results[kind].extend(latencies)
+        errors[kind] += errors_count
+
+    @staticmethod
+    def _read(version_id):
+        # what `conversation_manage` GET does
+        conversation = Conversation.objects.with_versions().get(versions=version_id)
+        ConversationSerializer(conversation).data
+
+    @staticmethod
+    def _write(version_id):
+        # what `version_add_message` does
+        version = Version.objects.select_related("conversation").get(pk=version_id)
+        role = Role.objects.get(name="user")
+        with transaction.atomic():
+            message = Message.objects.create(version=version, role=role, content="Benchmark message")
+            add_messages_to_summary(version.conversation, version, [message])
+            update_branch_metadata(version.conversation, [version])
+
+    @staticmethod
+    def _populate(rng, options):
+        roles = [Role.objects.get_or_create(name=name)[0] for name in ("user", "assistant")]
+        user = CustomUser.objects.create(email=f"benchmark-{rng.getrandbits(32)}@example.com")
+        conversations, versions, messages = [], [], []
+        for conversation_idx in range(options["conversations"]):
+            # the primary keys are generated UUIDs, so the related objects are created before being saved
+            conversation = Conversation(title=f"Conversation {conversation_idx}", user=user)
+            version = Version(conversation=conversation)
+            conversation.active_version = version
+            conversations.append(conversation)
+            versions.append(version)
+            messages += [
+                Message(version=version, role=roles[idx % 2], content=f"Message {idx}")
+                for idx in range(options["conversation_messages"])
+            ]
+        with transaction.atomic():
+            Conversation.objects.bulk_create(conversations)
+            Version.objects.bulk_create(versions)
+            Message.objects.bulk_create(messages)
+        return user, [version.id for version in versions]
+
+
+def _percentiles(values):
+    if len(values) < 2:
+        return float("nan"), float("nan")
+    quantiles = statistics.quantiles(values, n=20)
+    return statistics.median(values), quantiles[-1]
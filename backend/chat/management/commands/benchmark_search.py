@@ -0,0 +1,143 @@
+import itertools
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from authentication.models import CustomUser
+from chat.models import Conversation, Message, Role, Version
+from chat.utils.search import search_messages
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "pa", "do", "gri", "sto", "len", "mar", "quo"]
+QUERY_KINDS = {
+    # ranges of word ranks in the Zipf distribution of the vocabulary
+    "frequent": (5, 50),
+    "medium": (500, 2000),
+    "rare": (10000, 20000),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the full-text message search on a synthetic database, comparing it with a LIKE scan of the "
+        "messages. The data is created in a transaction which is rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=1_000_000)
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--conversation-messages", type=int, default=20, help="Messages per conversation.")
+        parser.add_argument("--vocabulary", type=int, default=20000)
+        parser.add_argument("--queries", type=int, default=20, help="Queries per kind of query.")
+        parser.add_argument("--scan-queries", type=int, default=3, help="Queries per kind made with a LIKE scan.")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("The search index needs SQLite")
+
+        rng = random.Random(options["seed"])
+        vocabulary = self._make_vocabulary(rng, options["vocabulary"])
+        with transaction.atomic():
+            start = time.perf_counter()
+            users = self._populate(rng, vocabulary, options)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"Created {options['messages']} messages in {elapsed:.1f} s "
+                f"({options['messages'] / elapsed:.0f} messages/s, indexed by the triggers)"
+            )
+
+            self.stdout.write(
+                f"{'query':>16} {'results':>8} {'FTS p50':>9} {'p95':>7} {'next page p50':>14} {'LIKE p50':>9}   [ms]"
+            )
+            for kind, (low, high) in QUERY_KINDS.items():
+                for words_count in (1, 2):
+                    queries = [
+                        (rng.choice(users), " ".join(rng.choice(vocabulary[low:high]) for _ in range(words_count)))
+                        for _ in range(options["queries"])
+                    ]
+                    self._benchmark(f"{kind} x{words_count}", queries, options["scan_queries"])
+            transaction.set_rollback(True)
+
+    def _benchmark(self, name, queries, scan_queries):
+        first_page, next_page, results_counts = [], [], []
+        for user, query in queries:
+            start = time.perf_counter()
+            results, cursor = search_messages(user, query)
+            first_page.append(time.perf_counter() - start)
+            results_counts.append(len(results))
+            if cursor is not None:
+                start = time.perf_counter()
+                search_messages(user, query, cursor=cursor)
+                next_page.append(time.perf_counter() - start)
+
+        scan = []
+        for user, query in queries[:scan_queries]:
+            messages = Message.objects.filter(version__conversation__user=user, version__conversation__deleted_at=None)
+            for word in query.split():
+                messages = messages.filter(content__icontains=word)
+            start = time.perf_counter()
+            list(messages[:20])
+            scan.append(time.perf_counter() - start)
+
+        self.stdout.write(
+            f"{name:>16} {statistics.mean(results_counts):>8.1f} {_percentile(first_page, 50) * 1000:>9.2f} "
+            f"{_percentile(first_page, 95) * 1000:>7.2f} {_percentile(next_page, 50) * 1000:>14.2f} "
+            f"{_percentile(scan, 50) * 1000:>9.2f}"
+        )
+
+    @staticmethod
+    def _make_vocabulary(rng, size):
+        words = set()
+        while len(words) < size:
+            words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+        return sorted(words, key=lambda word: rng.random())
+
+    @staticmethod
+    def _populate(rng, vocabulary, options):
+        roles = [Role.objects.get_or_create(name=name)[0] for name in ("user", "assistant")]
+        run_id = rng.getrandbits(32)
+        users = CustomUser.objects.bulk_create(
+            [CustomUser(email=f"benchmark-{run_id}-{idx}@example.com") for idx in range(options["users"])]
+        )
+        # Zipf distribution of the words, as in natural language
+        cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, len(vocabulary) + 1)))
+
+        batch = []
+        conversations_count = -(-options["messages"] // options["conversation_messages"])
+        for conversation_idx in range(conversations_count):
+            conversation = Conversation(title=f"Conversation {conversation_idx}", user=rng.choice(users))
+            version = Version(conversation=conversation)
+            messages_count = min(
+                options["conversation_messages"],
+                options["messages"] - conversation_idx * options["conversation_messages"],
+            )
+            batch.append(
+                (
+                    conversation,
+                    version,
+                    [
+                        Message(
+                            version=version,
+                            role=roles[idx % 2],
+                            content=" ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(8, 40))),
+                        )
+                        for idx in range(messages_count)
+                    ],
+                )
+            )
+            if len(batch) * options["conversation_messages"] >= 10000 or conversation_idx == conversations_count - 1:
+                # the primary keys are generated UUIDs, so the related objects are created before being saved
+                Conversation.objects.bulk_create([conversation for conversation, _, _ in batch])
+                Version.objects.bulk_create([version for _, version, _ in batch])
+                Message.objects.bulk_create([message for _, _, messages in batch for message in messages])
+                batch = []
+        return users
+
+
+def _percentile(values, q):
+    if not values:
+        return float("nan")
+    return sorted(values)[max(0, int(q / 100 * len(values) + 0.5) - 1)]
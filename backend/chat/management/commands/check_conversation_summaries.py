@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from chat.models import SUMMARY_FIELDS, Conversation
+from chat.utils.summary import compute_summary, get_summary
+
+
+class Command(BaseCommand):
+    help = "Compares the stored summaries of conversations with freshly computed ones, and repairs them if asked to."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repair", action="store_true", help="Store the computed summaries that differ.")
+        parser.add_argument("--batch-size", type=int, default=100)
+
+    def handle(self, *args, **options):
+        conversations = Conversation.objects.order_by("pk").only("id", "active_version", *SUMMARY_FIELDS)
+        counts = {"checked": 0, "mismatched": 0, "repaired": 0}
+        for conversation in conversations.iterator(chunk_size=options["batch_size"]):
+            counts["checked"] += 1
+            with transaction.atomic():
+                summary = compute_summary(conversation)
+                stored_summary = get_summary(conversation)
+                if summary == stored_summary:
+                    continue
+                counts["mismatched"] += 1
+                changes = ", ".join(
+                    f"{field} {stored_summary[field]!r} != {summary[field]!r}"
+                    for field in SUMMARY_FIELDS
+                    if summary[field] != stored_summary[field]
+                )
+                self.stdout.write(self.style.WARNING(f"Conversation {conversation.pk} has a stale summary: {changes}"))
+                if options["repair"]:
+                    # only repaired if it was not changed by a write view in the meantime
+                    counts["repaired"] += Conversation.objects.filter(pk=conversation.pk, **stored_summary).update(
+                        **summary
+                    )
+
+        result = ", ".join(f"{count} {name}" for name, count in counts.items())
+        if not options["repair"] and counts["mismatched"]:
+            raise CommandError(f"Conversation summaries check failed: {result}")
+        self.stdout.write(self.style.SUCCESS(f"Successfully checked conversation summaries: {result}"))
@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat.models import Change
+from chat.utils.sync import prune_changes
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes the changes of the sync change log older than the given number of days. Clients whose cursor is older "
+        "than the changes kept get a snapshot on their next sync."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=30)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        first_kept = Change.objects.filter(created_at__gte=cutoff).order_by("id").values_list("id", flat=True).first()
+        deleted_count = prune_changes(first_kept)
+        self.stdout.write(self.style.SUCCESS(f"Successfully deleted {deleted_count} changes"))
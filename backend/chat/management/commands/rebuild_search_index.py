@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from chat.utils.search import install_search_index, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text search index of messages, e.g. after a VACUUM of the database."
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("The search index needs SQLite")
+        if not install_search_index():
+            rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS("Successfully rebuilt the search index"))
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.2 on 2026-10-18 14:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chat", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="branch_metadata",
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
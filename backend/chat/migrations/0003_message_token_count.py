@@ -0,0 +1,17 @@
+# Generated by Django 5.0.2 on 2026-10-18 14:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chat", "0002_conversation_branch_metadata"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="token_count",
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations
+
+
+def install_search_index(apps, schema_editor):
+    from chat.utils.search import install_search_index, suspend_search_index
+
+    install_search_index(schema_editor.connection)
+    # restored by the post_migrate handler of the chat app, once the later migrations are applied
+    suspend_search_index(schema_editor.connection)
+
+
+def uninstall_search_index(apps, schema_editor):
+    from chat.utils.search import uninstall_search_index
+
+    uninstall_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chat", "0003_message_token_count"),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
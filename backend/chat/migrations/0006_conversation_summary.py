@@ -0,0 +1,61 @@
+# Generated by Django 5.0.2 on 2026-10-18 15:29
+
+from django.db import migrations, models
+
+from src.utils.tokens import count_message_tokens
+
+
+def fill_summaries(apps, schema_editor):
+    """Computes the summaries of the existing conversations, the same way `chat.utils.summary.compute_summary` does."""
+    Conversation = apps.get_model("chat", "Conversation")
+    Message = apps.get_model("chat", "Message")
+    Version = apps.get_model("chat", "Version")
+    max_length = Conversation._meta.get_field("last_message_preview").max_length
+
+    for conversation in Conversation.objects.only("id", "active_version_id").iterator():
+        messages = list(
+            Message.objects.filter(version_id=conversation.active_version_id)
+            .select_related("role")
+            .order_by("created_at")
+        )
+        Conversation.objects.filter(pk=conversation.pk).update(
+            version_count=Version.objects.filter(conversation_id=conversation.pk).count(),
+            message_count=len(messages),
+            total_tokens=sum(
+                count_message_tokens(message.role.name, message.content)
+                if message.token_count is None
+                else message.token_count
+                for message in messages
+            ),
+            last_message_preview=messages[-1].content[:max_length] if messages else "",
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chat", "0005_conversation_user_modified_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="last_message_preview",
+            field=models.CharField(blank=True, default="", editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="message_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="total_tokens",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="version_count",
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name="Number of versions"),
+        ),
+        migrations.RunPython(fill_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.2 on 2026-10-18 15:56
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chat", "0008_change_log"),
+    ]
+
+    operations = [
+        # the column is the same, only Django sets it differently, so the message table is not rebuilt
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name="message",
+                    name="created_at",
+                    field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+                ),
+            ],
+        ),
+    ]
@@ -1,8 +1,19 @@
 import uuid
+from datetime import timedelta
+from functools import partial
 
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import BooleanField, Case, Count, F, Prefetch, Q, Sum, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 from authentication.models import CustomUser
+from src.utils.tokens import count_message_tokens
+
+DEFAULT_TITLE = "Mock title"
+# fields of `Conversation` maintained by `chat.utils.summary`
+SUMMARY_FIELDS = ["version_count", "message_count", "total_tokens", "last_message_preview"]
 
 
 class Role(models.Model):
@@ -12,9 +23,15 @@ class Role(models.Model):
         return self.name
 
 
+class ConversationQuerySet(models.QuerySet):
+    def with_versions(self):
+        """Prefetches versions, their messages and roles, so serializing needs a fixed number of queries."""
+        return self.prefetch_related(Prefetch("versions", queryset=Version.objects.with_serialization_fields()))
+
+
 class Conversation(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    title = models.CharField(max_length=100, blank=False, null=False, default="Mock title")
+    title = models.CharField(max_length=100, blank=False, null=False, default=DEFAULT_TITLE)
     created_at = models.DateTimeField(auto_now_add=True)
     modified_at = models.DateTimeField(auto_now=True)
     active_version = models.ForeignKey(
@@ -22,14 +39,64 @@ class Conversation(models.Model):
     )
     deleted_at = models.DateTimeField(null=True, blank=True)
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    # versions of each message and their chains, maintained by `chat.utils.branch_metadata`
+    branch_metadata = models.JSONField(null=True, blank=True, editable=False)
+    # summary of the conversation and its active version, maintained by `chat.utils.summary`
+    version_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Number of versions")
+    message_count = models.PositiveIntegerField(default=0, editable=False)
+    total_tokens = models.PositiveIntegerField(default=0, editable=False)
+    last_message_preview = models.CharField(max_length=100, blank=True, default="", editable=False)
+
+    objects = ConversationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # conversation lists of a user, newest first, paginated by `(modified_at, id)`, which leave out the soft
+            # deleted conversations
+            models.Index(
+                fields=["user", "-modified_at", "-id"],
+                condition=Q(deleted_at__isnull=True),
+                name="chat_conv_user_live_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.title
 
-    def version_count(self):
-        return self.versions.count()
-
-    version_count.short_description = "Number of versions"
+    def save(self, *args, **kwargs):
+        # the summary fields and the branch metadata are written by update queries of their own, so that saving a
+        # conversation loaded earlier, e.g. to change its title, does not overwrite them with stale values
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            excluded_fields = [*SUMMARY_FIELDS, "branch_metadata"]
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in excluded_fields
+            ]
+        super().save(*args, **kwargs)
+        _invalidate_branched_payload(self.pk)
+
+
+class VersionQuerySet(models.QuerySet):
+    def with_serialization_fields(self):
+        """Annotates `created_at` and `active` values and prefetches messages together with their roles."""
+        return self.annotate(
+            annotated_created_at=Coalesce("root_message__created_at", "conversation__created_at"),
+            annotated_active=Case(
+                When(conversation__active_version=F("pk"), then=True), default=False, output_field=BooleanField()
+            ),
+        ).prefetch_related(Prefetch("messages", queryset=Message.objects.select_related("role")))
+
+    def with_token_count(self):
+        """Annotates the `token_count` of all messages of each version, None if it is not known for some of them."""
+        return self.annotate(
+            unknown_token_counts=Count("messages", filter=Q(messages__token_count__isnull=True))
+        ).annotate(
+            token_count=Case(
+                When(unknown_token_counts=0, then=Coalesce(Sum("messages__token_count"), 0)),
+                default=None,
+            )
+        )
 
 
 class Version(models.Model):
@@ -40,6 +107,16 @@ class Version(models.Model):
         "Message", null=True, blank=True, on_delete=models.SET_NULL, related_name="root_message_versions"
     )
 
+    objects = VersionQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        _invalidate_branched_payload(self.conversation_id)
+
+    def delete(self, *args, **kwargs):
+        _invalidate_branched_payload(self.conversation_id)
+        return super().delete(*args, **kwargs)
+
     def __str__(self):
         if self.root_message:
             return f"Version of `{self.conversation.title}` created at `{self.root_message.created_at}`"
@@ -51,15 +128,109 @@ class Message(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     content = models.TextField(blank=False, null=False)
     role = models.ForeignKey(Role, on_delete=models.CASCADE)
-    created_at = models.DateTimeField(auto_now_add=True)
-    version = models.ForeignKey("Version", related_name="messages", on_delete=models.CASCADE)
+    # set when the message is created, as by `auto_now_add`, but kept when given so that messages appended in bulk are
+    # given distinct times in their order, see `Message.bulk_append`
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    # indexed together with `created_at` by `chat_msg_version_created_idx`
+    version = models.ForeignKey("Version", related_name="messages", on_delete=models.CASCADE, db_index=False)
+    # estimated prompt tokens of the message, see `src.utils.tokens`
+    token_count = models.PositiveIntegerField(null=True, blank=True, editable=False)
 
     class Meta:
         ordering = ["created_at"]
+        indexes = [
+            # messages of versions in their order, e.g. prefetched for serializing or copied up to a root message
+            models.Index(fields=["version", "created_at"], name="chat_msg_version_created_idx"),
+        ]
 
     def save(self, *args, **kwargs):
-        self.version.conversation.save()
+        self.token_count = self.count_tokens()
+        self.version.conversation.save(update_fields=["modified_at"])
+        adding = self._state.adding
         super().save(*args, **kwargs)
+        if not adding:
+            _invalidate_history(self)
+        elif self.role.name == "assistant":
+            _queue_title(self.version.conversation)
+
+    @classmethod
+    def bulk_append(cls, version: "Version", messages: list["Message"]) -> list["Message"]:
+        """
+        Appends messages to a version with a single insert, to be called in a transaction.
+
+        It does what saving each message would: counts their tokens, updates the `modified_at` of the conversation,
+        once, and queues the title of a new conversation once an answer is added. The messages are created a
+        microsecond apart, so they keep their order.
+        """
+        created_at = timezone.now()
+        for idx, message in enumerate(messages):
+            message.version = version
+            message.created_at = created_at + timedelta(microseconds=idx)
+            message.token_count = message.count_tokens()
+        version.conversation.save(update_fields=["modified_at"])
+        cls.objects.bulk_create(messages)
+        if any(message.role.name == "assistant" for message in messages):
+            _queue_title(version.conversation)
+        return messages
+
+    def delete(self, *args, **kwargs):
+        # the cached payloads and the ETags of the conversation are validated by its modification time
+        self.version.conversation.save(update_fields=["modified_at"])
+        _invalidate_history(self)
+        return super().delete(*args, **kwargs)
 
     def __str__(self):
         return f"{self.role}: {self.content[:20]}..."
+
+    def count_tokens(self) -> int:
+        return count_message_tokens(self.role.name, self.content)
+
+
+def _queue_title(conversation: Conversation) -> None:
+    """Queues the title of a conversation still having the default one once the transaction commits."""
+    if settings.CHAT_BACKGROUND_TITLES and conversation.title == DEFAULT_TITLE:
+        from chat.utils.titles import title_worker  # imports the models
+
+        transaction.on_commit(partial(title_worker.enqueue, conversation.pk))
+
+
+def _invalidate_history(message: Message) -> None:
+    from chat.utils.history import invalidate_history  # imports the models
+
+    invalidate_history(message)
+
+
+def _invalidate_branched_payload(conversation_id) -> None:
+    from chat.utils.payloads import branched_payloads  # imports the models
+
+    branched_payloads.invalidate([conversation_id])
+
+
+class Change(models.Model):
+    """
+    Entry of the log of changes of a user's conversations, versions and messages, read by the sync endpoint, see
+    `chat.utils.sync`. The ids are the change sequence: SQLite never reuses them, and runs one write transaction at a
+    time, so a change is never committed after a change with a greater id.
+    """
+
+    CONVERSATION = "conversation"
+    VERSION = "version"
+    MESSAGE = "message"
+    KINDS = [(CONVERSATION, "Conversation"), (VERSION, "Version"), (MESSAGE, "Message")]
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, db_index=False)
+    # not foreign keys, the changes outlive hard deleted objects
+    conversation_id = models.UUIDField()
+    kind = models.CharField(max_length=12, choices=KINDS)
+    object_id = models.UUIDField()
+    deleted = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # changes of a user after a cursor
+            models.Index(fields=["user", "id"], name="chat_change_user_idx"),
+        ]
+
+    def __str__(self):
+        return f"{'Deleted' if self.deleted else 'Changed'} {self.kind} {self.object_id}"
@@ -1,5 +1,6 @@
 from django.core.exceptions import ValidationError
 from django.utils import timezone
+from django.utils.encoding import smart_str
 from rest_framework import serializers
 
 from chat.models import Conversation, Message, Role, Version
@@ -19,8 +20,37 @@ class VersionTimeIdSerializer(serializers.Serializer):
     created_at = serializers.DateTimeField()
 
 
+class RoleField(serializers.SlugRelatedField):
+    """Role given by its name, taken from the `roles` of the context when they were loaded for a batch of messages."""
+
+    def __init__(self, **kwargs):
+        super().__init__(slug_field="name", queryset=Role.objects.all(), **kwargs)
+
+    def to_internal_value(self, data):
+        roles = self.context.get("roles")
+        if roles is None:
+            return super().to_internal_value(data)
+        try:
+            return roles[data]
+        except (KeyError, TypeError):
+            self.fail("does_not_exist", slug_name=self.slug_field, value=smart_str(data))
+
+
+class MessageListSerializer(serializers.ListSerializer):
+    """Validates a batch of messages looking their roles up with one query, and appends them with one insert."""
+
+    def to_internal_value(self, data):
+        self.context.setdefault("roles", {role.name: role for role in Role.objects.all()})
+        return super().to_internal_value(data)
+
+    def create(self, validated_data):
+        if not validated_data:
+            return []
+        return Message.bulk_append(validated_data[0]["version"], [Message(**attrs) for attrs in validated_data])
+
+
 class MessageSerializer(serializers.ModelSerializer):
-    role = serializers.SlugRelatedField(slug_field="name", queryset=Role.objects.all())
+    role = RoleField()
 
     class Meta:
         model = Message
@@ -31,6 +61,7 @@ class MessageSerializer(serializers.ModelSerializer):
             "created_at",  # DB, read-only
         ]
         read_only_fields = ["id", "created_at", "version"]
+        list_serializer_class = MessageListSerializer
 
     def create(self, validated_data):
         message = Message.objects.create(**validated_data)
@@ -63,10 +94,14 @@ class VersionSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def get_active(obj):
+        if hasattr(obj, "annotated_active"):
+            return obj.annotated_active
         return obj == obj.conversation.active_version
 
     @staticmethod
     def get_created_at(obj):
+        if hasattr(obj, "annotated_created_at"):
+            return timezone.localtime(obj.annotated_created_at)
         if obj.root_message is None:
             return timezone.localtime(obj.conversation.created_at)
         return timezone.localtime(obj.root_message.created_at)
@@ -133,13 +168,19 @@ class ConversationSerializer(serializers.ModelSerializer):
 
     def update(self, instance, validated_data):
         instance.title = validated_data.get("title", instance.title)
-        active_version_id = validated_data.get("active_version", instance.active_version)
-        if active_version_id is not None:
-            active_version = Version.objects.get(id=active_version_id)
+        active_version = validated_data.get("active_version", instance.active_version)
+        if active_version is not None:
             instance.active_version = active_version
         instance.save()
 
-        versions_data = validated_data.pop("versions", [])
+        validated_data.pop("versions", [])
+        # the nested serializers validate the versions as they were sent, the ids of the versions are read-only
+        versions_data = self.initial_data.get("versions", [])
+        if versions_data:
+            # `save` leaves the branch metadata out, it is rebuilt on the next write, see `chat.utils.branch_metadata`
+            instance.branch_metadata = None
+            Conversation.objects.filter(pk=instance.pk).update(branch_metadata=None)
+
         for version_data in versions_data:
             if "id" in version_data:
                 version = Version.objects.get(id=version_data["id"], conversation=instance)
@@ -150,3 +191,60 @@ class ConversationSerializer(serializers.ModelSerializer):
                 version_serializer.save(conversation=instance)
 
         return instance
+
+
+class ConversationSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Conversation
+        fields = [
+            "id",  # DB
+            "title",
+            "modified_at",  # DB, read-only
+            # DB, read-only, see `chat.utils.summary`
+            "version_count",
+            "message_count",
+            "total_tokens",
+            "last_message_preview",
+        ]
+
+
+class SyncConversationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Conversation
+        fields = [
+            "id",  # DB
+            "title",
+            "active_version",
+            "created_at",  # DB, read-only
+            "modified_at",  # DB, read-only
+            # DB, read-only, see `chat.utils.summary`
+            "version_count",
+            "message_count",
+            "total_tokens",
+            "last_message_preview",
+        ]
+
+
+class SyncVersionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Version
+        fields = [
+            "id",  # DB
+            "conversation",
+            "parent_version",
+            "root_message",
+        ]
+
+
+class SyncMessageSerializer(serializers.ModelSerializer):
+    role = serializers.SlugRelatedField(slug_field="name", read_only=True)
+
+    class Meta:
+        model = Message
+        fields = [
+            "id",  # DB
+            "version",
+            "role",
+            "content",
+            "created_at",  # DB, read-only
+        ]
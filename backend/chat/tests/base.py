@@ -0,0 +1,51 @@
+import json
+
+from django.urls import reverse
+from rest_framework import status
+
+from authentication.models import CustomUser
+from chat.models import Conversation, Role
+
+# session and user lookups done by the authentication middleware on every request
+AUTH_QUERIES = 2
+# lookup of the ETag and Last-Modified validators of the conditional reads
+VALIDATOR_QUERIES = 1
+
+
+class ChatTestMixin:
+    """
+    Creates the `user` and `assistant` roles together with `mock_user`, who is logged in, and makes requests to the chat
+    endpoints. Test cases without `setUpTestData`, as `TransactionTestCase`, call `_create_roles_and_user` in `setUp`
+    before calling `super().setUp()`.
+    """
+
+    @classmethod
+    def _create_roles_and_user(cls):
+        cls.user_role = Role.objects.create(name="user")
+        cls.assistant_role = Role.objects.create(name="assistant")
+        cls.mock_user = CustomUser.objects.create(email="mock@email.com", is_active=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls._create_roles_and_user()
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.mock_user)
+
+    def _request(self, method, url, data=None, expected_status=status.HTTP_201_CREATED):
+        response = getattr(self.client, method)(url, data=json.dumps(data), content_type="application/json")
+        self.assertEqual(response.status_code, expected_status)
+        return response.data
+
+    def _post(self, url, data, expected_status=status.HTTP_201_CREATED):
+        return self._request("post", url, data, expected_status)
+
+    def _create_conversation(self, *contents):
+        """Creates a conversation of messages with the given contents, asked and answered in turns."""
+        messages = [
+            {"role": ["user", "assistant"][idx % 2], "content": content} for idx, content in enumerate(contents)
+        ]
+        data = self._post(reverse("add_conversation"), {"messages": messages})
+        return Conversation.objects.get(pk=data["id"])
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.test import TestCase, TransactionTestCase
+
+from authentication.models import CustomUser
+from chat.models import Conversation, Message, Role, Version
+from chat.utils.answers import AnswerWriter, StreamedAnswer, answer_writer
+from chat.utils.summary import compute_summary, get_summary, refresh_summary
+from chat.utils.sync import get_changes
+from src.utils.cache import completion_cache
+from src.utils.stub_openai import StubOpenAIServer
+
+
+class AnswersMixin:
+    def _create_conversation(self, user):
+        conversation = Conversation.objects.create(title="Test title", user=user)
+        version = Version.objects.create(conversation=conversation)
+        Message.objects.create(version=version, role=Role.objects.get(name="user"), content="Hi what up?")
+        conversation.active_version = version
+        conversation.save()
+        refresh_summary(conversation)
+        return conversation
+
+    def _contents(self, conversation):
+        return [message.content for message in Message.objects.filter(version_id=conversation.active_version_id)]
+
+
+class StreamedAnswerTests(AnswersMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Role.objects.create(name="user")
+        Role.objects.create(name="assistant")
+        cls.mock_user = CustomUser.objects.create(email="mock@email.com", is_active=True)
+
+    def setUp(self):
+        self.conversation = self._create_conversation(self.mock_user)
+        self.writer = AnswerWriter()
+
+    def _assert_summary(self):
+        self.conversation.refresh_from_db()
+        self.assertEqual(get_summary(self.conversation), compute_summary(self.conversation))
+
+    def test_flush_interval(self):
+        now = [0.0]
+        answer = StreamedAnswer(self.conversation.active_version_id, flush_interval=2, clock=lambda: now[0])
+        self.assertFalse(answer.append("Hello"))
+        now[0] = 2.5
+        self.assertTrue(answer.append(" there"))
+        self.assertEqual(answer.content, "Hello there")
+
+        answer = StreamedAnswer(self.conversation.active_version_id, flush_interval=0, clock=lambda: now[0])
+        now[0] = 100
+        self.assertFalse(answer.append("Hello"))
+
+    def test_first_write_creates_and_next_ones_update(self):
+        cursor = int(get_changes(self.mock_user, 0, 100)["cursor"])
+        answer = StreamedAnswer(self.conversation.active_version_id, question="Tell me a joke")
+        self.assertIsNone(self.writer.write(answer))
+
+        answer.append("Why did")
+        message = self.writer.write(answer)
+        self.assertEqual(message.pk, answer.message_id)
+        self.assertEqual(self._contents(self.conversation), ["Hi what up?", "Tell me a joke", "Why did"])
+        self._assert_summary()
+        self.assertEqual(len(get_changes(self.mock_user, cursor, 100)["messages"]), 2)
+
+        cursor = int(get_changes(self.mock_user, cursor, 100)["cursor"])
+        modified_at = Conversation.objects.get(pk=self.conversation.pk).modified_at
+        answer.append(" the chicken")
+        self.assertIsNone(self.writer.write(answer))
+        self.assertEqual(self._contents(self.conversation), ["Hi what up?", "Tell me a joke", "Why did the chicken"])
+        # intermediate writes update the content alone
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.modified_at, modified_at)
+        self.assertEqual(self.conversation.last_message_preview, "Why did")
+        self.assertEqual(get_changes(self.mock_user, cursor, 100)["messages"], [])
+
+        answer.append(" cross")
+        answer.finished = True
+        message = self.writer.write(answer)
+        self.assertEqual(self._contents(self.conversation)[-1], "Why did the chicken cross")
+        self._assert_summary()
+        self.assertGreater(self.conversation.modified_at, modified_at)
+        self.assertEqual(self.conversation.last_message_preview, "Why did the chicken cross")
+        self.assertEqual(len(get_changes(self.mock_user, cursor, 100)["messages"]), 1)
+        self.assertEqual(message.token_count, message.count_tokens())
+
+    def test_question_is_stored_without_answer_once_finished(self):
+        answer = StreamedAnswer(self.conversation.active_version_id, question="Tell me a joke")
+        answer.finished = True
+        self.assertIsNone(self.writer.write(answer))
+        self.assertEqual(self._contents(self.conversation), ["Hi what up?", "Tell me a joke"])
+        self.assertFalse(Message.objects.filter(pk=answer.message_id).exists())
+
+    def test_missing_version(self):
+        answer = StreamedAnswer(uuid.uuid4())
+        answer.append("Hello")
+        self.assertIsNone(self.writer.write(answer))
+
+
+class PersistedStreamsTests(AnswersMixin, TransactionTestCase):
+    # the writer thread reads from the replica alias of the production database profile
+    databases = "__all__"
+
+    def setUp(self):
+        completion_cache.clear()
+        Role.objects.create(name="user")
+        Role.objects.create(name="assistant")
+        self.user = CustomUser.objects.create(email="mock@email.com", is_active=True)
+        self.conversation = self._create_conversation(self.user)
+        self.async_client.force_login(self.user)
+
+    async def _post(self, path, data):
+        return await self.async_client.post(path, data=json.dumps(data), content_type="application/json")
+
+    async def _contents_after_writes(self):
+        self.assertTrue(await sync_to_async(answer_writer.wait)(10))
+        return await sync_to_async(self._contents)(self.conversation)
+
+    async def test_conversation_by_id_stores_question_and_answer(self):
+        async with StubOpenAIServer(chunks_count=5) as upstream:
+            response = await self._post(
+                f"/gpt/conversation/{self.conversation.id}/",
+                {"message": "Tell me a joke", "model": "gpt35", "persist": True},
+            )
+            content = b"".join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(content, upstream.content)
+        self.assertEqual(await self._contents_after_writes(), ["Hi what up?", "Tell me a joke", upstream.content])
+        message = await Message.objects.aget(pk=response.headers["X-Message-Id"])
+        self.assertEqual(message.content, upstream.content)
+
+    async def test_conversation_stores_answer(self):
+        conversation = [{"role": "user", "content": "Hi what up?"}]
+        async with StubOpenAIServer(chunks_count=5) as upstream:
+            response = await self._post(
+                "/gpt/conversation/",
+                {
+                    "conversation": conversation,
+                    "model": "gpt4",
+                    "persist": True,
+                    "conversation_id": str(self.conversation.id),
+                },
+            )
+            b"".join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(await self._contents_after_writes(), ["Hi what up?", upstream.content])
+
+        response = await self._post(
+            "/gpt/conversation/",
+            {"conversation": conversation, "model": "gpt4", "persist": True, "conversation_id": "x"},
+        )
+        self.assertEqual(response.status_code, 404)
+
+    async def test_answer_is_stored_when_client_goes_away(self):
+        async def read_first_chunk(streaming_content, received):
+            async for chunk in streaming_content:
+                received.set()
+
+        async with StubOpenAIServer(chunks_count=50, chunk_delay=0.05):
+            response = await self._post(
+                f"/gpt/conversation/{self.conversation.id}/", {"model": "gpt35", "persist": True}
+            )
+            received = asyncio.Event()
+            task = asyncio.create_task(read_first_chunk(response.streaming_content, received))
+            await received.wait()
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        contents = await self._contents_after_writes()
+        self.assertEqual(len(contents), 2)
+        self.assertTrue(0 < len(contents[1]) < len("Lorem ipsum " * 50))
@@ -0,0 +1,147 @@
+import copy
+import json
+import random
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from chat.models import Conversation
+from chat.serializers import ConversationSerializer
+from chat.tests.base import ChatTestMixin
+from chat.utils.branch_metadata import merge_branch_metadata
+from chat.utils.branching import make_branched_conversation
+
+
+class BranchMetadataTests(ChatTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.rng = random.Random(0)
+
+    def _message(self, role="user"):
+        return {"role": role, "content": f"Message {self.rng.getrandbits(32)}"}
+
+    def _create_conversation(self):
+        return super()._create_conversation(self._message()["content"], self._message("assistant")["content"])
+
+    def _expected_and_merged(self, conversation):
+        conversation.refresh_from_db()
+        return self._expected_and_merged_with(conversation)
+
+    def _expected_and_merged_with(self, conversation):
+        conversation_data = ConversationSerializer(Conversation.objects.with_versions().get(pk=conversation.pk)).data
+        expected_data = copy.deepcopy(conversation_data)
+        make_branched_conversation(expected_data)
+        merge_branch_metadata(conversation_data, conversation.branch_metadata)
+        return json.dumps(expected_data, default=str), json.dumps(conversation_data, default=str)
+
+    def _run_random_writes(self, conversation, writes_count):
+        for _ in range(writes_count):
+            conversation.refresh_from_db()
+            active_messages = list(conversation.active_version.messages.all())
+            operation = self.rng.choice(["add_message", "add_version", "add_version", "switch_version"])
+            if operation == "add_message" or not active_messages:
+                url = reverse("conversation_add_message", kwargs={"pk": conversation.id})
+                self._post(url, self._message(self.rng.choice(["user", "assistant"])))
+            elif operation == "add_version":
+                root_message = self.rng.choice(active_messages)
+                url = reverse("conversation_add_version", kwargs={"pk": conversation.id})
+                version_data = self._post(url, {"root_message_id": str(root_message.id)})
+                for _ in range(self.rng.randint(0, 2)):
+                    self._post(reverse("version_add_message", kwargs={"pk": version_data["id"]}), self._message())
+            else:
+                version = self.rng.choice(list(conversation.versions.all()))
+                url = reverse("conversation_switch_version", kwargs={"pk": conversation.id, "version_id": version.id})
+                self.client.put(url)
+
+            self.assertIsNotNone(Conversation.objects.get(pk=conversation.pk).branch_metadata)
+            expected, merged = self._expected_and_merged(conversation)
+            self.assertEqual(merged, expected)
+
+    def test_incremental_updates_match_make_branched_conversation(self):
+        for _ in range(3):
+            self._run_random_writes(self._create_conversation(), 15)
+
+    def test_branched_endpoints_use_stored_metadata(self):
+        conversation = self._create_conversation()
+        self._run_random_writes(conversation, 8)
+        expected, _ = self._expected_and_merged(conversation)
+
+        response = self.client.get(reverse("get_branched_conversation", kwargs={"pk": conversation.id}))
+        self.assertEqual(json.dumps(response.data, default=str), expected)
+        response = self.client.get(reverse("get_branched_conversations"))
+        self.assertEqual(json.dumps(response.data[0], default=str), expected)
+
+    def test_missing_metadata_falls_back_and_is_rebuilt_on_write(self):
+        conversation = self._create_conversation()
+        self._run_random_writes(conversation, 4)
+        Conversation.objects.filter(pk=conversation.pk).update(branch_metadata=None)
+
+        expected, merged = self._expected_and_merged(conversation)
+        self.assertEqual(merged, expected)
+
+        self._run_random_writes(conversation, 4)
+
+    def test_saving_conversation_loaded_earlier_keeps_metadata(self):
+        conversation = self._create_conversation()
+        stale_conversation = Conversation.objects.get(pk=conversation.pk)
+        root_message = conversation.active_version.messages.last()
+        url = reverse("conversation_add_version", kwargs={"pk": conversation.id})
+        version_data = self._post(url, {"root_message_id": str(root_message.id)})
+
+        stale_conversation.save()
+        conversation.refresh_from_db()
+        self.assertIn(str(version_data["id"]), conversation.branch_metadata["versions"])
+
+    def test_put_versions_clears_metadata(self):
+        conversation = self._create_conversation()
+        root_message = conversation.active_version.messages.last()
+        url = reverse("conversation_add_version", kwargs={"pk": conversation.id})
+        version_data = self._post(url, {"root_message_id": str(root_message.id)})
+        stored_metadata = Conversation.objects.get(pk=conversation.pk).branch_metadata
+
+        # the answer of the new version moves its branching row, the versions stay the same
+        version_data["messages"] = [self._message("assistant")]
+        response = self.client.put(
+            reverse("conversation_manage", kwargs={"pk": conversation.id}),
+            data=json.dumps({"title": "Title", "versions": [version_data]}, default=str),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(conversation.versions.get(pk=version_data["id"]).messages.count(), 2)
+        self.assertIsNone(Conversation.objects.get(pk=conversation.pk).branch_metadata)
+
+        expected, _ = self._expected_and_merged(conversation)
+        conversation.branch_metadata = stored_metadata
+        _, stale = self._expected_and_merged_with(conversation)
+        self.assertNotEqual(stale, expected)
+        response = self.client.get(reverse("get_branched_conversation", kwargs={"pk": conversation.id}))
+        self.assertEqual(json.dumps(response.data, default=str), expected)
+
+    def test_backfill_command(self):
+        conversation = self._create_conversation()
+        self._run_random_writes(conversation, 6)
+        stored_metadata = Conversation.objects.get(pk=conversation.pk).branch_metadata
+        Conversation.objects.filter(pk=conversation.pk).update(branch_metadata=None)
+
+        call_command("backfill_branch_metadata", stdout=StringIO())
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.branch_metadata, stored_metadata)
+        call_command("backfill_branch_metadata", "--verify", stdout=StringIO())
+
+    def test_verify_command_detects_stale_metadata(self):
+        conversation = self._create_conversation()
+        root_message = conversation.active_version.messages.first()
+        url = reverse("conversation_add_version", kwargs={"pk": conversation.id})
+        version_data = self._post(url, {"root_message_id": str(root_message.id)})
+        self._post(reverse("version_add_message", kwargs={"pk": version_data["id"]}), self._message())
+        conversation.refresh_from_db()
+        metadata = conversation.branch_metadata
+        self.assertTrue(metadata["rows"])
+        metadata["rows"] = {}
+        Conversation.objects.filter(pk=conversation.pk).update(branch_metadata=metadata)
+
+        with self.assertRaises(CommandError):
+            call_command("backfill_branch_metadata", "--verify", stdout=StringIO())
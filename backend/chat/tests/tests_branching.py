@@ -0,0 +1,75 @@
+import copy
+import json
+
+from django.test import SimpleTestCase
+
+from chat.utils import legacy_branching
+from chat.utils.branching import make_branched_conversation
+from chat.utils.synthetic import make_synthetic_conversation_data
+
+
+def _versions_ids(conversation_data):
+    return [
+        [[v["id"] for v in message["versions"]] for message in version["messages"]]
+        for version in conversation_data["versions"]
+    ]
+
+
+class MakeBranchedConversationTests(SimpleTestCase):
+    def _branch(self, function, conversation_data, calculate_chains=True):
+        conversation_data = copy.deepcopy(conversation_data)
+        function(conversation_data, calculate_chains=calculate_chains)
+        return conversation_data
+
+    def test_matches_legacy_implementation(self):
+        for versions_count in [1, 2, 5, 20, 100]:
+            for seed in range(5):
+                conversation_data = make_synthetic_conversation_data(versions_count, unique_roots=True, seed=seed)
+                for calculate_chains in [True, False]:
+                    with self.subTest(versions_count=versions_count, seed=seed, calculate_chains=calculate_chains):
+                        expected = self._branch(
+                            legacy_branching.make_branched_conversation, conversation_data, calculate_chains
+                        )
+                        result = self._branch(make_branched_conversation, conversation_data, calculate_chains)
+                        self.assertEqual(json.dumps(result, default=str), json.dumps(expected, default=str))
+
+    def test_matches_legacy_versions_with_shared_root_messages(self):
+        # the legacy chain order depends on set iteration order here, so only the versions of each message are compared
+        for seed in range(10):
+            conversation_data = make_synthetic_conversation_data(30, seed=seed)
+            with self.subTest(seed=seed):
+                expected = self._branch(legacy_branching.make_branched_conversation, conversation_data)
+                result = self._branch(make_branched_conversation, conversation_data)
+                self.assertEqual(
+                    [[sorted(ids) for ids in version] for version in _versions_ids(result)],
+                    [[sorted(ids) for ids in version] for version in _versions_ids(expected)],
+                )
+
+    def test_chains_of_versions_sharing_root_message_are_ordered_by_time(self):
+        conversation_data = make_synthetic_conversation_data(1, messages_count=2)
+        first_version = conversation_data["versions"][0]
+        root_message = first_version["messages"][0]
+        for created_at_offset in range(2):
+            version = copy.deepcopy(first_version)
+            version["id"] = f"00000000-0000-0000-0000-00000000000{created_at_offset}"
+            version["parent_version"] = first_version["id"]
+            version["root_message"] = root_message["id"]
+            version["created_at"] = version["created_at"].replace(minute=created_at_offset + 1)
+            version["messages"] = [{**root_message, "id": f"{version['id']}-m", "content": "Edited", "versions": []}]
+            conversation_data["versions"].append(version)
+
+        result = self._branch(make_branched_conversation, conversation_data)
+        version_ids = [version["id"] for version in conversation_data["versions"]]
+        for version_ids_of_message in [version[0] for version in _versions_ids(result)]:
+            self.assertEqual(version_ids_of_message, version_ids)
+
+    def test_content_mismatch_raises(self):
+        conversation_data = make_synthetic_conversation_data(2, unique_roots=True, seed=1)
+        child_version = conversation_data["versions"][1]
+        if len(child_version["messages"]) < 3:
+            child_version["messages"] = copy.deepcopy(conversation_data["versions"][0]["messages"])
+        child_version["root_message"] = conversation_data["versions"][0]["messages"][-1]["id"]
+        child_version["messages"][0]["content"] = "Changed"
+
+        with self.assertRaises(Exception):
+            make_branched_conversation(conversation_data)
@@ -0,0 +1,109 @@
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from authentication.models import CustomUser
+from chat.models import Conversation, Message
+from chat.tests.base import ChatTestMixin
+from chat.utils.summary import compute_summary, get_summary
+from chat.utils.sync import get_changes
+from chat.utils.titles import title_worker
+from chat.views import ADD_MESSAGES_MAX_BATCH
+
+
+class BulkMessagesTests(ChatTestMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other_user = CustomUser.objects.create(email="other@email.com", is_active=True)
+
+    @staticmethod
+    def _messages(count, prefix="Message"):
+        return [{"role": ["user", "assistant"][idx % 2], "content": f"{prefix} {idx}"} for idx in range(count)]
+
+    def _add_messages(self, conversation, messages, expected_status=status.HTTP_201_CREATED):
+        url = reverse("conversation_add_messages", kwargs={"pk": conversation.id})
+        return self._post(url, {"messages": messages}, expected_status)
+
+    def _count_queries(self, url, data):
+        with CaptureQueriesContext(connection) as queries:
+            self._post(url, data)
+        return len(queries)
+
+    def test_add_messages(self):
+        conversation = self._create_conversation("Message 0", "Message 1")
+        cursor = get_changes(self.mock_user, 0, 100)["cursor"]
+        data = self._add_messages(conversation, self._messages(5, "Added"))
+        self.assertEqual([message["content"] for message in data["messages"]], [f"Added {idx}" for idx in range(5)])
+
+        messages = list(conversation.active_version.messages.all())
+        self.assertEqual([message.content for message in messages[2:]], [f"Added {idx}" for idx in range(5)])
+        self.assertEqual(len({message.created_at for message in messages}), 7)
+        self.assertTrue(all(message.token_count == message.count_tokens() for message in messages))
+
+        conversation.refresh_from_db()
+        self.assertEqual(get_summary(conversation), compute_summary(conversation))
+        self.assertEqual(conversation.message_count, 7)
+        self.assertEqual(conversation.last_message_preview, "Added 4")
+        page = get_changes(self.mock_user, int(cursor), 100)
+        self.assertEqual(sorted(page["deleted"]["messages"]), [])
+        self.assertEqual(len(page["messages"]), 5)
+
+        response = self.client.get(reverse("get_branched_conversation", kwargs={"pk": conversation.id}))
+        self.assertEqual(len(response.data["versions"][0]["messages"]), 7)
+
+    def test_queries_do_not_grow_with_messages(self):
+        conversation = self._create_conversation("Message 0", "Message 1")
+        url = reverse("conversation_add_messages", kwargs={"pk": conversation.id})
+        self.assertEqual(
+            self._count_queries(url, {"messages": self._messages(1)}),
+            self._count_queries(url, {"messages": self._messages(50)}),
+        )
+        url = reverse("add_conversation")
+        self.assertEqual(
+            self._count_queries(url, {"messages": self._messages(1)}),
+            self._count_queries(url, {"messages": self._messages(50)}),
+        )
+
+    def test_invalid_batch_writes_nothing(self):
+        conversation = self._create_conversation("Message 0", "Message 1")
+        messages = self._messages(3) + [{"role": "unknown", "content": "Invalid"}]
+        errors = self._add_messages(conversation, messages, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("role", errors[3])
+        self.assertEqual(Message.objects.filter(version__conversation=conversation).count(), 2)
+
+        conversations_count = Conversation.objects.count()
+        messages = self._messages(2) + [{"role": "user", "content": ""}]
+        errors = self._post(reverse("add_conversation"), {"messages": messages}, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("content", errors[2])
+        self.assertEqual(Conversation.objects.count(), conversations_count)
+
+    def test_invalid_requests(self):
+        conversation = self._create_conversation("Message 0", "Message 1")
+        for messages in [
+            [],
+            None,
+            {"role": "user", "content": "Not a list"},
+            self._messages(ADD_MESSAGES_MAX_BATCH + 1),
+        ]:
+            self._add_messages(conversation, messages, status.HTTP_400_BAD_REQUEST)
+
+        self.client.force_login(self.other_user)
+        self._add_messages(conversation, self._messages(1), status.HTTP_404_NOT_FOUND)
+
+    @override_settings(CHAT_BACKGROUND_TITLES=True)
+    def test_answers_queue_title_once(self):
+        def title_callbacks(callbacks):
+            return [callback for callback in callbacks if getattr(callback, "func", None) == title_worker.enqueue]
+
+        conversation = self._create_conversation("Message 0")
+        with self.captureOnCommitCallbacks() as callbacks:
+            self._add_messages(conversation, self._messages(4))
+        self.assertEqual(len(title_callbacks(callbacks)), 1)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self._add_messages(conversation, [{"role": "user", "content": "Question"}])
+        self.assertEqual(title_callbacks(callbacks), [])
@@ -0,0 +1,90 @@
+from datetime import timedelta
+
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from authentication.models import CustomUser
+from chat.models import Conversation
+from chat.tests.base import AUTH_QUERIES, VALIDATOR_QUERIES, ChatTestMixin
+
+
+class ConditionalGetTests(ChatTestMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other_user = CustomUser.objects.create(email="other@email.com", is_active=True)
+
+    def _assert_not_modified(self, url, **headers):
+        # the validator lookup is the only query besides the authentication ones
+        with self.assertNumQueries(AUTH_QUERIES + VALIDATOR_QUERIES):
+            response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b"")
+
+    def test_conversation(self):
+        conversation = self._create_conversation("Question")
+        for url in [
+            reverse("conversation_manage", kwargs={"pk": conversation.id}),
+            reverse("get_branched_conversation", kwargs={"pk": conversation.id}),
+        ]:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            etag = response.headers["ETag"]
+            self._assert_not_modified(url, **{"If-None-Match": etag})
+            self._assert_not_modified(url, **{"If-Modified-Since": response.headers["Last-Modified"]})
+
+            self._post(
+                reverse("conversation_add_message", kwargs={"pk": conversation.id}), {"role": "user", "content": "More"}
+            )
+            response = self.client.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_stale_last_modified(self):
+        conversation = self._create_conversation("Question")
+        url = reverse("conversation_manage", kwargs={"pk": conversation.id})
+        if_modified_since = http_date((timezone.now() - timedelta(minutes=1)).timestamp())
+        response = self.client.get(url, headers={"If-Modified-Since": if_modified_since})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_missing_conversation(self):
+        conversation = self._create_conversation("Question")
+        self.client.force_login(self.other_user)
+        url = reverse("conversation_manage", kwargs={"pk": conversation.id})
+        response = self.client.get(url, headers={"If-None-Match": "*"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertNotIn("ETag", response.headers)
+
+    def test_conversations(self):
+        conversation = self._create_conversation("Question")
+        self._create_conversation("Question")
+        for url in [reverse("get_conversations"), reverse("get_branched_conversations")]:
+            etag = self.client.get(url).headers["ETag"]
+            self._assert_not_modified(url, **{"If-None-Match": etag})
+
+            # a conversation of another user does not change the list
+            self.client.force_login(self.other_user)
+            self._create_conversation("Question")
+            self.client.force_login(self.mock_user)
+            self._assert_not_modified(url, **{"If-None-Match": etag})
+
+            self._create_conversation("Question")
+            response = self.client.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            etag = response.headers["ETag"]
+
+            # taken out of the list without a later modification
+            Conversation.objects.filter(pk=conversation.pk).update(deleted_at=timezone.now())
+            response = self.client.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            Conversation.objects.filter(pk=conversation.pk).update(deleted_at=None)
+
+    def test_writes_are_not_conditional(self):
+        conversation = self._create_conversation("Question")
+        url = reverse("conversation_manage", kwargs={"pk": conversation.id})
+        etag = self.client.get(url).headers["ETag"]
+        response = self.client.delete(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,69 @@
+import sqlite3
+import tempfile
+from pathlib import Path
+
+from django.db import OperationalError, transaction
+from django.db.utils import ConnectionHandler
+from django.test import SimpleTestCase
+
+from backend.sqlite import REPLICA, WRITER, sqlite_databases
+from backend.sqlite.router import ReplicaRouter
+
+
+class TunedSQLiteTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "db.sqlite3"
+        self.connections = ConnectionHandler(sqlite_databases(self.path, "production"))
+        self.addCleanup(self.connections.close_all)
+        with self.connections[WRITER].cursor() as cursor:
+            cursor.execute("CREATE TABLE item (id INTEGER PRIMARY KEY)")
+
+    def _fetch(self, alias, sql):
+        with self.connections[alias].cursor() as cursor:
+            cursor.execute(sql)
+            return cursor.fetchone()[0]
+
+    def test_pragmas(self):
+        for alias in (WRITER, REPLICA):
+            self.assertEqual(self._fetch(alias, "PRAGMA journal_mode"), "wal")
+            self.assertEqual(self._fetch(alias, "PRAGMA synchronous"), 1)
+            self.assertEqual(self._fetch(alias, "PRAGMA busy_timeout"), 5000)
+        self.assertEqual(self._fetch(WRITER, "PRAGMA query_only"), 0)
+        self.assertEqual(self._fetch(REPLICA, "PRAGMA query_only"), 1)
+        with self.assertRaises(OperationalError):
+            self._fetch(REPLICA, "INSERT INTO item VALUES (1) RETURNING id")
+
+    def test_writer_transactions_take_the_lock_and_do_not_block_reads(self):
+        writer = self.connections[WRITER]
+        # what `transaction.atomic` does on SQLite
+        writer.set_autocommit(False, force_begin_transaction_with_broken_autocommit=True)
+        self.assertEqual(self._fetch(WRITER, "SELECT COUNT(*) FROM item"), 0)
+        # the write lock is taken when the transaction begins, not by its first write, so other writers wait for it
+        # instead of a transaction which has read failing to get it
+        other_writer = sqlite3.connect(self.path, timeout=0, isolation_level=None)
+        self.addCleanup(other_writer.close)
+        with self.assertRaisesMessage(sqlite3.OperationalError, "database is locked"):
+            other_writer.execute("BEGIN IMMEDIATE")
+        self._fetch(WRITER, "INSERT INTO item VALUES (1) RETURNING id")
+        self.assertEqual(self._fetch(REPLICA, "SELECT COUNT(*) FROM item"), 0)
+        writer.commit()
+        writer.set_autocommit(True)
+        self.assertEqual(self._fetch(REPLICA, "SELECT COUNT(*) FROM item"), 1)
+
+    def test_unknown_profile(self):
+        with self.assertRaises(ValueError):
+            sqlite_databases(self.path, "staging")
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    databases = {"default"}
+
+    def test_reads_within_transactions_stay_on_writer(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(None), REPLICA)
+        self.assertEqual(router.db_for_write(None), WRITER)
+        with transaction.atomic():
+            self.assertEqual(router.db_for_read(None), WRITER)
+        self.assertFalse(router.allow_migrate(REPLICA, "chat"))
@@ -0,0 +1,81 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from authentication.models import CustomUser
+from chat.models import Conversation, Message, Role, Version
+from chat.utils.history import get_conversation_history
+
+
+class ConversationHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user_role = Role.objects.create(name="user")
+        cls.assistant_role = Role.objects.create(name="assistant")
+        cls.mock_user = CustomUser.objects.create(email="mock@email.com", is_active=True)
+
+    def setUp(self):
+        cache.clear()
+        self.conversation = Conversation.objects.create(title="Test title", user=self.mock_user)
+        self.version = Version.objects.create(conversation=self.conversation)
+        self.messages = [self._add_message(self.version, f"Message {idx}") for idx in range(4)]
+        self.conversation.active_version = self.version
+        self.conversation.save()
+
+    def _add_message(self, version, content):
+        role = [self.user_role, self.assistant_role][version.messages.count() % 2]
+        return Message.objects.create(version=version, role=role, content=content)
+
+    def _history(self):
+        return get_conversation_history(
+            Conversation.objects.select_related("active_version").get(pk=self.conversation.pk)
+        )
+
+    def test_history_of_active_version(self):
+        self.assertEqual(
+            self._history(),
+            [{"role": ["user", "assistant"][idx % 2], "content": f"Message {idx}"} for idx in range(4)],
+        )
+
+    def test_cached_history_is_extended_with_new_messages(self):
+        self._history()
+        conversation = Conversation.objects.select_related("active_version").get(pk=self.conversation.pk)
+        with self.assertNumQueries(1):
+            get_conversation_history(conversation)
+
+        self._add_message(self.version, "Message 4")
+        conversation = Conversation.objects.select_related("active_version").get(pk=self.conversation.pk)
+        with self.assertNumQueries(1):
+            history = get_conversation_history(conversation)
+        self.assertEqual([message["content"] for message in history], [f"Message {idx}" for idx in range(5)])
+
+    def test_history_of_other_versions_is_not_loaded(self):
+        other_version = Version.objects.create(conversation=self.conversation)
+        self._add_message(other_version, "Other")
+        self.assertNotIn("Other", [message["content"] for message in self._history()])
+
+    def test_deleted_message_clears_cached_history(self):
+        self._history()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.messages[3].delete()
+        self._add_message(self.version, "New")
+        self.assertEqual(
+            [message["content"] for message in self._history()], ["Message 0", "Message 1", "Message 2", "New"]
+        )
+
+    def test_edited_message_clears_cached_history(self):
+        self._history()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.messages[1].content = "Edited"
+            self.messages[1].save()
+        self.assertEqual(self._history()[1]["content"], "Edited")
+
+    def test_edited_message_not_cached_yet_keeps_cached_history(self):
+        self._history()
+        answer = self._add_message(self.version, "Partial")
+        with self.captureOnCommitCallbacks(execute=True):
+            answer.content = "Answer"
+            answer.save()
+        conversation = Conversation.objects.select_related("active_version").get(pk=self.conversation.pk)
+        with self.assertNumQueries(1):
+            history = get_conversation_history(conversation)
+        self.assertEqual(history[-1]["content"], "Answer")
@@ -0,0 +1,113 @@
+import tempfile
+
+from django.core.management import call_command
+from django.db import transaction
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from chat.models import Message
+from chat.tests.base import AUTH_QUERIES, VALIDATOR_QUERIES, ChatTestMixin
+from chat.utils.payloads import branched_payloads
+
+
+class BranchedPayloadCacheTests(ChatTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        branched_payloads.clear()
+        branched_payloads.reset_stats()
+
+    def _get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_list_is_assembled_from_cached_payloads(self):
+        conversations = [self._create_conversation(f"Question {idx}", "Answer") for idx in range(3)]
+        url = reverse("get_branched_conversations")
+        payloads = self._get(url)
+        self.assertEqual(branched_payloads.stats()["misses"], 3)
+
+        # only the conversations are listed, their versions and messages are not loaded
+        with self.assertNumQueries(AUTH_QUERIES + VALIDATOR_QUERIES + 1):
+            self.assertEqual(self._get(url), payloads)
+        self.assertEqual(branched_payloads.stats()["hits"], 3)
+
+        # the single conversation endpoint shares the payloads
+        payload = self._get(reverse("get_branched_conversation", kwargs={"pk": conversations[0].id}))
+        self.assertEqual(payload, next(item for item in payloads if item["id"] == str(conversations[0].id)))
+        self.assertEqual(branched_payloads.stats()["hits"], 4)
+
+    def test_changed_conversation_is_rebuilt(self):
+        conversation = self._create_conversation("Question", "Answer")
+        self._create_conversation("Other question")
+        url = reverse("get_branched_conversations")
+        self._get(url)
+
+        self._post(
+            reverse("conversation_add_message", kwargs={"pk": conversation.id}), {"role": "user", "content": "More"}
+        )
+        payloads = self._get(url)
+        self.assertEqual([message["content"] for message in payloads[0]["versions"][0]["messages"]][-1], "More")
+        self.assertEqual(branched_payloads.stats()["misses"], 3)
+        self.assertEqual(branched_payloads.stats()["hits"], 1)
+
+    def test_writes_drop_payloads_on_commit(self):
+        conversation = self._create_conversation("Question", "Answer")
+        self._get(reverse("get_branched_conversation", kwargs={"pk": conversation.id}))
+        self.assertEqual(len(branched_payloads.cache.get_many([f"chat:branched:{conversation.id}"])), 1)
+
+        url = reverse("conversation_add_message", kwargs={"pk": conversation.id})
+        with self.captureOnCommitCallbacks(execute=True):
+            self._post(url, {"role": "user", "content": "More"})
+        self.assertEqual(branched_payloads.cache.get_many([f"chat:branched:{conversation.id}"]), {})
+        # the message, the conversation and the summary are saved by one transaction, which drops the payload once
+        self.assertEqual(branched_payloads.stats()["invalidations"], 1)
+
+        self._get(reverse("get_branched_conversation", kwargs={"pk": conversation.id}))
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.filter(version__conversation=conversation).last().delete()
+        payload = self._get(reverse("get_branched_conversation", kwargs={"pk": conversation.id}))
+        self.assertEqual([message["content"] for message in payload["versions"][0]["messages"]], ["Question", "Answer"])
+
+    def test_rolled_back_writes_keep_payloads(self):
+        conversation = self._create_conversation("Question")
+        self._get(reverse("get_branched_conversation", kwargs={"pk": conversation.id}))
+        key = f"chat:branched:{conversation.id}"
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                branched_payloads.invalidate([conversation.id])
+                transaction.set_rollback(True)
+        self.assertEqual(len(branched_payloads.cache.get_many([key])), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            branched_payloads.invalidate([conversation.id])
+        self.assertEqual(branched_payloads.cache.get_many([key]), {})
+
+    def test_stats_view(self):
+        conversation = self._create_conversation("Question")
+        url = reverse("get_branched_conversation", kwargs={"pk": conversation.id})
+        self._get(url)
+        self._get(url)
+        stats = self._get(reverse("payload_cache_stats"))
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["hit_ratio"], 0.5)
+        self.assertGreater(stats["rebuild_seconds_per_payload"], 0)
+
+    def test_file_and_sqlite_backends(self):
+        with tempfile.TemporaryDirectory() as path:
+            for backend, location in [
+                ("django.core.cache.backends.filebased.FileBasedCache", path),
+                ("django.core.cache.backends.db.DatabaseCache", "chat_payload_cache"),
+            ]:
+                with self.subTest(backend=backend), override_settings(
+                    CACHES={"payloads": {"BACKEND": backend, "LOCATION": location}}
+                ):
+                    call_command("createcachetable", "--database", "default")
+                    conversation = self._create_conversation("Question", "Answer")
+                    url = reverse("get_branched_conversation", kwargs={"pk": conversation.id})
+                    self.assertEqual(self._get(url), self._get(url))
+                    self.assertEqual(branched_payloads.stats()["hits"], 1)
+                    branched_payloads.reset_stats()
@@ -0,0 +1,90 @@
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from chat.models import Conversation, Message, Version
+from chat.tests.base import AUTH_QUERIES, VALIDATOR_QUERIES, ChatTestMixin
+from chat.utils.summary import refresh_summary
+
+
+class ConversationQueryBudgetTests(ChatTestMixin, APITestCase):
+    def _create_conversations(self, conversations_count, versions_count=3, messages_count=4):
+        conversations = []
+        for conversation_idx in range(conversations_count):
+            conversation = Conversation.objects.create(title=f"Title {conversation_idx}", user=self.mock_user)
+            parent_version = None
+            for _ in range(versions_count):
+                version = Version.objects.create(conversation=conversation, parent_version=parent_version)
+                messages = [
+                    Message.objects.create(
+                        version=version,
+                        content=f"Message {message_idx}",
+                        role=self.user_role if message_idx % 2 == 0 else self.assistant_role,
+                    )
+                    for message_idx in range(messages_count)
+                ]
+                if parent_version is not None:
+                    version.root_message = messages[0]
+                    version.save()
+                parent_version = version
+            conversation.active_version = parent_version
+            conversation.save()
+            refresh_summary(conversation)
+            conversations.append(conversation)
+        return conversations
+
+    def _assert_query_budget(self, url, budget):
+        with self.assertNumQueries(AUTH_QUERIES + budget):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_get_conversations_query_budget(self):
+        self._create_conversations(1)
+        self._assert_query_budget(reverse("get_conversations"), VALIDATOR_QUERIES + 3)
+
+        self._create_conversations(20, versions_count=5, messages_count=6)
+        response = self._assert_query_budget(reverse("get_conversations"), VALIDATOR_QUERIES + 3)
+        self.assertEqual(len(response.data), 21)
+
+    def test_get_conversation_summaries_query_budget(self):
+        self._create_conversations(20, versions_count=5, messages_count=6)
+        response = self._assert_query_budget(reverse("get_conversation_summaries"), 1)
+        self.assertEqual(len(response.data["results"]), 20)
+        self.assertEqual(response.data["results"][0]["version_count"], 5)
+        self.assertEqual(response.data["results"][0]["message_count"], 6)
+
+    def test_get_conversations_branched_query_budget(self):
+        self._create_conversations(1)
+        self._assert_query_budget(reverse("get_branched_conversations"), VALIDATOR_QUERIES + 3)
+
+        self._create_conversations(20, versions_count=5, messages_count=6)
+        response = self._assert_query_budget(reverse("get_branched_conversations"), VALIDATOR_QUERIES + 3)
+        self.assertEqual(len(response.data), 21)
+
+    def test_get_conversation_branched_query_budget(self):
+        (conversation,) = self._create_conversations(1, versions_count=10, messages_count=10)
+        url = reverse("get_branched_conversation", kwargs={"pk": conversation.id})
+        response = self._assert_query_budget(url, VALIDATOR_QUERIES + 3)
+        self.assertEqual(len(response.data["versions"]), 10)
+
+    def test_conversation_manage_get_query_budget(self):
+        (conversation,) = self._create_conversations(1, versions_count=10, messages_count=10)
+        url = reverse("conversation_manage", kwargs={"pk": conversation.id})
+        response = self._assert_query_budget(url, VALIDATOR_QUERIES + 3)
+        self.assertEqual(len(response.data["versions"]), 10)
+
+    def test_annotated_fields_match_instance_fields(self):
+        (conversation,) = self._create_conversations(1)
+        url = reverse("get_conversations")
+        response = self.client.get(url)
+
+        for version_data in response.data[0]["versions"]:
+            version = Version.objects.get(id=version_data["id"])
+            self.assertEqual(version_data["active"], version == conversation.active_version)
+            if version.root_message is None:
+                self.assertEqual(version_data["created_at"], conversation.created_at)
+            else:
+                self.assertEqual(version_data["created_at"], version.root_message.created_at)
+            for message_data in version_data["messages"]:
+                self.assertEqual(message_data["role"], Message.objects.get(id=message_data["id"]).role.name)
@@ -0,0 +1,83 @@
+import json
+
+from django.db import connection
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from authentication.models import CustomUser
+from chat.models import Conversation, Message, Role
+from src.utils.query_plans import assert_no_full_scans, find_full_scans
+
+# roles are looked up by name, the table holds a row per role
+ALLOWED_TABLES = ["chat_role"]
+
+
+class QueryPlanTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Role.objects.create(name="user")
+        Role.objects.create(name="assistant")
+        cls.mock_user = CustomUser.objects.create(email="mock@email.com", is_active=True)
+
+    def setUp(self):
+        self.client.force_login(self.mock_user)
+        messages = [{"role": ["user", "assistant"][idx % 2], "content": f"Message {idx}"} for idx in range(4)]
+        for _ in range(2):
+            data = self._request("post", reverse("add_conversation"), {"messages": messages})
+        self.conversation = Conversation.objects.get(pk=data["id"])
+
+    def _request(self, method, url, data=None):
+        with assert_no_full_scans(allowed_tables=ALLOWED_TABLES):
+            response = getattr(self.client, method)(
+                url, data=json.dumps(data) if data is not None else None, content_type="application/json"
+            )
+        self.assertLess(response.status_code, status.HTTP_400_BAD_REQUEST)
+        return response.data
+
+    def test_read_endpoints(self):
+        pk = self.conversation.id
+        self._request("get", reverse("get_conversations"))
+        self._request("get", reverse("get_branched_conversations"))
+        self._request("get", reverse("get_branched_conversation", kwargs={"pk": pk}))
+        self._request("get", reverse("conversation_manage", kwargs={"pk": pk}))
+        self._request("get", reverse("conversation_title", kwargs={"pk": pk}))
+        data = self._request("get", f"{reverse('get_conversation_summaries')}?limit=1")
+        self._request("get", f"{reverse('get_conversation_summaries')}?cursor={data['next_cursor']}")
+        self._request("get", f"{reverse('search_messages')}?q=message")
+        data = self._request("get", reverse("sync_conversations"))
+        self._request("get", f"{reverse('sync_conversations')}?cursor={int(data['cursor']) - 3}")
+
+    def test_write_endpoints(self):
+        pk = self.conversation.id
+        url = reverse("conversation_add_message", kwargs={"pk": pk})
+        self._request("post", url, {"role": "user", "content": "Next"})
+        root_message = list(self.conversation.active_version.messages.all())[2]
+        url = reverse("conversation_add_version", kwargs={"pk": pk})
+        version = self._request("post", url, {"root_message_id": str(root_message.id)})
+        url = reverse("version_add_message", kwargs={"pk": version["id"]})
+        self._request("post", url, {"role": "assistant", "content": "Answer"})
+        url = reverse("conversation_switch_version", kwargs={"pk": pk, "version_id": root_message.version_id})
+        self._request("put", url)
+        self._request("put", reverse("conversation_change_title", kwargs={"pk": pk}), {"title": "Title"})
+        self._request("put", reverse("conversation_delete", kwargs={"pk": pk}))
+
+    def test_hot_queries_use_composite_indexes(self):
+        conversations = Conversation.objects.filter(user=self.mock_user, deleted_at__isnull=True)
+        plan = conversations.order_by("-modified_at", "-pk").explain()
+        self.assertIn("USING INDEX chat_conv_user_live_idx", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+        messages = Message.objects.filter(version=self.conversation.active_version_id)
+        plan = messages.filter(created_at__lt=timezone.now()).explain()
+        self.assertIn("USING INDEX chat_msg_version_created_idx (version_id=? AND created_at<?)", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_full_scans_are_found(self):
+        queries = ["SELECT * FROM chat_message WHERE content = 'Message 0'", "SELECT * FROM chat_role"]
+        full_scans = find_full_scans(queries, connection, allowed_tables=ALLOWED_TABLES)
+        self.assertEqual(full_scans, [(queries[0], "SCAN chat_message")])
+        with self.assertRaises(AssertionError):
+            with assert_no_full_scans():
+                self.assertEqual(Conversation.objects.filter(title="Missing").count(), 0)
@@ -0,0 +1,146 @@
+from django.db import connection
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from authentication.models import CustomUser
+from chat.models import Conversation, Message
+from chat.tests.base import ChatTestMixin
+from chat.utils.cursors import encode_cursor
+from chat.utils.search import install_search_index, make_match_query, suspend_search_index
+
+
+class MessageSearchTests(ChatTestMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other_user = CustomUser.objects.create(email="other@email.com", is_active=True)
+
+    def _search(self, query, **params):
+        response = self.client.get(reverse("search_messages"), {"q": query, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_search(self):
+        conversation = self._create_conversation("How do I sort a list in Python?", "Use <sorted> or list.sort")
+        self._create_conversation("What is the capital of France?", "Paris")
+
+        data = self._search("list sort")
+        self.assertEqual(len(data["results"]), 2)
+        self.assertIsNone(data["next_cursor"])
+        result = next(result for result in data["results"] if result["role"] == "assistant")
+        self.assertEqual(result["conversation_id"], conversation.id)
+        self.assertEqual(result["conversation_title"], conversation.title)
+        self.assertEqual(result["version_id"], conversation.active_version_id)
+        self.assertEqual(result["snippet"], "Use &lt;<mark>sorted</mark>&gt; or <mark>list</mark>.<mark>sort</mark>")
+
+        self.assertEqual(len(self._search("pari")["results"]), 1)
+        self.assertEqual(len(self._search('"capital" (of')["results"]), 1)
+        response = self.client.get(reverse("search_messages"), {"q": "?!"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_is_scoped(self):
+        deleted = self._create_conversation("Deleted python question")
+        self._create_conversation("Kept python question")
+        Conversation.objects.filter(pk=deleted.pk).update(deleted_at=timezone.now())
+        self.client.force_login(self.other_user)
+        self._create_conversation("Python question of someone else")
+        self.client.force_login(self.mock_user)
+
+        results = self._search("python")["results"]
+        self.assertEqual([result["snippet"] for result in results], ["Kept <mark>python</mark> question"])
+
+    def test_index_follows_writes(self):
+        conversation = self._create_conversation("Old content")
+        message = Message.objects.get(version__conversation=conversation)
+        message.content = "New content"
+        message.save()
+        self.assertEqual(self._search("old")["results"], [])
+        self.assertEqual(len(self._search("new")["results"]), 1)
+
+        conversation.delete()
+        self.assertEqual(self._search("new")["results"], [])
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM chat_message_fts")
+            self.assertEqual(cursor.fetchone(), (0,))
+
+    def test_pagination(self):
+        for idx in range(5):
+            self._create_conversation(f"Python {'python ' * idx}question {idx}")
+
+        snippets, cursor = [], None
+        for _ in range(3):
+            data = self._search("python", limit=2, **({"cursor": cursor} if cursor else {}))
+            snippets += [result["snippet"] for result in data["results"]]
+            cursor = data["next_cursor"]
+        self.assertIsNone(cursor)
+        self.assertEqual(len(snippets), 5)
+        self.assertTrue(snippets[0].endswith("question 4"))
+        self.assertTrue(snippets[-1].endswith("question 0"))
+
+        for cursor in [
+            "invalid",
+            encode_cursor({"rank": 0}, "id"),
+            encode_cursor(-1.5, ["id"]),
+            encode_cursor(True, ""),
+        ]:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse("search_messages"), {"q": "python", "cursor": cursor})
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_copied_messages_are_deduplicated(self):
+        conversation = self._create_conversation("Python question", "Python answer", "Follow-up")
+        root_message = list(conversation.active_version.messages.all())[2]
+        url = reverse("conversation_add_version", kwargs={"pk": conversation.id})
+        self._post(url, {"root_message_id": str(root_message.id)})
+        self.assertEqual(Message.objects.filter(content="Python question").count(), 2)
+
+        results = self._search("python")["results"]
+        self.assertEqual(len(results), 2)
+        self.assertEqual({result["version_id"] for result in results}, {root_message.version_id})
+
+    def test_copies_of_copies_are_deduplicated(self):
+        conversation = self._create_conversation("Python question", "Python answer", "Follow-up")
+        first_version_id = conversation.active_version_id
+        url = reverse("conversation_add_version", kwargs={"pk": conversation.id})
+        for root_message_idx in [2, 1]:
+            conversation.refresh_from_db()
+            root_message = list(conversation.active_version.messages.all())[root_message_idx]
+            self._post(url, {"root_message_id": str(root_message.id)})
+        self.assertEqual(Message.objects.filter(content="Python question").count(), 3)
+
+        results = self._search("python")["results"]
+        self.assertEqual(len(results), 2)
+        self.assertEqual({result["version_id"] for result in results}, {first_version_id})
+
+    def test_messages_with_same_content_are_kept(self):
+        conversation = self._create_conversation("Python question", "Python answer", "Python question")
+        root_message = list(conversation.active_version.messages.all())[2]
+        url = reverse("conversation_add_version", kwargs={"pk": conversation.id})
+        self._post(url, {"root_message_id": str(root_message.id)})
+
+        results = self._search("python question")["results"]
+        self.assertEqual(len(results), 2)
+        self.assertEqual({result["version_id"] for result in results}, {conversation.active_version_id})
+
+    def test_index_is_rebuilt_without_triggers(self):
+        self._create_conversation("Python question")
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER chat_message_fts_delete")
+            cursor.execute("DELETE FROM chat_message_fts")
+        self.assertTrue(install_search_index())
+        self.assertFalse(install_search_index())
+        self.assertEqual(len(self._search("python")["results"]), 1)
+
+    def test_messages_inserted_while_suspended_are_indexed(self):
+        self._create_conversation("Python question")
+        suspend_search_index()
+        self._create_conversation("Python answer")
+        self.assertEqual(len(self._search("python")["results"]), 1)
+        self.assertFalse(install_search_index())
+        self.assertEqual(len(self._search("python")["results"]), 2)
+
+    def test_match_query(self):
+        self.assertEqual(make_match_query('sort "list" AND'), '"sort" "list" "AND"*')
+        self.assertIsNone(make_match_query("*"))
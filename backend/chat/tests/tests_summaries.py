@@ -0,0 +1,87 @@
+from datetime import timedelta
+
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from authentication.models import CustomUser
+from chat.models import Conversation, Version
+from chat.utils.cursors import encode_cursor
+from chat.utils.summary import refresh_summary
+
+
+class ConversationSummariesTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.mock_user = CustomUser.objects.create(email="mock@email.com", is_active=True)
+        cls.other_user = CustomUser.objects.create(email="other@email.com", is_active=True)
+
+    def setUp(self):
+        self.client.force_login(self.mock_user)
+
+    def _create_conversations(self, count, modified_at=None):
+        conversations = []
+        for idx in range(count):
+            conversation = Conversation.objects.create(title=f"Title {idx}", user=self.mock_user)
+            Version.objects.bulk_create([Version(conversation=conversation) for _ in range(idx % 3)])
+            refresh_summary(conversation)
+            if modified_at is not None:
+                # `modified_at` is set on every save, so ties are made with an update
+                Conversation.objects.filter(pk=conversation.pk).update(modified_at=modified_at)
+            conversations.append(conversation)
+        return conversations
+
+    def _get(self, **params):
+        response = self.client.get(reverse("get_conversation_summaries"), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_summaries(self):
+        conversations = self._create_conversations(3)
+        deleted = Conversation.objects.create(title="Deleted", user=self.mock_user, deleted_at=timezone.now())
+        Conversation.objects.create(title="Other", user=self.other_user)
+
+        data = self._get()
+        self.assertIsNone(data["next_cursor"])
+        self.assertEqual([summary["id"] for summary in data["results"]], [str(c.id) for c in reversed(conversations)])
+        self.assertNotIn(str(deleted.id), [summary["id"] for summary in data["results"]])
+        self.assertEqual(
+            set(data["results"][0]),
+            {"id", "title", "modified_at", "version_count", "message_count", "total_tokens", "last_message_preview"},
+        )
+        self.assertEqual([summary["version_count"] for summary in data["results"]], [2, 1, 0])
+
+    def test_pagination(self):
+        tied_at = timezone.now() - timedelta(days=1)
+        conversations = self._create_conversations(4, modified_at=tied_at) + self._create_conversations(3)
+
+        ids, cursor = [], None
+        for _ in range(3):
+            data = self._get(limit=3, **({"cursor": cursor} if cursor else {}))
+            ids += [summary["id"] for summary in data["results"]]
+            cursor = data["next_cursor"]
+        self.assertIsNone(cursor)
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(set(ids), {str(conversation.id) for conversation in conversations})
+        self.assertEqual(ids[3:], sorted(ids[3:], reverse=True))
+
+    def test_new_conversations_do_not_shift_pages(self):
+        conversations = self._create_conversations(4)
+        data = self._get(limit=2)
+        self._create_conversations(2)
+        data = self._get(limit=2, cursor=data["next_cursor"])
+        self.assertEqual([summary["id"] for summary in data["results"]], [str(c.id) for c in conversations[1::-1]])
+
+    def test_invalid_cursor(self):
+        for cursor in [
+            "invalid",
+            "WyJ4IiwieSJd",
+            encode_cursor("2024-01-01T00:00:00+00:00", 5),
+            encode_cursor(20240101, "0" * 32),
+            encode_cursor("2024-01-01T00:00:00+00:00", ["id"]),
+            encode_cursor(None, None),
+        ]:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse("get_conversation_summaries"), {"cursor": cursor})
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,78 @@
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from chat.models import Conversation
+from chat.tests.base import ChatTestMixin
+from chat.utils.summary import compute_summary, get_summary
+
+
+class ConversationSummaryTests(ChatTestMixin, APITestCase):
+    def _assert_summary(self, conversation, **expected):
+        conversation.refresh_from_db()
+        summary = get_summary(conversation)
+        self.assertEqual(summary, compute_summary(conversation))
+        for field, value in expected.items():
+            self.assertEqual(summary[field], value)
+
+    def test_write_views_keep_summary(self):
+        conversation = self._create_conversation("Question", "Answer")
+        self._assert_summary(conversation, version_count=1, message_count=2, last_message_preview="Answer")
+
+        url = reverse("conversation_add_message", kwargs={"pk": conversation.id})
+        self._post(url, {"role": "user", "content": "Follow-up " * 20})
+        self._assert_summary(conversation, message_count=3, last_message_preview="Follow-up " * 10)
+
+        root_message = list(conversation.active_version.messages.all())[2]
+        url = reverse("conversation_add_version", kwargs={"pk": conversation.id})
+        new_version = self._post(url, {"root_message_id": str(root_message.id)})
+        self._assert_summary(conversation, version_count=2, message_count=2, last_message_preview="Answer")
+
+        url = reverse("version_add_message", kwargs={"pk": new_version["id"]})
+        self._post(url, {"role": "user", "content": "Other follow-up"})
+        self._assert_summary(conversation, message_count=3, last_message_preview="Other follow-up")
+
+    def test_switch_version(self):
+        conversation = self._create_conversation("Question", "Answer")
+        first_version_id = conversation.active_version_id
+        root_message = list(conversation.active_version.messages.all())[1]
+        url = reverse("conversation_add_version", kwargs={"pk": conversation.id})
+        self._post(url, {"root_message_id": str(root_message.id)})
+        self._assert_summary(conversation, version_count=2, message_count=1, last_message_preview="Question")
+
+        # messages appended to an inactive version do not change the summary
+        url = reverse("version_add_message", kwargs={"pk": first_version_id})
+        self._post(url, {"role": "user", "content": "Follow-up"})
+        self._assert_summary(conversation, message_count=1)
+
+        url = reverse("conversation_switch_version", kwargs={"pk": conversation.id, "version_id": first_version_id})
+        response = self.client.put(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self._assert_summary(conversation, version_count=2, message_count=3, last_message_preview="Follow-up")
+
+    def test_saving_stale_instance_keeps_summary(self):
+        conversation = self._create_conversation("Question", "Answer")
+        stale_conversation = Conversation.objects.get(pk=conversation.pk)
+        url = reverse("conversation_add_message", kwargs={"pk": conversation.id})
+        self._post(url, {"role": "user", "content": "Follow-up"})
+
+        stale_conversation.title = "New title"
+        stale_conversation.save()
+        self._assert_summary(conversation, message_count=3)
+        self.assertEqual(conversation.title, "New title")
+
+    def test_check_conversation_summaries(self):
+        conversation = self._create_conversation("Question", "Answer")
+        call_command("check_conversation_summaries", stdout=StringIO())
+
+        Conversation.objects.filter(pk=conversation.pk).update(message_count=0, last_message_preview="")
+        with self.assertRaises(CommandError):
+            call_command("check_conversation_summaries", stdout=StringIO())
+
+        out = StringIO()
+        call_command("check_conversation_summaries", "--repair", stdout=out)
+        self.assertIn("1 repaired", out.getvalue())
+        self._assert_summary(conversation, message_count=2, last_message_preview="Answer")
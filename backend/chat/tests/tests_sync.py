@@ -0,0 +1,147 @@
+from io import StringIO
+
+from django.contrib import admin
+from django.core.management import call_command
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from authentication.models import CustomUser
+from chat.admin import ConversationAdmin
+from chat.models import Conversation
+from chat.tests.base import ChatTestMixin
+from chat.utils.sync import prune_changes
+
+
+class SyncTests(ChatTestMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other_user = CustomUser.objects.create(email="other@email.com", is_active=True)
+
+    def _sync(self, cursor=None, **params):
+        params = {**params, **({"cursor": cursor} if cursor is not None else {})}
+        response = self.client.get(reverse("sync_conversations"), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    @staticmethod
+    def _ids(page, kind):
+        return sorted(str(item["id"]) for item in page[kind])
+
+    def test_snapshot(self):
+        conversation = self._create_conversation("Question", "Answer")
+        deleted = self._create_conversation("Deleted")
+        self._request("put", reverse("conversation_delete", kwargs={"pk": deleted.id}), expected_status=204)
+        self.client.force_login(self.other_user)
+        self._create_conversation("Question of someone else")
+        self.client.force_login(self.mock_user)
+
+        page = self._sync()
+        self.assertTrue(page["reset"])
+        self.assertFalse(page["has_more"])
+        self.assertEqual(self._ids(page, "conversations"), [str(conversation.id)])
+        self.assertEqual(self._ids(page, "versions"), [str(conversation.active_version_id)])
+        self.assertEqual([message["content"] for message in page["messages"]], ["Question", "Answer"])
+        self.assertEqual(page["conversations"][0]["message_count"], 2)
+        self.assertEqual(self._sync(page["cursor"])["conversations"], [])
+
+    def test_changes(self):
+        conversation = self._create_conversation("Question", "Answer")
+        other_conversation = self._create_conversation("Other question")
+        cursor = self._sync()["cursor"]
+
+        url = reverse("conversation_add_message", kwargs={"pk": conversation.id})
+        message = self._request("post", url, {"role": "user", "content": "Follow-up"})["message"]
+        page = self._sync(cursor)
+        self.assertFalse(page["reset"])
+        self.assertEqual(self._ids(page, "conversations"), [str(conversation.id)])
+        self.assertEqual(page["versions"], [])
+        self.assertEqual(self._ids(page, "messages"), [str(message["id"])])
+        self.assertEqual(page["conversations"][0]["last_message_preview"], "Follow-up")
+        cursor = page["cursor"]
+
+        url = reverse("conversation_change_title", kwargs={"pk": other_conversation.id})
+        self._request("put", url, {"title": "New title"}, expected_status=204)
+        self._request("put", reverse("conversation_delete", kwargs={"pk": conversation.id}), expected_status=204)
+        page = self._sync(cursor)
+        self.assertEqual([item["title"] for item in page["conversations"]], ["New title"])
+        self.assertEqual(page["deleted"]["conversations"], [str(conversation.id)])
+        cursor = page["cursor"]
+
+        self._request(
+            "delete", reverse("conversation_manage", kwargs={"pk": other_conversation.id}), expected_status=204
+        )
+        page = self._sync(cursor)
+        self.assertEqual(page["conversations"], [])
+        self.assertEqual(page["deleted"]["conversations"], [str(other_conversation.id)])
+
+    def test_added_version_with_copied_messages(self):
+        conversation = self._create_conversation("Question", "Answer", "Follow-up")
+        cursor = self._sync()["cursor"]
+        root_message = list(conversation.active_version.messages.all())[2]
+        url = reverse("conversation_add_version", kwargs={"pk": conversation.id})
+        version = self._request("post", url, {"root_message_id": str(root_message.id)})
+
+        page = self._sync(cursor)
+        self.assertEqual(self._ids(page, "versions"), [str(version["id"])])
+        self.assertEqual(str(page["conversations"][0]["active_version"]), str(version["id"]))
+        self.assertEqual([message["content"] for message in page["messages"]], ["Question", "Answer"])
+        self.assertEqual({str(message["version"]) for message in page["messages"]}, {str(version["id"])})
+
+    def test_pagination(self):
+        cursor = self._sync()["cursor"]
+        conversations = [self._create_conversation("Question") for _ in range(3)]
+        self.client.force_login(self.other_user)
+        self._create_conversation("Question of someone else")
+        self.client.force_login(self.mock_user)
+
+        # a conversation, its version and its message are changed by each conversation created
+        conversation_ids, pages_count, has_more = [], 0, True
+        while has_more:
+            page = self._sync(cursor, limit=2)
+            conversation_ids += self._ids(page, "conversations")
+            cursor, pages_count, has_more = page["cursor"], pages_count + 1, page["has_more"]
+        self.assertEqual(pages_count, 5)
+        self.assertEqual(sorted(conversation_ids), sorted(str(conversation.id) for conversation in conversations))
+
+    def test_pruned_cursor_gets_snapshot(self):
+        cursor = self._sync()["cursor"]
+        self._create_conversation("Question")
+        conversation = self._create_conversation("Question")
+        prune_changes()
+        page = self._sync(cursor)
+        self.assertTrue(page["reset"])
+        self.assertEqual(len(page["conversations"]), 2)
+
+        self._request("put", reverse("conversation_delete", kwargs={"pk": conversation.id}), expected_status=204)
+        out = StringIO()
+        call_command("prune_changes", "--days", "0", stdout=out)
+        self.assertIn("Successfully deleted 1 changes", out.getvalue())
+        self.assertFalse(self._sync(page["cursor"])["reset"])
+
+    def test_cursor_ahead_of_log_gets_snapshot(self):
+        self._create_conversation("Question")
+        cursor = int(self._sync()["cursor"])
+        page = self._sync(cursor + 10)
+        self.assertTrue(page["reset"])
+        self.assertEqual(len(page["conversations"]), 1)
+        self.assertEqual(page["cursor"], str(cursor))
+
+    def test_undeleted_conversation_is_synced_whole(self):
+        conversation = self._create_conversation("Question", "Answer")
+        self._request("put", reverse("conversation_delete", kwargs={"pk": conversation.id}), expected_status=204)
+        cursor = self._sync()["cursor"]
+
+        ConversationAdmin(Conversation, admin.site).undelete_selected(
+            None, Conversation.objects.filter(pk=conversation.pk)
+        )
+        page = self._sync(cursor)
+        self.assertEqual(self._ids(page, "conversations"), [str(conversation.id)])
+        self.assertEqual(self._ids(page, "versions"), [str(conversation.active_version_id)])
+        self.assertEqual([message["content"] for message in page["messages"]], ["Question", "Answer"])
+
+    def test_invalid_cursor(self):
+        for params in [{"cursor": "invalid"}, {"cursor": "-1"}, {"limit": "x"}]:
+            response = self.client.get(reverse("sync_conversations"), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
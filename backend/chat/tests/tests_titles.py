@@ -0,0 +1,142 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from chat.models import DEFAULT_TITLE, Conversation
+from chat.tests.base import ChatTestMixin
+from chat.utils.titles import TitleWorker, title_worker
+from src.utils.cache import completion_cache
+from src.utils.stub_openai import StubOpenAIServer
+
+
+def reply_titles(request_body):
+    """Answers the title requests with a title made of the user's question."""
+    usr_msg = request_body["messages"][1]["content"]
+    if usr_msg.startswith("["):
+        return json.dumps([f"About {conversation['user_question']}" for conversation in json.loads(usr_msg)])
+    return f"About {usr_msg.splitlines()[0].split(': ', 1)[1]}"
+
+
+class TitlesMixin(ChatTestMixin):
+    def _create_conversation(self, question, answer="Hello!"):
+        return super()._create_conversation(question, answer)
+
+
+class FailingTitleWorker(TitleWorker):
+    """Worker failing its first batches, as while the upstream is overloaded."""
+
+    def __init__(self, failures):
+        super().__init__(retry_delay=0)
+        self.failures = failures
+        self.batches = []
+
+    def process(self, conversation_ids):
+        self.batches.append(conversation_ids)
+        if len(self.batches) <= self.failures:
+            raise RuntimeError("Upstream overloaded")
+
+
+class TitleWorkerTests(TitlesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        completion_cache.clear()
+
+    async def test_batch_is_titled_with_one_call(self):
+        conversations = [await sync_to_async(self._create_conversation)(f"Question {idx}") for idx in range(3)]
+        async with StubOpenAIServer(reply=reply_titles) as upstream:
+            await sync_to_async(TitleWorker().process)([conversation.pk for conversation in conversations])
+        self.assertEqual(len(upstream.requests), 1)
+        titles = [(await Conversation.objects.aget(pk=conversation.pk)).title for conversation in conversations]
+        self.assertEqual(titles, ["About Question 0", "About Question 1", "About Question 2"])
+
+    async def test_invalid_batch_answer_falls_back_to_single_calls(self):
+        conversations = [await sync_to_async(self._create_conversation)(f"Question {idx}") for idx in range(2)]
+        async with StubOpenAIServer(chunks_count=2) as upstream:
+            await sync_to_async(TitleWorker().process)([conversation.pk for conversation in conversations])
+        self.assertEqual(len(upstream.requests), 3)
+        self.assertEqual((await Conversation.objects.aget(pk=conversations[0].pk)).title, upstream.content.strip())
+
+    async def test_user_titles_are_kept(self):
+        conversation = await sync_to_async(self._create_conversation)("Question")
+        await Conversation.objects.filter(pk=conversation.pk).aupdate(title="My title")
+        async with StubOpenAIServer(reply=reply_titles) as upstream:
+            await sync_to_async(TitleWorker().process)([conversation.pk])
+        self.assertEqual(len(upstream.requests), 0)
+        self.assertEqual((await Conversation.objects.aget(pk=conversation.pk)).title, "My title")
+
+    @staticmethod
+    def _title_callbacks(callbacks):
+        # the other callbacks drop the cached payloads of the conversation
+        return [callback for callback in callbacks if getattr(callback, "func", None) == title_worker.enqueue]
+
+    @override_settings(CHAT_BACKGROUND_TITLES=True)
+    def test_first_answer_queues_title(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self._create_conversation("Question")
+        self.assertEqual(len(self._title_callbacks(callbacks)), 1)
+
+        with override_settings(CHAT_BACKGROUND_TITLES=False), self.captureOnCommitCallbacks() as callbacks:
+            self._create_conversation("Question")
+        self.assertEqual(self._title_callbacks(callbacks), [])
+
+    def test_failed_batch_is_retried(self):
+        worker = FailingTitleWorker(failures=1)
+        with self.assertLogs("chat.utils.titles", "ERROR"):
+            worker.enqueue("conversation")
+            self.assertTrue(worker.wait(10))
+        self.assertEqual(worker.batches, [["conversation"], ["conversation"]])
+
+    def test_failed_batch_is_given_up_after_max_attempts(self):
+        worker = FailingTitleWorker(failures=5)
+        with self.assertLogs("chat.utils.titles", "WARNING"):
+            worker.enqueue("conversation")
+            self.assertTrue(worker.wait(10))
+        self.assertEqual(len(worker.batches), worker.max_attempts)
+        self.assertFalse(worker.is_pending("conversation"))
+
+    def test_writes_leave_title(self):
+        # a title written by the worker after these writes loaded the conversation is not put back to the default one
+        conversation = self._create_conversation("Question")
+        root_message = conversation.active_version.messages.first()
+        switch_kwargs = {"pk": conversation.pk, "version_id": conversation.active_version_id}
+        for method, url, data in [
+            (
+                "post",
+                reverse("conversation_add_version", kwargs={"pk": conversation.pk}),
+                {"root_message_id": str(root_message.id)},
+            ),
+            ("put", reverse("conversation_switch_version", kwargs=switch_kwargs), {}),
+            ("put", reverse("conversation_delete", kwargs={"pk": conversation.pk}), {}),
+        ]:
+            with CaptureQueriesContext(connection) as queries:
+                response = getattr(self.client, method)(url, data=json.dumps(data), content_type="application/json")
+            self.assertLess(response.status_code, 300)
+            updates = [query["sql"] for query in queries if query["sql"].startswith('UPDATE "chat_conversation" SET')]
+            self.assertTrue(updates)
+            self.assertFalse(any('"title"' in update for update in updates), url)
+
+    def test_title_view(self):
+        conversation = self._create_conversation("Question")
+        response = self.client.get(reverse("conversation_title", kwargs={"pk": conversation.pk}))
+        self.assertEqual(response.data, {"title": DEFAULT_TITLE, "pending": False})
+
+
+@override_settings(CHAT_BACKGROUND_TITLES=True)
+class BackgroundTitlesTests(TitlesMixin, TransactionTestCase):
+    # the worker thread reads from the replica alias of the production database profile
+    databases = "__all__"
+
+    def setUp(self):
+        self._create_roles_and_user()
+        super().setUp()
+        completion_cache.clear()
+
+    async def test_title_is_written_in_background(self):
+        async with StubOpenAIServer(reply=reply_titles):
+            conversation = await sync_to_async(self._create_conversation)("Question")
+            self.assertTrue(await sync_to_async(title_worker.wait)(10))
+        self.assertEqual((await Conversation.objects.aget(pk=conversation.pk)).title, "About Question")
@@ -0,0 +1,65 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from chat.models import Message, Version
+from chat.tests.base import ChatTestMixin
+from src.utils.tokens import count_message_tokens
+
+
+class TokenCountTests(ChatTestMixin, APITestCase):
+    def _create_forked_conversation(self):
+        conversation = self._create_conversation(*[f"Message number {idx}" for idx in range(6)])
+        root_message = conversation.active_version.messages.all()[4]
+        url = reverse("conversation_add_version", kwargs={"pk": conversation.id})
+        version_data = self._post(url, {"root_message_id": str(root_message.id)})
+        self._post(reverse("version_add_message", kwargs={"pk": version_data["id"]}), {"role": "user", "content": "Hi"})
+        return conversation
+
+    def _assert_version_token_counts(self, conversation):
+        for version in Version.objects.filter(conversation=conversation).with_token_count():
+            expected = sum(count_message_tokens(m.role.name, m.content) for m in version.messages.all())
+            self.assertEqual(version.token_count, expected)
+
+    def test_token_count_is_stored_on_write(self):
+        conversation = self._create_forked_conversation()
+        for message in Message.objects.filter(version__conversation=conversation):
+            self.assertEqual(message.token_count, count_message_tokens(message.role.name, message.content))
+
+        message = conversation.versions.first().messages.first()
+        message.content = "Message number 0 " * 10
+        message.save()
+        self.assertEqual(message.token_count, count_message_tokens(message.role.name, message.content))
+
+    def test_add_version_copies_token_counts(self):
+        conversation = self._create_conversation("Question", "Answer")
+        # counts stored by an older estimate are copied as they are, instead of being counted again
+        Message.objects.filter(version=conversation.active_version).update(token_count=1)
+        root_message = conversation.active_version.messages.last()
+        url = reverse("conversation_add_version", kwargs={"pk": conversation.id})
+        version_data = self._post(url, {"root_message_id": str(root_message.id)})
+        self.assertEqual([m.token_count for m in Message.objects.filter(version_id=version_data["id"])], [1])
+
+    def test_version_token_count(self):
+        self._assert_version_token_counts(self._create_forked_conversation())
+
+    def test_version_token_count_is_single_query(self):
+        conversation = self._create_forked_conversation()
+        with self.assertNumQueries(1):
+            list(Version.objects.filter(conversation=conversation).with_token_count().values_list("token_count"))
+
+    def test_unknown_token_counts(self):
+        conversation = self._create_forked_conversation()
+        Message.objects.filter(version=conversation.active_version).update(token_count=None)
+        version = Version.objects.with_token_count().get(pk=conversation.active_version_id)
+        self.assertIsNone(version.token_count)
+
+    def test_backfill_command(self):
+        conversation = self._create_forked_conversation()
+        Message.objects.update(token_count=None)
+
+        call_command("backfill_token_counts", "--batch-size", "4", stdout=StringIO())
+        self.assertFalse(Message.objects.filter(token_count__isnull=True).exists())
+        self._assert_version_token_counts(conversation)
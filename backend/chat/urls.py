@@ -5,12 +5,18 @@ from chat import views
 urlpatterns = [
     path("", views.chat_root_view, name="chat_root_view"),
     path("conversations/", views.get_conversations, name="get_conversations"),
+    path("conversations/summaries/", views.get_conversation_summaries, name="get_conversation_summaries"),
     path("conversations_branched/", views.get_conversations_branched, name="get_branched_conversations"),
     path("conversation_branched/<uuid:pk>/", views.get_conversation_branched, name="get_branched_conversation"),
+    path("payload_cache_stats/", views.get_payload_cache_stats, name="payload_cache_stats"),
+    path("sync/", views.sync, name="sync_conversations"),
+    path("search/", views.search, name="search_messages"),
     path("conversations/add/", views.add_conversation, name="add_conversation"),
     path("conversations/<uuid:pk>/", views.conversation_manage, name="conversation_manage"),
     path("conversations/<uuid:pk>/change_title/", views.conversation_change_title, name="conversation_change_title"),
+    path("conversations/<uuid:pk>/title/", views.conversation_title, name="conversation_title"),
     path("conversations/<uuid:pk>/add_message/", views.conversation_add_message, name="conversation_add_message"),
+    path("conversations/<uuid:pk>/add_messages/", views.conversation_add_messages, name="conversation_add_messages"),
     path("conversations/<uuid:pk>/add_version/", views.conversation_add_version, name="conversation_add_version"),
     path(
         "conversations/<uuid:pk>/switch_version/<uuid:version_id>/",
@@ -0,0 +1,189 @@
+"""
+Write-behind persistence of streamed answers.
+
+The streaming views can store the answer they stream as an assistant message of the conversation, so that the client
+does not send it back once streamed, and an answer cut by the client going away is kept. The streaming loop only appends
+the chunks to a `StreamedAnswer` in memory and hands it over to the `answer_writer` daemon thread, which writes it:
+every `CHAT_ANSWER_FLUSH_INTERVAL` seconds while it is streamed, and once the stream ends, completed or not. The loop
+never waits for the database, and the flushes of an answer requested while the thread is busy are merged into one.
+
+The first write creates the message, together with the user message the answer is for if it was not stored yet, the
+next ones update its content. The writes made while the answer is streamed update the content alone, the token count,
+the summary, the branch metadata, the change log and the modification time of the conversation are updated once, by
+the final write. The message id is known from the start, so the views send it with the stream.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from typing import Callable, Optional
+from uuid import UUID
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from chat.models import Message, Role, Version
+from chat.utils.branch_metadata import update_branch_metadata
+from chat.utils.summary import add_messages_to_summary, refresh_summary
+from chat.utils.sync import record_changes
+
+__all__ = ["AnswerWriter", "StreamedAnswer", "answer_writer"]
+
+logger = logging.getLogger(__name__)
+
+
+class StreamedAnswer:
+    """
+    Answer streamed into a version of a conversation, optionally following a user message which is stored with it.
+
+    Examples
+    --------
+    >>> answer = StreamedAnswer(conversation.active_version_id, question="Tell me a joke")
+    >>> for chunk in chunks:
+    ...     if answer.append(chunk):
+    ...         answer_writer.flush(answer)
+    >>> answer_writer.flush(answer, finished=True)
+    """
+
+    def __init__(
+        self,
+        version_id: UUID,
+        question: Optional[str] = None,
+        flush_interval: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.version_id = version_id
+        self.question = question
+        self.message_id = uuid.uuid4()
+        self.flush_interval = settings.CHAT_ANSWER_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.clock = clock
+        self.finished = False
+        self.created = False
+        self._chunks = []
+        self._flushed_at = clock()
+
+    def append(self, chunk: str) -> bool:
+        """Adds a chunk, returns whether the answer is due to be flushed."""
+        self._chunks.append(chunk)
+        return 0 < self.flush_interval <= self.clock() - self._flushed_at
+
+    @property
+    def content(self) -> str:
+        # the slice is taken at once, while the streaming loop may be appending chunks
+        return "".join(self._chunks[:])
+
+
+class AnswerWriter:
+    """
+    Queue of the answers waiting to be written, processed by a daemon thread started on the first `flush`.
+
+    Examples
+    --------
+    >>> answer_writer.flush(answer, finished=True)
+    >>> answer_writer.wait(timeout=10)
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._in_progress = set()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def flush(self, answer: StreamedAnswer, finished: bool = False) -> None:
+        """Queues the answer to be written with the chunks it has by then, returns right away."""
+        with self._condition:
+            answer.finished = answer.finished or finished
+            answer._flushed_at = answer.clock()
+            self._pending[answer] = None
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="answer-writer", daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Waits until no answer is queued or being written, returns False on timeout."""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and not self._in_progress, timeout)
+
+    def write(self, answer: StreamedAnswer) -> Optional[Message]:
+        """
+        Stores the answer with its current content, creating its message on the first write.
+
+        Parameters
+        ----------
+        answer : StreamedAnswer
+            The answer to be written.
+
+        Returns
+        -------
+        Optional[Message]
+            The stored answer, None if there is nothing to store yet, its version is gone or the answer is still
+            streamed, as only its content is updated then.
+        """
+        content = answer.content
+        if not answer.created:
+            return self._create(answer, content)
+        if not answer.finished:
+            Message.objects.filter(pk=answer.message_id).update(content=content)
+            return None
+
+        with transaction.atomic():
+            try:
+                message = Message.objects.select_related("role", "version__conversation").get(pk=answer.message_id)
+            except Message.DoesNotExist:
+                return None
+            message.content = content
+            message.save()
+            conversation = message.version.conversation
+            refresh_summary(conversation)
+            update_branch_metadata(conversation, [message.version])
+            record_changes(conversation, messages=[message])
+        return message
+
+    @staticmethod
+    def _create(answer: StreamedAnswer, content: str) -> Optional[Message]:
+        # a message has to have content, the question is stored without its answer only once the stream ended
+        if not content and not (answer.finished and answer.question):
+            return None
+        try:
+            version = Version.objects.select_related("conversation").get(pk=answer.version_id)
+        except Version.DoesNotExist:
+            return None
+
+        roles = {role.name: role for role in Role.objects.all()}
+        messages = []
+        if answer.question:
+            messages.append(Message(role=roles["user"], content=answer.question))
+        if content:
+            messages.append(Message(id=answer.message_id, role=roles["assistant"], content=content))
+        with transaction.atomic():
+            Message.bulk_append(version, messages)
+            conversation = version.conversation
+            add_messages_to_summary(conversation, version, messages)
+            update_branch_metadata(conversation, [version])
+            record_changes(conversation, messages=messages)
+        answer.question = None
+        answer.created = bool(content)
+        return messages[-1] if content else None
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending)
+                batch = list(self._pending)
+                self._pending.clear()
+                self._in_progress.update(batch)
+
+            for answer in batch:
+                try:
+                    self.write(answer)
+                except Exception:
+                    logger.exception("Storing the answer %s failed", answer.message_id)
+            close_old_connections()
+            with self._condition:
+                self._in_progress.difference_update(batch)
+                self._condition.notify_all()
+
+
+answer_writer = AnswerWriter()
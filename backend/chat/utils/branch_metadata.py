@@ -0,0 +1,240 @@
+"""
+Persisted branch metadata of a conversation.
+
+The versions lists and chains that `make_branched_conversation` attaches to messages only change when a version is
+added or a message is appended, so they are stored in `Conversation.branch_metadata` and updated incrementally by the
+write views. Reads only merge them into the serializer data. The metadata has the following layout::
+
+    {
+        "versions": {version_id: [position, parent_version_id, root_message_id, created_at]},
+        "branches": {version_id: row},  # row at which the version branches off its parent version
+        "rows": {row: {version_id: [version_id, ...]}},  # versions list of the row message of each version
+    }
+"""
+
+from collections import OrderedDict, defaultdict
+from typing import Iterable, Optional
+
+from django.db import transaction
+
+from chat.models import Conversation, Message, Version
+from chat.serializers import ConversationSerializer, VersionSerializer, VersionTimeIdSerializer
+from chat.utils.branching import get_branch_row, make_branched_conversation, make_row_versions
+
+__all__ = [
+    "build_branch_metadata",
+    "empty_branch_metadata",
+    "merge_branch_metadata",
+    "rebuild_branch_metadata",
+    "update_branch_metadata",
+]
+
+POSITION, PARENT_ID, ROOT_MESSAGE_ID, CREATED_AT = range(4)
+
+
+def empty_branch_metadata() -> dict:
+    """Returns the branch metadata of a conversation without versions."""
+    return {"versions": {}, "branches": {}, "rows": {}}
+
+
+def build_branch_metadata(conversation_data: OrderedDict) -> dict:
+    """
+    Computes the branch metadata of a conversation from scratch.
+
+    Parameters
+    ----------
+    conversation_data : OrderedDict
+        The conversation serializer data.
+
+    Returns
+    -------
+    dict
+        The branch metadata.
+
+    Raises
+    ------
+    Exception
+        If there is a content mismatch between a message and its parent message.
+    """
+    time_id_serializer = VersionTimeIdSerializer()
+    metadata = empty_branch_metadata()
+    for position, version_data in enumerate(conversation_data["versions"]):
+        metadata["versions"][str(version_data["id"])] = [
+            position,
+            _str_or_none(version_data["parent_version"]),
+            _str_or_none(version_data["root_message"]),
+            time_id_serializer.to_representation(version_data)["created_at"],
+        ]
+
+    messages = {str(version_data["id"]): version_data["messages"] for version_data in conversation_data["versions"]}
+    for version_id, version in metadata["versions"].items():
+        if version[PARENT_ID] not in messages:
+            continue
+        row = get_branch_row(messages[version_id], messages[version[PARENT_ID]], version[ROOT_MESSAGE_ID])
+        if row is not None:
+            metadata["branches"][version_id] = row
+
+    for row in set(metadata["branches"].values()):
+        _update_row(metadata, row)
+    return metadata
+
+
+def merge_branch_metadata(conversation_data: OrderedDict, branch_metadata: Optional[dict]) -> None:
+    """
+    Modifies the input conversation_data dictionary in-place to include the versions of each message, the same way
+    `make_branched_conversation` does.
+
+    Falls back to `make_branched_conversation` when the metadata is missing or does not cover the same versions.
+
+    Parameters
+    ----------
+    conversation_data : OrderedDict
+        The conversation serializer data to be modified.
+    branch_metadata : Optional[dict]
+        The branch metadata stored with the conversation.
+    """
+    versions = {str(version_data["id"]): version_data for version_data in conversation_data["versions"]}
+    if branch_metadata is None or branch_metadata["versions"].keys() != versions.keys():
+        make_branched_conversation(conversation_data)
+        return
+
+    time_id_serializer = VersionTimeIdSerializer()
+    time_ids = {}
+    for row, row_versions in branch_metadata["rows"].items():
+        for version_id, message_version_ids in row_versions.items():
+            for message_version_id in message_version_ids:
+                if message_version_id not in time_ids:
+                    time_ids[message_version_id] = time_id_serializer.to_representation(versions[message_version_id])
+            message_data = versions[version_id]["messages"][int(row)]
+            message_data["versions"] = [time_ids[message_version_id] for message_version_id in message_version_ids]
+
+
+def rebuild_branch_metadata(conversation: Conversation) -> Optional[dict]:
+    """
+    Recomputes and stores the branch metadata of a conversation.
+
+    The metadata is cleared if the conversation cannot be branched, so reads fall back to `make_branched_conversation`.
+
+    Parameters
+    ----------
+    conversation : Conversation
+        The conversation to be updated.
+
+    Returns
+    -------
+    Optional[dict]
+        The stored branch metadata.
+    """
+    conversation_data = ConversationSerializer(Conversation.objects.with_versions().get(pk=conversation.pk)).data
+    try:
+        metadata = build_branch_metadata(conversation_data)
+    except Exception:
+        metadata = None
+    _save(conversation, metadata)
+    return metadata
+
+
+def update_branch_metadata(conversation: Conversation, versions: Iterable[Version]) -> None:
+    """
+    Updates the branch metadata of a conversation after versions were added or messages were appended to them.
+
+    Only the branching rows of the given versions and of their child versions are recomputed, together with the
+    versions lists of the messages in these rows.
+
+    Parameters
+    ----------
+    conversation : Conversation
+        The conversation to be updated.
+    versions : Iterable[Version]
+        The versions that were added or had messages appended.
+    """
+    with transaction.atomic():
+        metadata = (
+            Conversation.objects.select_for_update().values_list("branch_metadata", flat=True).get(pk=conversation.pk)
+        )
+        if metadata is None:
+            rebuild_branch_metadata(conversation)
+            return
+
+        time_id_serializer = VersionTimeIdSerializer()
+        changed_ids = set()
+        for version in versions:
+            version_id = str(version.id)
+            changed_ids.add(version_id)
+            if version_id not in metadata["versions"]:
+                created_at = VersionSerializer.get_created_at(version)
+                metadata["versions"][version_id] = [
+                    max((v[POSITION] for v in metadata["versions"].values()), default=-1) + 1,
+                    _str_or_none(version.parent_version_id),
+                    _str_or_none(version.root_message_id),
+                    time_id_serializer.to_representation({"id": version.id, "created_at": created_at})["created_at"],
+                ]
+
+        affected_ids = {
+            version_id
+            for version_id, version in metadata["versions"].items()
+            if version[PARENT_ID] in metadata["versions"]
+            and (version_id in changed_ids or version[PARENT_ID] in changed_ids)
+        }
+        messages = _load_messages(affected_ids | {metadata["versions"][v][PARENT_ID] for v in affected_ids})
+
+        changed_rows = set()
+        for version_id in affected_ids:
+            version = metadata["versions"][version_id]
+            try:
+                row = get_branch_row(messages[version_id], messages[version[PARENT_ID]], version[ROOT_MESSAGE_ID])
+            except Exception:
+                _save(conversation, None)
+                return
+            old_row = metadata["branches"].get(version_id)
+            if row == old_row:
+                continue
+            changed_rows.update(r for r in (row, old_row) if r is not None)
+            if row is None:
+                del metadata["branches"][version_id]
+            else:
+                metadata["branches"][version_id] = row
+
+        for row in changed_rows:
+            _update_row(metadata, row)
+        _save(conversation, metadata)
+
+
+def _update_row(metadata: dict, row: int) -> None:
+    pairs = [
+        (version_id, metadata["versions"][version_id][PARENT_ID])
+        for version_id, version_row in metadata["branches"].items()
+        if version_row == row
+    ]
+    if not pairs:
+        metadata["rows"].pop(str(row), None)
+        return
+
+    involved_ids = {version_id for pair in pairs for version_id in pair}
+    positions = {version_id: metadata["versions"][version_id][POSITION] for version_id in involved_ids}
+    time_ids = {
+        version_id: {"id": version_id, "created_at": metadata["versions"][version_id][CREATED_AT]}
+        for version_id in involved_ids
+    }
+    row_versions = make_row_versions(pairs, positions, time_ids, calculate_chains=True)
+    metadata["rows"][str(row)] = {
+        version_id: [v["id"] for v in message_versions] for version_id, message_versions in row_versions.items()
+    }
+
+
+def _load_messages(version_ids: set[str]) -> dict[str, list[dict]]:
+    messages = defaultdict(list)
+    for version_id, message_id, content in Message.objects.filter(version_id__in=version_ids).values_list(
+        "version_id", "id", "content"
+    ):
+        messages[str(version_id)].append({"id": str(message_id), "content": content})
+    return messages
+
+
+def _save(conversation: Conversation, metadata: Optional[dict]) -> None:
+    conversation.branch_metadata = metadata
+    Conversation.objects.filter(pk=conversation.pk).update(branch_metadata=metadata)
+
+
+def _str_or_none(value) -> Optional[str]:
+    return None if value is None else str(value)
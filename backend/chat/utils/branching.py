@@ -1,12 +1,25 @@
-from bisect import insort
-from collections import OrderedDict
-from itertools import zip_longest
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
 from operator import itemgetter
 from typing import Optional
 
 from chat.serializers import VersionTimeIdSerializer
 
-__all__ = ["make_branched_conversation"]
+__all__ = ["get_branch_row", "make_branched_conversation", "make_row_versions"]
+
+
+@dataclass(slots=True)
+class _VersionRecord:
+    """Compact view of a single serialized version, built once per `make_branched_conversation` call."""
+
+    data: OrderedDict
+    position: int
+    parent_id: str
+    root_message_id: str
+
+    @property
+    def messages(self) -> list[OrderedDict]:
+        return self.data["messages"]
 
 
 def make_branched_conversation(conversation_data: OrderedDict, calculate_chains: bool = True) -> None:
@@ -21,6 +34,9 @@ def make_branched_conversation(conversation_data: OrderedDict, calculate_chains:
     If calculate_chains is set to True, the function will also calculate and set the chains (the longest connection
     between versions) of versions for each message in the conversation data.
 
+    The versions are indexed by id once, and every version only touches the single row (message index) at which it
+    branches off its parent, so the whole computation is linear in the number of messages.
+
     Parameters
     ----------
     conversation_data : OrderedDict
@@ -31,191 +47,131 @@ def make_branched_conversation(conversation_data: OrderedDict, calculate_chains:
     Raises
     ------
     Exception
-        If there is a content mismatch between the current message and its parent message, or if there is no version
-        with the given id in the conversation data.
-    """
-
-    versions = [v for v in conversation_data["versions"]]
-    while versions:
-        curr_active_version = versions.pop()
-        curr_active_version_id = str(curr_active_version["id"])
-
-        curr_parent_version_id = str(curr_active_version["parent_version"])
-        curr_parent_version = _get_conversation_version(conversation_data, curr_parent_version_id)
-        if curr_parent_version is None:
+        If there is a content mismatch between the current message and its parent message.
+    """
+    versions = {
+        str(version_data["id"]): _VersionRecord(
+            data=version_data,
+            position=position,
+            parent_id=str(version_data["parent_version"]),
+            root_message_id=str(version_data["root_message"]),
+        )
+        for position, version_data in enumerate(conversation_data["versions"])
+    }
+
+    row_pairs = defaultdict(list)
+    for version_id, version in versions.items():
+        parent_version = versions.get(version.parent_id)
+        if parent_version is None:
             continue
+        row = get_branch_row(version.messages, parent_version.messages, version.root_message_id)
+        if row is not None:
+            row_pairs[row].append((version_id, version.parent_id))
 
-        curr_branch_msg, curr_parent_branch_msg = _get_branching_messages(curr_active_version, curr_parent_version)
-        curr_active_version_time_id = VersionTimeIdSerializer(curr_active_version).data
-        curr_parent_version_time_id = VersionTimeIdSerializer(curr_parent_version).data
-        if not _message_has_version(curr_branch_msg, curr_active_version_id):
-            _message_insort_version(curr_branch_msg, curr_active_version_time_id)
-        if not _message_has_version(curr_parent_branch_msg, curr_parent_version_id):
-            _message_insort_version(curr_parent_branch_msg, curr_parent_version_time_id)
-        _message_insort_version(curr_branch_msg, curr_parent_version_time_id)
-        _message_insort_version(curr_parent_branch_msg, curr_active_version_time_id)
+    time_id_serializer = VersionTimeIdSerializer()
+    time_ids = {}
+    for row, pairs in row_pairs.items():
+        positions = {version_id: versions[version_id].position for pair in pairs for version_id in pair}
+        for version_id in positions.keys() - time_ids.keys():
+            time_ids[version_id] = time_id_serializer.to_representation(versions[version_id].data)
+        row_versions = make_row_versions(pairs, positions, time_ids, calculate_chains)
+        for version_id, message_versions in row_versions.items():
+            versions[version_id].messages[row]["versions"] = message_versions
 
-        _set_conversation_version(conversation_data, curr_active_version_id, curr_active_version)
-        _set_conversation_version(conversation_data, curr_parent_version_id, curr_parent_version)
 
-    if calculate_chains:
-        _make_branched_conversation_chains(conversation_data)
-
-
-def _get_conversation_version(conversation_data: OrderedDict, version_id: str) -> Optional[OrderedDict]:
+def get_branch_row(
+    current_messages: list[OrderedDict], parent_messages: list[OrderedDict], root_message_id: str
+) -> Optional[int]:
     """
-    Fetches a conversation version based on its id from the conversation data.
+    Finds the row (message index) at which a version branches off its parent version.
 
     Parameters
     ----------
-    conversation_data : OrderedDict
-        The conversation serializer data.
-    version_id : str
-        The id of the version to be fetched.
+    current_messages : list[OrderedDict]
+        The messages of the current version.
+    parent_messages : list[OrderedDict]
+        The messages of the parent version.
+    root_message_id : str
+        The id of the root message of the current version.
 
     Returns
     -------
-    OrderedDict
-        The fetched version data if found, None otherwise.
-    """
-    versions = conversation_data["versions"]
-    for version in versions:
-        if version["id"] == version_id:
-            return version
-    return None
-
-
-def _get_branching_messages(curr_version: OrderedDict, parent_version: OrderedDict) -> tuple[OrderedDict, OrderedDict]:
-    """
-    Fetches the branching messages between a current version and its parent version.
-
-    Parameters
-    ----------
-    curr_version : OrderedDict
-        The current version data.
-    parent_version : OrderedDict
-        The parent version data.
+    Optional[int]
+        The index of the branching messages in both versions, None if either of the versions has no messages.
 
-    Returns
-    -------
-    tuple[OrderedDict, OrderedDict]
-        The branching messages in the current version and the parent version.
+    Raises
+    ------
+    Exception
+        If the messages differ before the branching point at any message other than the root message.
     """
-    current_messages = curr_version["messages"]
-    curr_version_root_msg = str(curr_version["root_message"])
-    parent_messages = parent_version["messages"]
-
-    msg_enumerable = zip(current_messages, parent_messages)
     n = min(len(current_messages), len(parent_messages))
     for idx in range(n - 1):
-        curr_msg, parent_msg = next(msg_enumerable)
+        curr_msg, parent_msg = current_messages[idx], parent_messages[idx]
         if curr_msg["content"] != parent_msg["content"]:
-            if parent_msg["id"] == curr_version_root_msg:
-                return curr_msg, parent_msg
+            if parent_msg["id"] == root_message_id:
+                return idx
             else:
                 raise Exception("Content mismatch between current message and parent message")  # TODO: edge cases?
 
-    if n > 0:
-        curr_branch_msg, parent_branch_msg = next(msg_enumerable)
-    else:
-        curr_branch_msg, parent_branch_msg = OrderedDict(), OrderedDict()
-    return curr_branch_msg, parent_branch_msg
+    return n - 1 if n > 0 else None
 
 
-def _message_has_version(message_data: OrderedDict, version_id: str) -> bool:
+def make_row_versions(
+    pairs: list[tuple[str, str]], positions: dict[str, int], time_ids: dict[str, OrderedDict], calculate_chains: bool
+) -> dict[str, list[OrderedDict]]:
     """
-    Checks if a message has a certain version by its id.
+    Calculates the versions lists of all messages in a single row.
+
+    Every (version, parent version) pair branching at this row adds both versions to the row messages of both versions.
+    Pairs are applied starting from the most recent version and the lists are kept ordered by the time of modification,
+    ties keeping the order in which the versions were added.
 
     Parameters
     ----------
-    message_data : OrderedDict
-        The message data.
-    version_id : str
-        The id of the version to check.
+    pairs : list[tuple[str, str]]
+        The (version id, parent version id) pairs branching at this row.
+    positions : dict[str, int]
+        The position of each version in the conversation versions.
+    time_ids : dict[str, OrderedDict]
+        The serialized id and creation time of each version.
+    calculate_chains : bool
+        Whether to replace the lists with the chains of versions.
 
     Returns
     -------
-    bool
-        True if the message has the version, False otherwise.
-    """
-    versions = message_data.get("versions", [])
-    for version in versions:
-        if version["id"] == version_id:
-            return True
-    return False
-
-
-def _message_insort_version(message_data: OrderedDict, version_time_id: OrderedDict) -> None:
-    """
-    Inserts a version into a message's versions list in sorted order.
-
-    Parameters
-    ----------
-    message_data : OrderedDict
-        The message data.
-    version_time_id : OrderedDict
-        The version data to be inserted.
+    dict[str, list[OrderedDict]]
+        The versions list of the row message of each version involved.
     """
-    if not message_data:
-        return
-    insort(message_data["versions"], version_time_id, key=itemgetter("created_at"))
-
+    row_versions = {}
+    for version_id, parent_version_id in sorted(pairs, key=lambda pair: positions[pair[0]], reverse=True):
+        version_message_versions = row_versions.setdefault(version_id, [time_ids[version_id]])
+        parent_message_versions = row_versions.setdefault(parent_version_id, [time_ids[parent_version_id]])
+        version_message_versions.append(time_ids[parent_version_id])
+        parent_message_versions.append(time_ids[version_id])
 
-def _set_conversation_version(conversation_data: OrderedDict, version_id: str, version_data: OrderedDict) -> None:
-    """
-    Sets a conversation version in the conversation data.
+    for message_versions in row_versions.values():
+        message_versions.sort(key=itemgetter("created_at"))
 
-    Parameters
-    ----------
-    conversation_data : OrderedDict
-        The conversation data.
-    version_id : str
-        The id of the version to be set.
-    version_data : OrderedDict
-        The data of the version to be set.
-    """
-    versions = conversation_data["versions"]
-    for i, version in enumerate(versions):
-        if version["id"] == version_id:
-            versions[i] = version_data
-            return
-    raise Exception("No version with the given id")
+    if calculate_chains:
+        ordered_version_ids = sorted(row_versions, key=positions.__getitem__)
+        chains = _get_version_time_id_chains([row_versions[version_id] for version_id in ordered_version_ids])
+        chain_idx_by_version_id = {v["id"]: chain_idx for chain_idx, chain in enumerate(chains) for v in chain}
+        for version_id in ordered_version_ids:
+            chain_ids = {chain_idx_by_version_id.get(v["id"]) for v in row_versions[version_id]}
+            if len(chain_ids) == 1 and None not in chain_ids:
+                row_versions[version_id] = chains[chain_ids.pop()]
 
+    return row_versions
 
-def _make_branched_conversation_chains(conversation_data: OrderedDict) -> None:
-    """
-    Calculates the chains of versions for each message in the conversation data.
 
-    Parameters
-    ----------
-    conversation_data : OrderedDict
-        The conversation data.
-    """
-    versions = [v for v in conversation_data["versions"]]
-    zipped_messages = list(zip_longest(*[v["messages"] for v in versions], fillvalue=OrderedDict()))
-
-    for idx, row in enumerate(zipped_messages):
-        # if at least there are two OrderedDicts which are not empty
-        candidate_cells = [c for c in row if c and c.get("versions", [])]
-        if len(candidate_cells) >= 1:
-            versions_to_check = [c["versions"] for c in candidate_cells]
-            version_time_id_chains = _get_version_time_id_chain(versions_to_check)
-            id_version_chain_matches = _get_version_chain_matches(candidate_cells, version_time_id_chains)
-
-            while id_version_chain_matches:
-                replacement_data = id_version_chain_matches.pop()
-                replacement_id = replacement_data["id"]
-                replacement_chain = replacement_data["chain"]
-                for v_idx, version in enumerate(versions):
-                    if idx < len(version["messages"]) and version["messages"][idx]["id"] == replacement_id:
-                        conversation_data["versions"][v_idx]["messages"][idx]["versions"] = replacement_chain
-                        break
-
-
-def _get_version_time_id_chain(list_of_versions: list[list[OrderedDict]]) -> list[list[dict]]:
+def _get_version_time_id_chains(list_of_versions: list[list[OrderedDict]]) -> list[list[OrderedDict]]:
     """
     Returns a list of chains of versions.
 
+    The sublists are merged into a graph where each version points to the version following it in any sublist, and the
+    chains are the depth-first walks of this graph from its start nodes. Start nodes and successors are visited in the
+    order they were first seen, so the result does not depend on set iteration order.
+
     Parameters
     ----------
     list_of_versions : list[list[OrderedDict]]
@@ -223,74 +179,36 @@ def _get_version_time_id_chain(list_of_versions: list[list[OrderedDict]]) -> lis
 
     Returns
     -------
-    list[list[dict]]
+    list[list[OrderedDict]]
         A list of chains of versions.
     """
     node_info = {}
     graph = {}
 
-    # Create a graph where each node is connected to its subsequent node in each sublist
     for sublist in list_of_versions:
-        for i in range(len(sublist) - 1):
-            pair = sublist[i], sublist[i + 1]
-            node, next_node = pair[0]["id"], pair[1]
-            node_info[node] = pair[0]
+        for node, next_node in zip(sublist, sublist[1:]):
+            node_info[node["id"]] = node
             node_info[next_node["id"]] = next_node
-            if node in graph:
-                graph[node].add(next_node["id"])
-            else:
-                graph[node] = {next_node["id"]}
+            graph.setdefault(node["id"], {})[next_node["id"]] = None
 
-    all_nodes = set(node_info.keys())
-    start_nodes = all_nodes - set(n for sublist in graph.values() for n in sublist)
+    next_nodes = {next_node for successors in graph.values() for next_node in successors}
+    start_nodes = [node for node in node_info if node not in next_nodes]
 
-    # Instead of creating chains from each start node, create a set of visited nodes
-    # and only start a new chain if the node hasn't been visited yet
     visited = set()
     chains = []
-
     for start in start_nodes:
         if start in visited:
             continue
 
         chain = []
         stack = [start]
-
         while stack:
             node = stack.pop()
             if node not in visited:
                 chain.append(node_info[node])
                 visited.add(node)
-                if node in graph:
-                    stack.extend(graph[node])
+                stack.extend(reversed(graph.get(node, {})))
 
         chains.append(chain)
 
     return chains
-
-
-def _get_version_chain_matches(candidates: list[OrderedDict], chains: list[list[dict]]) -> list[dict]:
-    """
-    Returns a list of matched version chains.
-
-    Parameters
-    ----------
-    candidates : list[OrderedDict]
-        A list of candidate versions.
-    chains : list[list[dict]]
-        A list of chains of versions.
-
-    Returns
-    -------
-    list[dict]
-        A list of matched version chains.
-    """
-    matched_data = []
-    for item in candidates:
-        item_versions = item["versions"]
-        for chain in chains:
-            if set(v["id"] for v in item_versions).issubset(set(v["id"] for v in chain)):
-                matched_data.append({"id": item["id"], "chain": chain})
-                break  # stop searching once we've found a match
-
-    return matched_data
@@ -0,0 +1,77 @@
+"""
+Validators of the conversation read endpoints, for conditional GETs.
+
+The views are wrapped with `django.views.decorators.http.condition`, which checks `If-None-Match` and
+`If-Modified-Since` against these validators before the view runs, so an unchanged payload is answered with 304 after
+a single query instead of being serialized and branched again. A conversation is validated by its `modified_at`,
+which every write of the conversation, its versions or messages updates. A list of conversations is validated by the
+number of the user's conversations which are not deleted together with the latest `modified_at` of all of them, as
+deleting a conversation updates its `modified_at` but takes it out of the list.
+
+The ETags are strong, the payloads being rendered the same way from the same data, while `Last-Modified` has a
+resolution of a second, so clients should prefer the ETags.
+"""
+
+import hashlib
+from datetime import datetime
+from typing import Optional
+
+from django.db.models import Count, Max, Q
+
+from chat.models import Conversation
+
+__all__ = ["conversation_etag", "conversation_last_modified", "conversations_etag", "conversations_last_modified"]
+
+
+def conversation_etag(request, pk, **kwargs) -> Optional[str]:
+    """ETag of the conversation `pk` of the user, None if it does not exist or the request is not a read."""
+    modified_at = _get_conversation_modified_at(request, pk)
+    return _make_etag(request.user.pk, pk, modified_at) if modified_at is not None else None
+
+
+def conversation_last_modified(request, pk, **kwargs) -> Optional[datetime]:
+    """Modification time of the conversation `pk` of the user, None if it does not exist or for writes."""
+    return _get_conversation_modified_at(request, pk)
+
+
+def conversations_etag(request, **kwargs) -> Optional[str]:
+    """ETag of the list of the user's conversations, None if the request is not a read."""
+    validators = _get_conversations_validators(request)
+    return _make_etag(request.user.pk, *validators) if validators is not None else None
+
+
+def conversations_last_modified(request, **kwargs) -> Optional[datetime]:
+    """Latest modification time of the user's conversations, None if there are none or the request is not a read."""
+    validators = _get_conversations_validators(request)
+    return validators[1] if validators is not None else None
+
+
+def _get_conversation_modified_at(request, pk) -> Optional[datetime]:
+    def lookup():
+        return Conversation.objects.filter(user=request.user, pk=pk).values_list("modified_at", flat=True).first()
+
+    return _get_cached(request, ("conversation", pk), lookup)
+
+
+def _get_conversations_validators(request) -> Optional[tuple[int, Optional[datetime]]]:
+    def lookup():
+        validators = Conversation.objects.filter(user=request.user).aggregate(
+            count=Count("pk", filter=Q(deleted_at__isnull=True)), modified_at=Max("modified_at")
+        )
+        return validators["count"], validators["modified_at"]
+
+    return _get_cached(request, ("conversations",), lookup)
+
+
+def _get_cached(request, key, lookup):
+    # `condition` asks for the ETag and for the last modification separately, they come from the same query
+    if request.method not in ("GET", "HEAD"):
+        return None
+    cache = request.__dict__.setdefault("_chat_validators", {})
+    if key not in cache:
+        cache[key] = lookup()
+    return cache[key]
+
+
+def _make_etag(*values) -> str:
+    return hashlib.blake2b(repr(values).encode(), digest_size=16).hexdigest()
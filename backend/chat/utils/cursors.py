@@ -0,0 +1,59 @@
+"""
+Opaque cursors of the keyset-paginated endpoints.
+
+A cursor holds the sort key of the last item of a page, the next page starts right after it. It is the URL-safe base64
+of the JSON list of the key values, so clients pass it back as it is.
+"""
+
+import base64
+import binascii
+import json
+
+__all__ = ["decode_cursor", "encode_cursor"]
+
+
+def encode_cursor(*values) -> str:
+    """
+    Encodes the sort key of the last item of a page.
+
+    Parameters
+    ----------
+    *values
+        JSON serializable values of the sort key.
+
+    Returns
+    -------
+    str
+        The cursor of the next page.
+    """
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+    """
+    Decodes a cursor made by `encode_cursor`.
+
+    Parameters
+    ----------
+    cursor : str
+        The cursor given by the client.
+    size : int
+        The number of values of the sort key.
+
+    Returns
+    -------
+    list
+        The values of the sort key.
+
+    Raises
+    ------
+    ValueError
+        If the cursor is malformed.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor")
+    return values
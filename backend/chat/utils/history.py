@@ -0,0 +1,75 @@
+"""
+Cached prompt history of conversations.
+
+The messages of a version, formatted for the chat completions API, are cached per version with their ids and the
+creation time of the last one. Messages are only ever appended to a version, so reading a history loads just the
+messages created after the cached ones, in a single indexed query, and extends the entry with them. Editing or deleting
+a cached message drops the entry once its transaction commits, from `Message.save` and `Message.delete`.
+"""
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from chat.models import Conversation, Message
+
+__all__ = ["get_conversation_history", "invalidate_history"]
+
+
+def get_conversation_history(conversation: Conversation) -> list[dict[str, str]]:
+    """
+    Returns the messages of the active version of a conversation, formatted for the chat completions API.
+
+    Parameters
+    ----------
+    conversation : Conversation
+        The conversation, with its active version selected.
+
+    Returns
+    -------
+    list[dict[str, str]]
+        The role and content of each message, in their order.
+    """
+    version = conversation.active_version
+    if version is None:
+        return []
+
+    key = _cache_key(version.id)
+    entry = cache.get(key)
+    new_messages = version.messages.select_related("role")
+    if entry is not None:
+        new_messages = new_messages.filter(created_at__gt=entry["last_created_at"])
+    new_messages = list(new_messages)
+    if not new_messages:
+        return entry["messages"] if entry is not None else []
+
+    entry = entry or {"ids": [], "messages": []}
+    entry = {
+        "ids": [*entry["ids"], *(message.id for message in new_messages)],
+        "messages": [*entry["messages"], *_format(new_messages)],
+        "last_created_at": new_messages[-1].created_at,
+    }
+    cache.set(key, entry, settings.CHAT_HISTORY_CACHE_TIMEOUT)
+    return entry["messages"]
+
+
+def invalidate_history(message: Message) -> None:
+    """Drops the cached history of the version of an edited or deleted message once the current transaction commits."""
+    transaction.on_commit(partial(_drop, message.version_id, message.id))
+
+
+def _drop(version_id, message_id) -> None:
+    key = _cache_key(version_id)
+    entry = cache.get(key)
+    # an answer completed after the history was read is not cached yet, so it does not drop the entry
+    if entry is not None and message_id in entry["ids"]:
+        cache.delete(key)
+
+
+def _cache_key(version_id) -> str:
+    return f"chat:history:{version_id}"
+
+
+def _format(messages: list[Message]) -> list[dict[str, str]]:
+    return [{"role": message.role.name, "content": message.content} for message in messages]
@@ -0,0 +1,141 @@
+"""
+Cache of the branched payloads of conversations.
+
+The branched payload of a conversation, its serializer data with the versions of each message merged in, is the most
+expensive part of the branched endpoints: it needs the versions and messages of the conversation prefetched and
+serialized. It is cached per conversation in the `payloads` cache of Django's cache framework, see `CHAT_PAYLOAD_CACHE`,
+and the list endpoint assembles its response from the cached payloads, prefetching and serializing only the
+conversations which are missing.
+
+A payload is cached together with the `modified_at` of the conversation it was built from and is only used for a
+conversation with the same `modified_at`, which every write of the conversation, its versions or messages updates, so
+a payload cached by a read running concurrently with a write is never served after it. The writes also drop the cached
+payload once their transaction commits, see `Conversation.save`, `Version.save` and `Message.delete`, so stale payloads
+do not take the place of live ones.
+"""
+
+import threading
+import time
+from functools import partial
+from typing import Iterable
+
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+
+from chat.models import Conversation, Version
+from chat.serializers import ConversationSerializer
+from chat.utils.branch_metadata import merge_branch_metadata
+
+__all__ = ["BranchedPayloadCache", "branched_payloads"]
+
+
+class BranchedPayloadCache:
+    """
+    Cache of the branched payloads of conversations counting its hits, misses and the time spent rebuilding payloads.
+
+    Examples
+    --------
+    >>> conversations = list(Conversation.objects.filter(user=user, deleted_at__isnull=True))
+    >>> payloads = branched_payloads.get_many(conversations)
+    """
+
+    def __init__(self, alias: str = "payloads"):
+        self.alias = alias
+        self._lock = threading.Lock()
+        self._counters = {}
+        self.reset_stats()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get_many(self, conversations: list[Conversation]) -> list[dict]:
+        """
+        Returns the branched payloads of conversations, building and caching the missing ones.
+
+        Parameters
+        ----------
+        conversations : list[Conversation]
+            The conversations, loaded without their versions, which are only prefetched for the missing payloads.
+
+        Returns
+        -------
+        list[dict]
+            The payload of each conversation, in the same order.
+        """
+        keys = {conversation.pk: _cache_key(conversation.pk) for conversation in conversations}
+        entries = self.cache.get_many(keys.values()) if keys else {}
+        payloads, missing = {}, []
+        for conversation in conversations:
+            entry = entries.get(keys[conversation.pk])
+            if entry is not None and entry["modified_at"] == conversation.modified_at:
+                payloads[conversation.pk] = entry["payload"]
+            else:
+                missing.append(conversation)
+
+        if missing:
+            start = time.perf_counter()
+            prefetch_related_objects(
+                missing, Prefetch("versions", queryset=Version.objects.with_serialization_fields())
+            )
+            for conversation in missing:
+                payload = ConversationSerializer(conversation).data
+                merge_branch_metadata(payload, conversation.branch_metadata)
+                payloads[conversation.pk] = payload
+            self.cache.set_many(
+                {
+                    keys[conversation.pk]: {
+                        "modified_at": conversation.modified_at,
+                        "payload": payloads[conversation.pk],
+                    }
+                    for conversation in missing
+                }
+            )
+            self._count(rebuild_seconds=time.perf_counter() - start)
+
+        self._count(hits=len(conversations) - len(missing), misses=len(missing))
+        return [payloads[conversation.pk] for conversation in conversations]
+
+    def get(self, conversation: Conversation) -> dict:
+        """Returns the branched payload of a conversation, see `get_many`."""
+        return self.get_many([conversation])[0]
+
+    def invalidate(self, conversation_ids: Iterable) -> None:
+        """Drops the cached payloads of conversations once the current transaction commits, right away outside one."""
+        keys = {_cache_key(conversation_id) for conversation_id in conversation_ids}
+        transaction.on_commit(partial(self._delete, keys))
+
+    def stats(self) -> dict[str, float]:
+        """Returns the hit and miss counters with the hit ratio, and the seconds spent rebuilding payloads."""
+        with self._lock:
+            counters = dict(self._counters)
+        hits, misses = counters["hits"], counters["misses"]
+        return {
+            **counters,
+            "hit_ratio": hits / (hits + misses) if hits + misses else 0.0,
+            "rebuild_seconds_per_payload": counters["rebuild_seconds"] / misses if misses else 0.0,
+        }
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._counters = {"hits": 0, "misses": 0, "invalidations": 0, "rebuild_seconds": 0.0}
+
+    def clear(self) -> None:
+        self.cache.clear()
+
+    def _delete(self, keys: set[str]) -> None:
+        self.cache.delete_many(list(keys))
+        self._count(invalidations=len(keys))
+
+    def _count(self, **increments: float) -> None:
+        with self._lock:
+            for name, increment in increments.items():
+                self._counters[name] += increment
+
+
+def _cache_key(conversation_id) -> str:
+    return f"chat:branched:{conversation_id}"
+
+
+branched_payloads = BranchedPayloadCache()
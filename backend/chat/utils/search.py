@@ -0,0 +1,297 @@
+"""
+Full-text search of the messages of conversations.
+
+Messages are indexed by the `chat_message_fts` SQLite FTS5 table, kept in sync with `chat_message` by triggers, so
+every write path is covered, including `bulk_create` and cascading deletes. An index row has the rowid of its message.
+Rebuilding `chat_message` in a migration drops its triggers, and VACUUM may renumber its rowids, so
+`install_search_index` runs after every `migrate` and rebuilds the index if the triggers are gone, and the
+`rebuild_search_index` command rebuilds it on demand. The insert trigger reads the owner of the message from the
+conversation tables, and SQLite refuses to rebuild a table referenced by a trigger, so `suspend_search_index` drops it
+before migrations are applied and the messages inserted meanwhile are indexed once it is restored.
+
+Search results are scoped to the non-deleted conversations of the user, ranked by BM25, and paginated by the rank and id
+of the last result. Forked versions have copies of the messages before their root message, only the message they were
+copied from is returned, found by their positions in the versions.
+"""
+
+import html
+import re
+import uuid
+from typing import Optional
+
+from django.db import connection as default_connection
+from django.db.backends.base.base import BaseDatabaseWrapper
+
+from chat.models import Message
+from chat.utils.cursors import decode_cursor, encode_cursor
+
+__all__ = [
+    "install_search_index",
+    "make_match_query",
+    "rebuild_search_index",
+    "search_messages",
+    "suspend_search_index",
+    "uninstall_search_index",
+]
+
+SNIPPET_TOKENS = 16
+_MARK_START, _MARK_END = "\x02", "\x03"
+_TERM_PATTERN = re.compile(r"\w+")
+
+# messages are indexed together with a token of their owner, so that the index only yields the messages of the user
+_OWNER_QUERY = """
+    SELECT 'u' || c.user_id FROM chat_version v JOIN chat_conversation c ON c.id = v.conversation_id
+    WHERE v.id = {message}.version_id
+"""
+
+_INDEX_MESSAGES = f"""
+    INSERT INTO chat_message_fts (rowid, content, owner)
+    SELECT chat_message.rowid, content, ({_OWNER_QUERY.format(message="chat_message")}) FROM chat_message
+"""
+
+_TRIGGERS = {
+    "chat_message_fts_insert": f"""
+        CREATE TRIGGER chat_message_fts_insert AFTER INSERT ON chat_message BEGIN
+            INSERT INTO chat_message_fts (rowid, content, owner)
+            VALUES (new.rowid, new.content, ({_OWNER_QUERY.format(message="new")}));
+        END
+    """,
+    "chat_message_fts_update": """
+        CREATE TRIGGER chat_message_fts_update AFTER UPDATE OF content ON chat_message BEGIN
+            UPDATE chat_message_fts SET content = new.content WHERE rowid = new.rowid;
+        END
+    """,
+    "chat_message_fts_delete": """
+        CREATE TRIGGER chat_message_fts_delete AFTER DELETE ON chat_message BEGIN
+            DELETE FROM chat_message_fts WHERE rowid = old.rowid;
+        END
+    """,
+}
+
+# A copy is told apart by its lineage: a message at a position of a version before its root message is a copy of the
+# message at that position of the parent version, so following the parent versions up to the first version in which
+# the position is not a copy gives the message every copy comes from.
+# Copies edited since are not dropped, as they are grouped by their content too, nor are distinct messages with the
+# same content. Snippets are only made for the messages of the page, after the matches are ranked and the copies
+# dropped, in one more pass over the matches, as looking up single rows of the index with a MATCH reads the whole
+# doclists of the terms again
+_SEARCH_QUERY = """
+    WITH matches AS MATERIALIZED (
+        SELECT
+            m.rowid AS message_rowid, m.id, m.role_id, m.content, m.created_at, v.conversation_id,
+            bm25(chat_message_fts, 1.0, 0.0) AS rank
+        FROM chat_message_fts
+        JOIN chat_message m ON m.rowid = chat_message_fts.rowid
+        JOIN chat_version v ON v.id = m.version_id
+        JOIN chat_conversation c ON c.id = v.conversation_id
+        WHERE chat_message_fts MATCH %s AND c.user_id = %s AND c.deleted_at IS NULL
+    ),
+    positions AS MATERIALIZED (
+        SELECT
+            m.id, m.version_id,
+            ROW_NUMBER() OVER (PARTITION BY m.version_id ORDER BY m.created_at, m.rowid) - 1 AS position
+        FROM chat_message m
+        JOIN chat_version v ON v.id = m.version_id
+        WHERE v.conversation_id IN (SELECT conversation_id FROM matches)
+    ),
+    versions AS MATERIALIZED (
+        SELECT v.id, v.parent_version_id, root.position AS copies_count
+        FROM chat_version v
+        LEFT JOIN positions root ON root.id = v.root_message_id
+        WHERE v.conversation_id IN (SELECT conversation_id FROM matches)
+    ),
+    lineage (message_rowid, version_id, position, depth) AS (
+        SELECT matches.message_rowid, positions.version_id, positions.position, 0
+        FROM matches
+        JOIN positions ON positions.id = matches.id
+        UNION ALL
+        SELECT lineage.message_rowid, v.parent_version_id, lineage.position, lineage.depth + 1
+        FROM lineage
+        JOIN versions v ON v.id = lineage.version_id
+        WHERE v.parent_version_id IS NOT NULL AND lineage.position < v.copies_count
+    ),
+    origins AS MATERIALIZED (
+        SELECT message_rowid, version_id AS origin_version_id, position AS origin_position
+        FROM (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY message_rowid ORDER BY depth DESC) AS step_idx FROM lineage
+        )
+        WHERE step_idx = 1
+    ),
+    page AS MATERIALIZED (
+        SELECT * FROM (
+            SELECT
+                matches.*,
+                ROW_NUMBER() OVER (
+                    PARTITION BY origin_version_id, origin_position, role_id, content ORDER BY created_at, id
+                ) AS copy_idx
+            FROM matches
+            JOIN origins ON origins.message_rowid = matches.message_rowid
+        )
+        WHERE copy_idx = 1 {after}
+        ORDER BY rank, id
+        LIMIT %s
+    ),
+    snippets AS MATERIALIZED (
+        SELECT rowid AS message_rowid, snippet(chat_message_fts, 0, char(2), char(3), '…', %s) AS snippet
+        FROM chat_message_fts
+        WHERE chat_message_fts MATCH %s AND +rowid IN (SELECT message_rowid FROM page)
+    )
+    SELECT
+        m.id, m.content, m.role_id, m.created_at, m.version_id, m.token_count,
+        page.conversation_id, c.title AS conversation_title, r.name AS role_name, page.rank, snippets.snippet
+    FROM page
+    JOIN snippets ON snippets.message_rowid = page.message_rowid
+    JOIN chat_message m ON m.rowid = page.message_rowid
+    JOIN chat_conversation c ON c.id = page.conversation_id
+    JOIN chat_role r ON r.id = m.role_id
+    ORDER BY page.rank, page.id
+"""
+
+
+def install_search_index(connection: BaseDatabaseWrapper = default_connection) -> bool:
+    """
+    Creates the search index and its triggers if they are missing. The index is rebuilt if the update or delete trigger
+    was missing, as `chat_message` was rebuilt then, and the messages missing from it are indexed if only the insert
+    trigger was missing.
+
+    Returns
+    -------
+    bool
+        Whether the index was rebuilt.
+    """
+    if connection.vendor != "sqlite":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS chat_message_fts "
+            "USING fts5(content, owner, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'chat_message' AND name LIKE %s",
+            ["chat_message_fts_%"],
+        )
+        installed = {name for (name,) in cursor.fetchall()}
+        missing = [name for name in _TRIGGERS if name not in installed]
+        for name in missing:
+            cursor.execute(_TRIGGERS[name])
+    if "chat_message_fts_update" in missing or "chat_message_fts_delete" in missing:
+        rebuild_search_index(connection)
+        return True
+    if missing:
+        with connection.cursor() as cursor:
+            cursor.execute(f"{_INDEX_MESSAGES} WHERE chat_message.rowid NOT IN (SELECT rowid FROM chat_message_fts)")
+    return False
+
+
+def suspend_search_index(connection: BaseDatabaseWrapper = default_connection) -> None:
+    """Drops the insert trigger, so that migrations can rebuild the conversation tables it reads."""
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("DROP TRIGGER IF EXISTS chat_message_fts_insert")
+
+
+def uninstall_search_index(connection: BaseDatabaseWrapper = default_connection) -> None:
+    """Drops the search index and its triggers."""
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for name in _TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute("DROP TABLE IF EXISTS chat_message_fts")
+
+
+def rebuild_search_index(connection: BaseDatabaseWrapper = default_connection) -> None:
+    """Indexes all the messages again."""
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM chat_message_fts")
+        cursor.execute(_INDEX_MESSAGES)
+        cursor.execute("INSERT INTO chat_message_fts (chat_message_fts) VALUES ('optimize')")
+
+
+def make_match_query(text: str) -> Optional[str]:
+    """
+    Makes an FTS5 query matching messages with all the words of the text, the last one as a prefix, so that results show
+    up while typing. Operators and quotes of the text are ignored rather than failing the query.
+
+    Parameters
+    ----------
+    text : str
+        The text typed by the user.
+
+    Returns
+    -------
+    Optional[str]
+        The FTS5 query, None if the text has no words.
+    """
+    terms = _TERM_PATTERN.findall(text)
+    if not terms:
+        return None
+    return " ".join(f'"{term}"' for term in terms) + "*"
+
+
+def search_messages(user, text: str, limit: int = 20, cursor: Optional[str] = None) -> tuple[list[dict], Optional[str]]:
+    """
+    Searches the messages of the non-deleted conversations of the user.
+
+    Parameters
+    ----------
+    user : CustomUser
+        The owner of the conversations.
+    text : str
+        The searched text, see `make_match_query`.
+    limit : int, optional
+        The number of results per page. Default is 20.
+    cursor : Optional[str], optional
+        The cursor of the page, as returned with the previous page. Default is None, the first page.
+
+    Returns
+    -------
+    tuple[list[dict], Optional[str]]
+        The results, best first, and the cursor of the next page, None if it is the last page.
+
+    Raises
+    ------
+    ValueError
+        If the text has no words or the cursor is malformed.
+    """
+    match_query = make_match_query(text)
+    if match_query is None:
+        raise ValueError("Search query has no words")
+
+    match_query = f"owner:u{int(user.pk)} AND content:({match_query})"
+    params = [match_query, user.pk]
+    after = ""
+    if cursor is not None:
+        rank, message_id = decode_cursor(cursor, 2)
+        # checked here, the values are bound as they are and SQLite cannot bind lists or objects
+        if isinstance(rank, bool) or not isinstance(rank, (int, float)) or not isinstance(message_id, str):
+            raise ValueError("Invalid cursor")
+        after = "AND (rank > %s OR (rank = %s AND id > %s))"
+        params += [rank, rank, message_id]
+    params += [limit + 1, SNIPPET_TOKENS, match_query]
+
+    messages = list(Message.objects.raw(_SEARCH_QUERY.format(after=after), params))
+    next_cursor = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        next_cursor = encode_cursor(messages[-1].rank, messages[-1].id.hex)
+
+    results = [
+        {
+            "conversation_id": uuid.UUID(message.conversation_id),
+            "conversation_title": message.conversation_title,
+            "version_id": message.version_id,
+            "message_id": message.id,
+            "role": message.role_name,
+            "snippet": _format_snippet(message.snippet),
+            "created_at": message.created_at,
+        }
+        for message in messages
+    ]
+    return results, next_cursor
+
+
+def _format_snippet(snippet: str) -> str:
+    """Escapes the snippet as HTML and marks the matched words with `<mark>`."""
+    return html.escape(snippet).replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>")
@@ -0,0 +1,118 @@
+"""
+Denormalized summary of a conversation.
+
+Conversation lists show the number of versions of each conversation, together with the number of messages, the token
+count and the last message of its active version. These are stored in the `Conversation` summary fields and updated by
+the write views in the same transaction as the messages and versions, so lists need neither to load versions and
+messages nor to count them per row. Appending to the active version updates the fields with `F` expressions, switching
+the active version computes them again. The `check_conversation_summaries` command compares them with freshly computed
+ones and repairs them.
+"""
+
+from typing import Iterable
+
+from django.db.models import F, Prefetch
+
+from chat.models import SUMMARY_FIELDS, Conversation, Message, Version
+
+__all__ = [
+    "add_messages_to_summary",
+    "add_version_to_summary",
+    "compute_summary",
+    "get_summary",
+    "refresh_summary",
+]
+
+
+def add_messages_to_summary(conversation: Conversation, version: Version, messages: Iterable[Message]) -> None:
+    """
+    Updates the summary after messages were appended to a version, which only changes it for the active version.
+
+    Parameters
+    ----------
+    conversation : Conversation
+        The conversation of the version.
+    version : Version
+        The version the messages were appended to.
+    messages : Iterable[Message]
+        The appended messages, oldest first.
+    """
+    messages = list(messages)
+    if version.id != conversation.active_version_id or not messages:
+        return
+    Conversation.objects.filter(pk=conversation.pk).update(
+        message_count=F("message_count") + len(messages),
+        total_tokens=F("total_tokens") + _count_tokens(messages),
+        last_message_preview=_preview(messages[-1]),
+    )
+
+
+def add_version_to_summary(conversation: Conversation, messages: list[Message]) -> None:
+    """
+    Updates the summary after a version was added and made the active one.
+
+    Parameters
+    ----------
+    conversation : Conversation
+        The conversation of the version.
+    messages : list[Message]
+        All the messages of the new version.
+    """
+    Conversation.objects.filter(pk=conversation.pk).update(
+        version_count=F("version_count") + 1,
+        message_count=len(messages),
+        total_tokens=_count_tokens(messages),
+        last_message_preview=_preview(messages[-1]) if messages else "",
+    )
+
+
+def compute_summary(conversation: Conversation) -> dict:
+    """
+    Computes the summary of a conversation from its versions and messages.
+
+    Parameters
+    ----------
+    conversation : Conversation
+        The conversation.
+
+    Returns
+    -------
+    dict
+        The values of the `SUMMARY_FIELDS`.
+    """
+    versions = list(
+        Version.objects.filter(conversation=conversation).prefetch_related(
+            Prefetch("messages", queryset=Message.objects.select_related("role"))
+        )
+    )
+    active_version = next((version for version in versions if version.id == conversation.active_version_id), None)
+    messages = list(active_version.messages.all()) if active_version is not None else []
+    return {
+        "version_count": len(versions),
+        "message_count": len(messages),
+        "total_tokens": _count_tokens(messages),
+        "last_message_preview": _preview(messages[-1]) if messages else "",
+    }
+
+
+def get_summary(conversation: Conversation) -> dict:
+    """Returns the stored values of the `SUMMARY_FIELDS`."""
+    return {field: getattr(conversation, field) for field in SUMMARY_FIELDS}
+
+
+def refresh_summary(conversation: Conversation) -> dict:
+    """Computes and stores the summary of a conversation, e.g. after its active version was switched."""
+    summary = compute_summary(conversation)
+    Conversation.objects.filter(pk=conversation.pk).update(**summary)
+    for field, value in summary.items():
+        setattr(conversation, field, value)
+    return summary
+
+
+def _count_tokens(messages: Iterable[Message]) -> int:
+    return sum(message.count_tokens() if message.token_count is None else message.token_count for message in messages)
+
+
+def _preview(message: Message) -> str:
+    max_length = Conversation._meta.get_field("last_message_preview").max_length
+    return message.content[:max_length]
@@ -0,0 +1,182 @@
+"""
+Delta sync of the conversation store.
+
+The write views record what they change in the `Change` log, in the same transaction as the change: the conversation,
+together with its new or changed versions and messages, or the conversation as deleted. A client keeps a local copy of
+the user's conversations by loading a snapshot once, `get_snapshot`, and then pulling the conversations, versions and
+messages changed after its cursor, `get_changes`, instead of loading and branching every conversation again.
+
+The cursor is the id of the last change the client has seen. Changes are pulled in pages of at most `limit` changes,
+each change reported once with the current state of its object, or as deleted if the object is gone or its
+conversation was deleted, which also deletes its versions and messages. The log is pruned by the `prune_changes`
+command, so a client whose cursor is older than the oldest change kept gets a snapshot again, as does a client whose
+cursor is ahead of the last change, e.g. after the database was restored from a backup.
+"""
+
+from typing import Iterable, Optional
+
+from django.db.models import Max, Min
+
+from authentication.models import CustomUser
+from chat.models import Change, Conversation, Message, Version
+from chat.serializers import SyncConversationSerializer, SyncMessageSerializer, SyncVersionSerializer
+
+__all__ = ["get_changes", "get_snapshot", "prune_changes", "record_changes"]
+
+KINDS = [Change.CONVERSATION, Change.VERSION, Change.MESSAGE]
+
+
+def record_changes(
+    conversation: Conversation,
+    versions: Iterable[Version] = (),
+    messages: Iterable[Message] = (),
+    deleted: bool = False,
+) -> None:
+    """
+    Records changes of a conversation in the change log, to be called in the transaction making them.
+
+    Parameters
+    ----------
+    conversation : Conversation
+        The changed conversation.
+    versions : Iterable[Version]
+        The new or changed versions of the conversation.
+    messages : Iterable[Message]
+        The new or changed messages of the conversation.
+    deleted : bool
+        Whether the conversation was deleted, soft or hard.
+    """
+    changes = [
+        Change(
+            user_id=conversation.user_id,
+            conversation_id=conversation.pk,
+            kind=Change.CONVERSATION,
+            object_id=conversation.pk,
+            deleted=deleted,
+        )
+    ]
+    for kind, objects in ((Change.VERSION, versions), (Change.MESSAGE, messages)):
+        changes += [
+            Change(user_id=conversation.user_id, conversation_id=conversation.pk, kind=kind, object_id=obj.pk)
+            for obj in objects
+        ]
+    Change.objects.bulk_create(changes)
+
+
+def get_snapshot(user: CustomUser) -> dict:
+    """
+    Returns all conversations of a user which are not deleted, with their versions and messages.
+
+    Parameters
+    ----------
+    user : CustomUser
+        The user.
+
+    Returns
+    -------
+    dict
+        The page of the snapshot, see `get_changes`, with `reset` set.
+    """
+    # taken first, so changes made while the snapshot is read are pulled again rather than missed
+    cursor = _get_head()
+    conversations = Conversation.objects.filter(user=user, deleted_at__isnull=True)
+    versions = Version.objects.filter(conversation__in=conversations)
+    messages = Message.objects.filter(version__in=versions).select_related("role")
+    return _make_page(conversations, versions, messages, {}, cursor, has_more=False, reset=True)
+
+
+def get_changes(user: CustomUser, cursor: int, limit: int) -> dict:
+    """
+    Returns the conversations, versions and messages of a user changed after a cursor.
+
+    Parameters
+    ----------
+    user : CustomUser
+        The user.
+    cursor : int
+        The `cursor` of the previous page or snapshot.
+    limit : int
+        Changes per page.
+
+    Returns
+    -------
+    dict
+        The page, with the current state of the changed `conversations`, `versions` and `messages`, the ids of the
+        `deleted` ones by kind, the `cursor` of the next page, whether it `has_more` changes already, and whether it
+        is a snapshot which should `reset` the local copy, given when the cursor is older than the change log or
+        ahead of it.
+    """
+    head = _get_head()
+    first = Change.objects.aggregate(first=Min("id"))["first"]
+    if cursor > head or (first is not None and cursor < first - 1):
+        return get_snapshot(user)
+
+    # one more change tells whether there is a next page
+    page_size = limit + 1
+    changes = list(Change.objects.filter(user=user, id__gt=cursor, id__lte=head).order_by("id")[:page_size])
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    # the last change of each object is the one which counts
+    deleted_by_key = {(change.kind, change.object_id): change.deleted for change in changes}
+    ids = {kind: set() for kind in KINDS}
+    deleted_ids = {kind: set() for kind in KINDS}
+    for (kind, object_id), deleted in deleted_by_key.items():
+        (deleted_ids if deleted else ids)[kind].add(object_id)
+
+    conversations = list(
+        Conversation.objects.filter(user=user, deleted_at__isnull=True, pk__in=ids[Change.CONVERSATION])
+    )
+    versions = list(
+        Version.objects.filter(
+            conversation__user=user, conversation__deleted_at__isnull=True, pk__in=ids[Change.VERSION]
+        )
+    )
+    messages = list(
+        Message.objects.filter(
+            version__conversation__user=user,
+            version__conversation__deleted_at__isnull=True,
+            pk__in=ids[Change.MESSAGE],
+        ).select_related("role")
+    )
+    # changed objects which are gone, or whose conversation is deleted, are deleted for the client
+    for kind, objects in ((Change.CONVERSATION, conversations), (Change.VERSION, versions), (Change.MESSAGE, messages)):
+        deleted_ids[kind] |= ids[kind] - {obj.pk for obj in objects}
+
+    next_cursor = changes[-1].id if has_more else head
+    return _make_page(conversations, versions, messages, deleted_ids, next_cursor, has_more, reset=False)
+
+
+def prune_changes(before_id: Optional[int] = None) -> int:
+    """
+    Deletes the changes older than a change, keeping the last change so that the cursors older than the log are told.
+
+    Parameters
+    ----------
+    before_id : Optional[int]
+        Id of the oldest change kept, only the last change is kept if None.
+
+    Returns
+    -------
+    int
+        The number of deleted changes.
+    """
+    head = _get_head()
+    before_id = head if before_id is None else min(before_id, head)
+    deleted_count, _ = Change.objects.filter(id__lt=before_id).delete()
+    return deleted_count
+
+
+def _get_head() -> int:
+    return Change.objects.aggregate(head=Max("id"))["head"] or 0
+
+
+def _make_page(conversations, versions, messages, deleted_ids: dict, cursor: int, has_more: bool, reset: bool) -> dict:
+    return {
+        "conversations": SyncConversationSerializer(conversations, many=True).data,
+        "versions": SyncVersionSerializer(versions, many=True).data,
+        "messages": SyncMessageSerializer(messages, many=True).data,
+        "deleted": {f"{kind}s": sorted(str(object_id) for object_id in deleted_ids.get(kind, ())) for kind in KINDS},
+        "cursor": str(cursor),
+        "has_more": has_more,
+        "reset": reset,
+    }
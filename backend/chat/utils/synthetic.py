@@ -0,0 +1,119 @@
+import random
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+
+__all__ = ["make_synthetic_conversation_data"]
+
+
+def make_synthetic_conversation_data(
+    versions_count: int, messages_count: int = 6, unique_roots: bool = False, seed: int = 0
+) -> OrderedDict:
+    """
+    Builds conversation serializer data with a random tree of versions, the way the chat views would produce it.
+
+    Every new version branches off a random message (its root message) of a random existing version: it gets a copy of
+    the parent messages before the root message, followed by its own new messages.
+
+    Parameters
+    ----------
+    versions_count : int
+        The number of versions in the conversation.
+    messages_count : int, optional
+        The number of messages in the first version and the typical length of the other ones. Default is 6.
+    unique_roots : bool, optional
+        Whether every message can be the root message of at most one version. Default is False.
+    seed : int, optional
+        The seed of the random generator. Default is 0.
+
+    Returns
+    -------
+    OrderedDict
+        The conversation data, shaped like the `ConversationSerializer` data.
+    """
+    rng = random.Random(seed)
+    conversation_id = str(_uuid(rng))
+    clock = _Clock(timezone.make_aware(datetime(2023, 1, 1, 12, 0, 0)))
+    conversation_created_at = clock.tick()
+
+    first_version = _make_version(rng, conversation_id, None, None, conversation_created_at)
+    first_version["messages"] = [_make_message(rng, clock, idx) for idx in range(messages_count)]
+    versions = [first_version]
+
+    used_root_ids = set()
+    while len(versions) < versions_count:
+        parent_version = rng.choice(versions)
+        if not parent_version["messages"]:
+            continue
+        root_idx = rng.randrange(len(parent_version["messages"]))
+        root_message = parent_version["messages"][root_idx]
+        if unique_roots and root_message["id"] in used_root_ids:
+            continue
+        used_root_ids.add(root_message["id"])
+
+        version = _make_version(
+            rng, conversation_id, parent_version["id"], root_message["id"], created_at=root_message["_at"]
+        )
+        copies = [_copy_message(rng, clock, message) for message in parent_version["messages"][:root_idx]]
+        min_new_messages = 1 if unique_roots else 0
+        new_count = rng.randint(min_new_messages, max(min_new_messages, messages_count - root_idx))
+        version["messages"] = copies + [_make_message(rng, clock, root_idx + idx) for idx in range(new_count)]
+        versions.append(version)
+
+    for version in versions:
+        version["active"] = version is versions[-1]
+        for message in version["messages"]:
+            del message["_at"]
+
+    return OrderedDict(
+        id=conversation_id,
+        title="Synthetic conversation",
+        active_version=versions[-1]["id"],
+        versions=versions,
+        modified_at=clock.tick(),
+    )
+
+
+class _Clock:
+    def __init__(self, start: datetime):
+        self.now = start
+
+    def tick(self) -> datetime:
+        self.now += timedelta(seconds=1)
+        return self.now
+
+
+def _uuid(rng: random.Random) -> uuid.UUID:
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+
+def _make_version(rng, conversation_id, parent_version, root_message, created_at) -> OrderedDict:
+    return OrderedDict(
+        id=str(_uuid(rng)),
+        conversation_id=conversation_id,
+        root_message=None if root_message is None else uuid.UUID(root_message),
+        messages=[],
+        active=False,
+        created_at=created_at,
+        parent_version=None if parent_version is None else uuid.UUID(parent_version),
+    )
+
+
+def _make_message(rng, clock, idx) -> OrderedDict:
+    created_at = clock.tick()
+    return OrderedDict(
+        id=str(_uuid(rng)),
+        content=f"Message {rng.getrandbits(64):x}",
+        role="user" if idx % 2 == 0 else "assistant",
+        created_at=created_at.isoformat(),
+        versions=[],
+        _at=created_at,
+    )
+
+
+def _copy_message(rng, clock, message) -> OrderedDict:
+    copy = _make_message(rng, clock, 0)
+    copy["content"], copy["role"] = message["content"], message["role"]
+    return copy
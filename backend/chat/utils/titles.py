@@ -0,0 +1,136 @@
+"""
+Background generation of conversation titles.
+
+Once the first answer of a conversation is stored, the conversation is queued for a title, which a worker thread
+generates and writes to `Conversation.title` outside of the request cycle. The worker takes all the conversations queued
+while it was busy, up to `CHAT_TITLE_BATCH_SIZE`, and makes their titles with one upstream call. A title set meanwhile
+by the user is not overwritten. A batch which fails, e.g. while the upstream is overloaded, is queued again after a
+delay, up to `max_attempts` times.
+"""
+
+import logging
+import threading
+import time
+from typing import Optional
+from uuid import UUID
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from chat.models import DEFAULT_TITLE, Conversation, Version
+from chat.utils.payloads import branched_payloads
+from chat.utils.sync import record_changes
+from src.utils.gpt import get_gpt_titles
+
+__all__ = ["TitleWorker", "title_worker"]
+
+logger = logging.getLogger(__name__)
+
+
+class TitleWorker:
+    """
+    Queue of the conversations waiting for a title, processed by a daemon thread started on the first `enqueue`.
+
+    Examples
+    --------
+    >>> title_worker.enqueue(conversation.id)
+    >>> title_worker.wait(timeout=10)
+    """
+
+    def __init__(self, batch_size: int = 8, max_attempts: int = 3, retry_delay: float = 5.0):
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        # the queued conversations with the attempts already made for their titles
+        self._pending = {}
+        self._in_progress = set()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def enqueue(self, conversation_id: UUID) -> None:
+        with self._condition:
+            if conversation_id in self._pending or conversation_id in self._in_progress:
+                return
+            self._pending[conversation_id] = 0
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="title-worker", daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def is_pending(self, conversation_id: UUID) -> bool:
+        """Returns whether the title of the conversation is queued or being generated."""
+        with self._condition:
+            return conversation_id in self._pending or conversation_id in self._in_progress
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Waits until no title is queued or being generated, returns False on timeout."""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and not self._in_progress, timeout)
+
+    def process(self, conversation_ids: list[UUID]) -> None:
+        """Writes the titles of the conversations which still have the default one."""
+        conversations = list(
+            Conversation.objects.filter(pk__in=conversation_ids, title=DEFAULT_TITLE, deleted_at__isnull=True)
+            .exclude(active_version=None)
+            .select_related("active_version")
+        )
+        first_messages = [_get_first_messages(conversation.active_version) for conversation in conversations]
+        conversations_to_title = [
+            (conversation, messages) for conversation, messages in zip(conversations, first_messages) if messages
+        ]
+        if not conversations_to_title:
+            return
+
+        titles = get_gpt_titles([messages for _, messages in conversations_to_title])
+        for (conversation, _), title in zip(conversations_to_title, titles):
+            title = title.strip()[: Conversation._meta.get_field("title").max_length]
+            if not title:
+                continue
+            with transaction.atomic():
+                updated = Conversation.objects.filter(pk=conversation.pk, title=DEFAULT_TITLE).update(
+                    title=title, modified_at=timezone.now()
+                )
+                if updated:
+                    record_changes(conversation)
+                    branched_payloads.invalidate([conversation.pk])
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending)
+                batch = list(self._pending)[: self.batch_size]
+                attempts = {conversation_id: self._pending.pop(conversation_id) + 1 for conversation_id in batch}
+                self._in_progress.update(batch)
+
+            failed = False
+            try:
+                self.process(batch)
+            except Exception:
+                failed = True
+                logger.exception("Generating the titles of %s conversations failed", len(batch))
+            finally:
+                close_old_connections()
+                retried = [pk for pk in batch if attempts[pk] < self.max_attempts] if failed else []
+                with self._condition:
+                    self._in_progress.difference_update(batch)
+                    for pk in retried:
+                        self._pending.setdefault(pk, attempts[pk])
+                    if failed and len(retried) < len(batch):
+                        logger.warning("Gave up the titles of %s conversations", len(batch) - len(retried))
+                    self._condition.notify_all()
+            if retried:
+                time.sleep(self.retry_delay)
+
+
+def _get_first_messages(version: Version) -> Optional[tuple[str, str]]:
+    """Returns the first user message and the first answer of the version, None if it has no answer yet."""
+    messages = list(version.messages.select_related("role"))
+    question = next((message.content for message in messages if message.role.name == "user"), None)
+    answer = next((message.content for message in messages if message.role.name == "assistant"), None)
+    if question is None or answer is None:
+        return None
+    return question, answer
+
+
+title_worker = TitleWorker(settings.CHAT_TITLE_BATCH_SIZE)
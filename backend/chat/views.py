@@ -1,12 +1,44 @@
+import uuid
+from datetime import datetime
+
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
+from django.views.decorators.http import condition
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
-from chat.models import Conversation, Message, Version
-from chat.serializers import ConversationSerializer, MessageSerializer, TitleSerializer, VersionSerializer
-from chat.utils.branching import make_branched_conversation
+from chat.models import DEFAULT_TITLE, SUMMARY_FIELDS, Conversation, Message, Version
+from chat.serializers import (
+    ConversationSerializer,
+    ConversationSummarySerializer,
+    MessageSerializer,
+    TitleSerializer,
+    VersionSerializer,
+)
+from chat.utils.branch_metadata import empty_branch_metadata, update_branch_metadata
+from chat.utils.conditional import (
+    conversation_etag,
+    conversation_last_modified,
+    conversations_etag,
+    conversations_last_modified,
+)
+from chat.utils.cursors import decode_cursor, encode_cursor
+from chat.utils.payloads import branched_payloads
+from chat.utils.search import search_messages
+from chat.utils.summary import add_messages_to_summary, add_version_to_summary, refresh_summary
+from chat.utils.sync import get_changes, get_snapshot, record_changes
+from chat.utils.titles import title_worker
+
+ADD_MESSAGES_MAX_BATCH = 1000
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+SUMMARIES_PAGE_SIZE = 50
+SUMMARIES_MAX_PAGE_SIZE = 200
+SYNC_PAGE_SIZE = 1000
+SYNC_MAX_PAGE_SIZE = 5000
 
 
 @api_view(["GET"])
@@ -15,27 +47,66 @@ def chat_root_view(request):
 
 
 @login_required
+@condition(etag_func=conversations_etag, last_modified_func=conversations_last_modified)
 @api_view(["GET"])
 def get_conversations(request):
-    conversations = Conversation.objects.filter(user=request.user, deleted_at__isnull=True).order_by("-modified_at")
+    conversations = (
+        Conversation.objects.filter(user=request.user, deleted_at__isnull=True).order_by("-modified_at").with_versions()
+    )
     serializer = ConversationSerializer(conversations, many=True)
     return Response(serializer.data, status=status.HTTP_200_OK)
 
 
 @login_required
 @api_view(["GET"])
-def get_conversations_branched(request):
-    conversations = Conversation.objects.filter(user=request.user, deleted_at__isnull=True).order_by("-modified_at")
-    conversations_serializer = ConversationSerializer(conversations, many=True)
-    conversations_data = conversations_serializer.data
+def get_conversation_summaries(request):
+    """
+    Lightweight list of the user's conversations for the sidebar, newest first, with their stored summaries instead of
+    versions and messages. Pages have `limit` conversations, the next one starts at the `next_cursor` of the previous
+    page.
+    """
+    conversations = Conversation.objects.filter(user=request.user, deleted_at__isnull=True)
+    try:
+        limit = min(max(int(request.query_params.get("limit", SUMMARIES_PAGE_SIZE)), 1), SUMMARIES_MAX_PAGE_SIZE)
+        cursor = request.query_params.get("cursor")
+        if cursor is not None:
+            modified_at, pk = decode_cursor(cursor, 2)
+            # checked here, parsing values of other JSON types raises other errors than ValueError
+            if not isinstance(modified_at, str) or not isinstance(pk, str):
+                raise ValueError("Invalid cursor")
+            modified_at, pk = datetime.fromisoformat(modified_at), uuid.UUID(pk)
+            # the redundant bound lets the index seek to the cursor instead of skipping the previous pages
+            conversations = conversations.filter(
+                Q(modified_at__lt=modified_at) | Q(modified_at=modified_at, pk__lt=pk), modified_at__lte=modified_at
+            )
+    except (TypeError, ValueError):
+        return Response({"detail": "Invalid limit or cursor"}, status=status.HTTP_400_BAD_REQUEST)
+
+    conversations = conversations.order_by("-modified_at", "-pk").only("id", "title", "modified_at", *SUMMARY_FIELDS)
+    # one more conversation tells whether there is a next page
+    page_size = limit + 1
+    conversations = list(conversations[:page_size])
+    next_cursor = None
+    if len(conversations) > limit:
+        conversations = conversations[:limit]
+        next_cursor = encode_cursor(conversations[-1].modified_at.isoformat(), conversations[-1].pk.hex)
+
+    serializer = ConversationSummarySerializer(conversations, many=True)
+    return Response({"results": serializer.data, "next_cursor": next_cursor}, status=status.HTTP_200_OK)
 
-    for conversation_data in conversations_data:
-        make_branched_conversation(conversation_data)
 
+@login_required
+@condition(etag_func=conversations_etag, last_modified_func=conversations_last_modified)
+@api_view(["GET"])
+def get_conversations_branched(request):
+    conversations = Conversation.objects.filter(user=request.user, deleted_at__isnull=True).order_by("-modified_at")
+    # only the conversations changed since their payload was cached are serialized and branched again
+    conversations_data = branched_payloads.get_many(list(conversations))
     return Response(conversations_data, status=status.HTTP_200_OK)
 
 
 @login_required
+@condition(etag_func=conversation_etag, last_modified_func=conversation_last_modified)
 @api_view(["GET"])
 def get_conversation_branched(request, pk):
     try:
@@ -43,45 +114,96 @@ def get_conversation_branched(request, pk):
     except Conversation.DoesNotExist:
         return Response({"detail": "Conversation not found"}, status=status.HTTP_404_NOT_FOUND)
 
-    conversation_serializer = ConversationSerializer(conversation)
-    conversation_data = conversation_serializer.data
-    make_branched_conversation(conversation_data)
-
+    conversation_data = branched_payloads.get(conversation)
     return Response(conversation_data, status=status.HTTP_200_OK)
 
 
+@login_required
+@api_view(["GET"])
+def get_payload_cache_stats(request):
+    """Hits, misses and hit ratio of the cache of branched payloads, with the time spent rebuilding payloads."""
+    return Response(branched_payloads.stats(), status=status.HTTP_200_OK)
+
+
+@login_required
+@api_view(["GET"])
+def sync(request):
+    """
+    Changes of the user's conversations, versions and messages after `cursor`, the `cursor` of the previous page, for
+    keeping a local copy of them. Without a cursor, or with one older than the change log, it returns a snapshot of all
+    of them with `reset` set. Pages have at most `limit` changes, `has_more` tells whether the next page has more.
+    """
+    try:
+        limit = min(max(int(request.query_params.get("limit", SYNC_PAGE_SIZE)), 1), SYNC_MAX_PAGE_SIZE)
+        cursor = request.query_params.get("cursor")
+        cursor = int(cursor) if cursor is not None else None
+        if cursor is not None and cursor < 0:
+            raise ValueError(cursor)
+    except ValueError:
+        return Response({"detail": "Invalid limit or cursor"}, status=status.HTTP_400_BAD_REQUEST)
+
+    page = get_snapshot(request.user) if cursor is None else get_changes(request.user, cursor, limit)
+    return Response(page, status=status.HTTP_200_OK)
+
+
+@login_required
+@api_view(["GET"])
+def search(request):
+    """
+    Full-text search of the messages of the user's conversations, `q` is the searched text, `limit` the results per page
+    and `cursor` the `next_cursor` of the previous page.
+    """
+    try:
+        limit = min(max(int(request.query_params.get("limit", SEARCH_PAGE_SIZE)), 1), SEARCH_MAX_PAGE_SIZE)
+        results, next_cursor = search_messages(
+            request.user, request.query_params.get("q", ""), limit, request.query_params.get("cursor")
+        )
+    except ValueError as e:
+        return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({"results": results, "next_cursor": next_cursor}, status=status.HTTP_200_OK)
+
+
 @login_required
 @api_view(["POST"])
 def add_conversation(request):
     try:
-        conversation_data = {"title": request.data.get("title", "Mock title"), "user": request.user}
-        conversation = Conversation.objects.create(**conversation_data)
-        version = Version.objects.create(conversation=conversation)
-
-        messages_data = request.data.get("messages", [])
-        for idx, message_data in enumerate(messages_data):
-            message_serializer = MessageSerializer(data=message_data)
-            if message_serializer.is_valid():
-                message_serializer.save(version=version)
-                if idx == 0:
-                    version.save()
-            else:
-                return Response(message_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
+        # the messages are validated together, before anything is written
+        messages_serializer = MessageSerializer(data=request.data.get("messages", []), many=True)
+        if not messages_serializer.is_valid():
+            return Response(messages_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # the primary keys are generated UUIDs, so the conversation is created together with its active version
+        conversation = Conversation(
+            title=request.data.get("title", DEFAULT_TITLE),
+            user=request.user,
+            branch_metadata=empty_branch_metadata(),
+        )
+        version = Version(conversation=conversation)
         conversation.active_version = version
-        conversation.save()
-
-        serializer = ConversationSerializer(conversation)
+        with transaction.atomic():
+            conversation.save()
+            version.save()
+            messages = messages_serializer.save(version=version)
+            add_version_to_summary(conversation, messages)
+            update_branch_metadata(conversation, [version])
+            record_changes(conversation, [version], messages)
+
+        serializer = ConversationSerializer(Conversation.objects.with_versions().get(pk=conversation.pk))
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     except Exception as e:
         return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
 @login_required
+@condition(etag_func=conversation_etag, last_modified_func=conversation_last_modified)
 @api_view(["GET", "PUT", "DELETE"])
 def conversation_manage(request, pk):
+    conversations = Conversation.objects.filter(user=request.user)
+    if request.method == "GET":
+        conversations = conversations.with_versions()
     try:
-        conversation = Conversation.objects.get(user=request.user, pk=pk)
+        conversation = conversations.get(pk=pk)
     except Conversation.DoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
 
@@ -92,12 +214,22 @@ def conversation_manage(request, pk):
     elif request.method == "PUT":
         serializer = ConversationSerializer(conversation, data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            with transaction.atomic():
+                serializer.save()
+                refresh_summary(conversation)
+                # versions and messages may have been changed as well
+                record_changes(
+                    conversation,
+                    conversation.versions.all(),
+                    Message.objects.filter(version__conversation=conversation),
+                )
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     elif request.method == "DELETE":
-        conversation.delete()
+        with transaction.atomic():
+            record_changes(conversation, deleted=True)
+            conversation.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -113,12 +245,28 @@ def conversation_change_title(request, pk):
 
     if serializer.is_valid():
         conversation.title = serializer.data.get("title")
-        conversation.save()
+        with transaction.atomic():
+            conversation.save(update_fields=["title", "modified_at"])
+            record_changes(conversation)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     return Response({"detail": "Title not provided"}, status=status.HTTP_400_BAD_REQUEST)
 
 
+@login_required
+@api_view(["GET"])
+def conversation_title(request, pk):
+    """Returns the title of the conversation and whether it is being generated, for polling after the first answer."""
+    try:
+        conversation = Conversation.objects.only("title").get(user=request.user, pk=pk)
+    except Conversation.DoesNotExist:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+
+    return Response(
+        {"title": conversation.title, "pending": title_worker.is_pending(conversation.pk)}, status=status.HTTP_200_OK
+    )
+
+
 @login_required
 @api_view(["PUT"])
 def conversation_soft_delete(request, pk):
@@ -128,7 +276,9 @@ def conversation_soft_delete(request, pk):
         return Response(status=status.HTTP_404_NOT_FOUND)
 
     conversation.deleted_at = timezone.now()
-    conversation.save()
+    with transaction.atomic():
+        conversation.save(update_fields=["deleted_at", "modified_at"])
+        record_changes(conversation, deleted=True)
     return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -146,7 +296,11 @@ def conversation_add_message(request, pk):
 
     serializer = MessageSerializer(data=request.data)
     if serializer.is_valid():
-        serializer.save(version=version)
+        with transaction.atomic():
+            message = serializer.save(version=version)
+            add_messages_to_summary(conversation, version, [message])
+            update_branch_metadata(conversation, [version])
+            record_changes(conversation, messages=[message])
         # return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(
             {
@@ -158,12 +312,56 @@ def conversation_add_message(request, pk):
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@login_required
+@api_view(["POST"])
+def conversation_add_messages(request, pk):
+    """
+    Appends `messages`, a list of messages as taken by `conversation_add_message`, to the active version of the
+    conversation. They are validated together and written with a single insert, at most `ADD_MESSAGES_MAX_BATCH` of
+    them at once.
+    """
+    try:
+        conversation = Conversation.objects.select_related("active_version").get(user=request.user, pk=pk)
+        version = conversation.active_version
+    except Conversation.DoesNotExist:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+
+    if version is None:
+        return Response({"detail": "Active version not set for this conversation."}, status=status.HTTP_400_BAD_REQUEST)
+
+    messages_data = request.data.get("messages")
+    if not isinstance(messages_data, list) or not messages_data:
+        return Response({"detail": "Messages not provided"}, status=status.HTTP_400_BAD_REQUEST)
+    if len(messages_data) > ADD_MESSAGES_MAX_BATCH:
+        return Response(
+            {"detail": f"At most {ADD_MESSAGES_MAX_BATCH} messages can be added at once"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    serializer = MessageSerializer(data=messages_data, many=True)
+    if serializer.is_valid():
+        # saves the conversation loaded above instead of loading it again through the version
+        version.conversation = conversation
+        with transaction.atomic():
+            messages = serializer.save(version=version)
+            add_messages_to_summary(conversation, version, messages)
+            update_branch_metadata(conversation, [version])
+            record_changes(conversation, messages=messages)
+        return Response(
+            {
+                "messages": serializer.data,
+                "conversation_id": conversation.id,
+            },
+            status=status.HTTP_201_CREATED,
+        )
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
 @login_required
 @api_view(["POST"])
 def conversation_add_version(request, pk):
     try:
         conversation = Conversation.objects.get(user=request.user, pk=pk)
-        version = conversation.active_version
         root_message_id = request.data.get("root_message_id")
         root_message = Message.objects.get(pk=root_message_id)
     except Conversation.DoesNotExist:
@@ -175,20 +373,30 @@ def conversation_add_version(request, pk):
     if root_message.version.conversation != conversation:
         return Response({"detail": "Root message not part of the conversation"}, status=status.HTTP_400_BAD_REQUEST)
 
-    new_version = Version.objects.create(
-        conversation=conversation, parent_version=root_message.version, root_message=root_message
+    messages_before_root = list(
+        Message.objects.select_related("role").filter(
+            version_id=conversation.active_version_id, created_at__lt=root_message.created_at
+        )
     )
 
-    # Copy messages before root_message to new_version
-    messages_before_root = Message.objects.filter(version=version, created_at__lt=root_message.created_at)
-    new_messages = [
-        Message(content=message.content, role=message.role, version=new_version) for message in messages_before_root
-    ]
-    Message.objects.bulk_create(new_messages)
-
-    # Set the new version as the current version
-    conversation.active_version = new_version
-    conversation.save()
+    with transaction.atomic():
+        new_version = Version.objects.create(
+            conversation=conversation, parent_version=root_message.version, root_message=root_message
+        )
+        # Copy messages before root_message to new_version, with the token counts of the messages they copy
+        new_messages = [
+            Message(content=message.content, role=message.role, version=new_version, token_count=message.token_count)
+            for message in messages_before_root
+        ]
+        Message.objects.bulk_create(new_messages)
+
+        # Set the new version as the current version, leaving the other fields, e.g. a title written in the meantime by
+        # the title worker, as they are
+        conversation.active_version = new_version
+        conversation.save(update_fields=["active_version", "modified_at"])
+        add_version_to_summary(conversation, messages_before_root)
+        update_branch_metadata(conversation, [new_version])
+        record_changes(conversation, [new_version], new_messages)
 
     serializer = VersionSerializer(new_version)
     return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -205,8 +413,11 @@ def conversation_switch_version(request, pk, version_id):
     except Version.DoesNotExist:
         return Response({"detail": "Version not found"}, status=status.HTTP_404_NOT_FOUND)
 
-    conversation.active_version = version
-    conversation.save()
+    with transaction.atomic():
+        conversation.active_version = version
+        conversation.save(update_fields=["active_version", "modified_at"])
+        refresh_summary(conversation)
+        record_changes(conversation)
 
     return Response(status=status.HTTP_204_NO_CONTENT)
 
@@ -221,7 +432,11 @@ def version_add_message(request, pk):
 
     serializer = MessageSerializer(data=request.data)
     if serializer.is_valid():
-        serializer.save(version=version)
+        with transaction.atomic():
+            message = serializer.save(version=version)
+            add_messages_to_summary(version.conversation, version, [message])
+            update_branch_metadata(version.conversation, [version])
+            record_changes(version.conversation, messages=[message])
         return Response(
             {
                 "message": serializer.data,
@@ -0,0 +1,18 @@
+from functools import wraps
+
+from django.contrib.auth.views import redirect_to_login
+
+
+def alogin_required(view_func):
+    """
+    Async counterpart of `django.contrib.auth.decorators.login_required`, which only supports sync views in Django 5.0.
+    """
+
+    @wraps(view_func)
+    async def _wrapped_view(request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view_func(request, *args, **kwargs)
+
+    return _wrapped_view
@@ -0,0 +1,69 @@
+import asyncio
+import statistics
+import time
+import warnings
+
+from django.core.management.base import BaseCommand
+from django.http import StreamingHttpResponse
+
+from src.utils.gpt import aget_simple_answer, get_simple_answer
+from src.utils.stub_openai import StubOpenAIServer
+
+STREAM_FACTORIES = {
+    "sync": lambda: get_simple_answer("Hi", stream=True),
+    "async": lambda: aget_simple_answer("Hi"),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures how many GPT answers can be streamed concurrently under ASGI by the sync and async generators, "
+        "against a local stub of the OpenAI endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--streams", type=int, nargs="+", default=[10, 50, 100])
+        parser.add_argument("--chunks", type=int, default=20)
+        parser.add_argument("--chunk-delay", type=float, default=0.01, help="Seconds the stub waits before a chunk.")
+        parser.add_argument("--modes", nargs="+", choices=list(STREAM_FACTORIES), default=list(STREAM_FACTORIES))
+
+    def handle(self, *args, **options):
+        warnings.filterwarnings("ignore", message="StreamingHttpResponse must consume synchronous iterators")
+        stream_time = options["chunks"] * options["chunk_delay"]
+        self.stdout.write(f"Every stream takes at least {stream_time * 1000:.0f} ms upstream")
+        self.stdout.write(
+            f"{'mode':>6} {'streams':>8} {'total [s]':>10} {'first chunk [ms]':>17} {'p95 [ms]':>9} "
+            f"{'concurrent':>10} {'streams/s':>10}"
+        )
+        for streams_count in options["streams"]:
+            for mode in options["modes"]:
+                result = asyncio.run(self._run(mode, streams_count, options["chunks"], options["chunk_delay"]))
+                self.stdout.write(
+                    f"{mode:>6} {streams_count:>8} {result['total']:>10.2f} {result['first_chunk'] * 1000:>17.0f} "
+                    f"{result['first_chunk_p95'] * 1000:>9.0f} {result['concurrent']:>10} "
+                    f"{streams_count / result['total']:>10.1f}"
+                )
+
+    @staticmethod
+    async def _run(mode, streams_count, chunks_count, chunk_delay):
+        async def consume(expected_content):
+            # The same way django.core.handlers.asgi.ASGIHandler.send_response consumes streaming responses
+            response = StreamingHttpResponse(STREAM_FACTORIES[mode](), content_type="text/html")
+            first_chunk_time, content = None, b""
+            async for part in response:
+                first_chunk_time = first_chunk_time or time.perf_counter() - start
+                content += part
+            assert content == expected_content.encode(), "Incomplete stream"
+            return first_chunk_time
+
+        async with StubOpenAIServer(chunks_count=chunks_count, chunk_delay=chunk_delay) as upstream:
+            start = time.perf_counter()
+            first_chunk_times = await asyncio.gather(*(consume(upstream.content) for _ in range(streams_count)))
+            total = time.perf_counter() - start
+
+        return {
+            "total": total,
+            "first_chunk": statistics.mean(first_chunk_times),
+            "first_chunk_p95": sorted(first_chunk_times)[int(0.95 * (len(first_chunk_times) - 1))],
+            "concurrent": upstream.max_active_streams,
+        }
@@ -0,0 +1,188 @@
+import asyncio
+import json
+import time
+from contextlib import AsyncExitStack
+from importlib import import_module
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import login
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.http import HttpRequest
+from django.utils.crypto import get_random_string
+
+from authentication.models import CustomUser
+from gpt import views
+from gpt.management.commands.run_stub_openai import add_stub_arguments, make_stub_server
+from src.utils.rate_limit import MemoryRateLimitStore, RateLimiter
+
+ENDPOINTS = {
+    "question": lambda question: ("/gpt/question/", {"user_question": question}),
+    "conversation": lambda question: (
+        "/gpt/conversation/",
+        {
+            "conversation": [
+                {"role": "user", "content": "Hi what up?"},
+                {"role": "assistant", "content": "Hello, how can I help you?"},
+                {"role": "user", "content": question},
+            ],
+            "model": "gpt35",
+        },
+    ),
+}
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Returns the `q` percentile of the values, with the nearest-rank method."""
+    if not values:
+        return float("nan")
+    return sorted(values)[max(0, int(q / 100 * len(values) + 0.5) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Load tests the streaming GPT endpoints with concurrent users, reporting the time to first token, the latency "
+        "between chunks and the streams per second. Requests go through the whole ASGI application in process, against "
+        "a local stub of the OpenAI endpoint unless --external-upstream is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--email", required=True, help="Email of the user the requests are made as.")
+        parser.add_argument("--users", type=int, nargs="+", default=[1, 10, 50])
+        parser.add_argument("--requests", type=int, default=5, help="Requests made one after another by every user.")
+        parser.add_argument("--endpoints", nargs="+", choices=list(ENDPOINTS), default=list(ENDPOINTS))
+        parser.add_argument("--host", default="127.0.0.1", help="Host header of the requests.")
+        parser.add_argument(
+            "--external-upstream",
+            action="store_true",
+            help="Use the OpenAI endpoint configured by the OPENAI_* environment variables, e.g. run_stub_openai.",
+        )
+        parser.add_argument(
+            "--rate-limit",
+            action="store_true",
+            help="Keep the rate limits of the user, which are lifted by default as all the users share one account.",
+        )
+        add_stub_arguments(parser)
+
+    def handle(self, *args, **options):
+        try:
+            user = CustomUser.objects.get(email=options["email"])
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"User {options['email']} does not exist")
+
+        session = self._login(user)
+        # the views are given a limiter of their own, disabled unless asked, instead of the shared one being changed
+        limiter = views.rate_limiter
+        if not options["rate_limit"]:
+            views.rate_limiter = RateLimiter(MemoryRateLimitStore(), tokens_per_minute=0)
+        try:
+            async_to_sync(self._run)(session.session_key, options)
+        finally:
+            views.rate_limiter = limiter
+            session.delete()
+
+    @staticmethod
+    def _login(user):
+        request = HttpRequest()
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore()
+        login(request, user, settings.AUTHENTICATION_BACKENDS[0])
+        request.session.save()
+        return request.session
+
+    async def _run(self, session_key, options):
+        application = get_asgi_application()
+        csrf_token = get_random_string(32)
+        headers = [
+            (b"host", options["host"].encode()),
+            (b"content-type", b"application/json"),
+            (
+                b"cookie",
+                f"{settings.SESSION_COOKIE_NAME}={session_key}; {settings.CSRF_COOKIE_NAME}={csrf_token}".encode(),
+            ),
+            (b"x-csrftoken", csrf_token.encode()),
+        ]
+
+        async with AsyncExitStack() as stack:
+            if not options["external_upstream"]:
+                await stack.enter_async_context(make_stub_server(options))
+            self.stdout.write(
+                f"{'endpoint':>12} {'users':>6} {'streams':>8} {'errors':>7} {'streams/s':>10} {'TTFT p50':>9} "
+                f"{'p95':>7} {'p99':>7} {'chunk gap p50':>14} {'p95':>7} {'p99':>7}   [ms]"
+            )
+            for users_count in options["users"]:
+                for endpoint in options["endpoints"]:
+                    result = await self._load(application, headers, endpoint, users_count, options["requests"])
+                    first_chunk = [percentile(result["first_chunk"], q) * 1000 for q in (50, 95, 99)]
+                    chunk_gaps = [percentile(result["chunk_gaps"], q) * 1000 for q in (50, 95, 99)]
+                    self.stdout.write(
+                        f"{endpoint:>12} {users_count:>6} {result['streams']:>8} {result['errors']:>7} "
+                        f"{result['streams'] / result['total']:>10.1f} {first_chunk[0]:>9.1f} {first_chunk[1]:>7.1f} "
+                        f"{first_chunk[2]:>7.1f} {chunk_gaps[0]:>14.1f} {chunk_gaps[1]:>7.1f} {chunk_gaps[2]:>7.1f}"
+                    )
+
+    @staticmethod
+    async def _load(application, headers, endpoint, users_count, requests_count):
+        result = {"streams": 0, "errors": 0, "first_chunk": [], "chunk_gaps": []}
+
+        async def request(path, data):
+            body = json.dumps(data).encode()
+            scope = {
+                "type": "http",
+                "asgi": {"version": "3.0"},
+                "http_version": "1.1",
+                "method": "POST",
+                "scheme": "http",
+                "path": path,
+                "raw_path": path.encode(),
+                "query_string": b"",
+                "root_path": "",
+                "headers": [*headers, (b"content-length", str(len(body)).encode())],
+                "client": ("127.0.0.1", 0),
+                "server": ("127.0.0.1", 80),
+            }
+            request_sent = asyncio.Event()
+            response_sent = asyncio.Event()
+
+            async def receive():
+                if not request_sent.is_set():
+                    request_sent.set()
+                    return {"type": "http.request", "body": body, "more_body": False}
+                await response_sent.wait()
+                return {"type": "http.disconnect"}
+
+            status, chunk_times = None, []
+
+            async def send(message):
+                nonlocal status
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                elif message["type"] == "http.response.body":
+                    if message.get("body"):
+                        chunk_times.append(time.perf_counter())
+                    if not message.get("more_body"):
+                        response_sent.set()
+
+            start = time.perf_counter()
+            try:
+                await application(scope, receive, send)
+            except Exception:
+                status = None
+            if status != 200 or not chunk_times:
+                result["errors"] += 1
+                return
+            result["streams"] += 1
+            result["first_chunk"].append(chunk_times[0] - start)
+            result["chunk_gaps"].extend(later - earlier for earlier, later in zip(chunk_times, chunk_times[1:]))
+
+        # every question is unique, so that no answer comes from the cache or a coalesced call
+        run_id = get_random_string(8)
+
+        async def user(user_idx):
+            for idx in range(requests_count):
+                await request(*ENDPOINTS[endpoint](f"Question {run_id}.{user_idx}.{idx}"))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user(user_idx) for user_idx in range(users_count)))
+        result["total"] = time.perf_counter() - start
+        return result
@@ -0,0 +1,55 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from src.libs import openai
+from src.utils.stub_openai import StubOpenAIServer
+
+
+def add_stub_arguments(parser):
+    parser.add_argument("--chunks", type=int, default=20, help="Tokens streamed per answer.")
+    parser.add_argument("--chunk-delay", type=float, default=0.01, help="Seconds between the tokens of an answer.")
+    parser.add_argument("--latency", type=float, default=0, help="Mean seconds the stub waits before answering.")
+    parser.add_argument("--latency-jitter", type=float, default=0, help="Standard deviation of the latency.")
+    parser.add_argument("--error-rate", type=float, default=0, help="Share of the requests answered with an error.")
+    parser.add_argument("--error-status", type=int, default=500, help="HTTP status of the injected errors.")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def make_stub_server(options, port=0):
+    return StubOpenAIServer(
+        chunks_count=options["chunks"],
+        chunk_delay=options["chunk_delay"],
+        latency=options["latency"],
+        latency_jitter=options["latency_jitter"],
+        error_rate=options["error_rate"],
+        error_status=options["error_status"],
+        port=port,
+        seed=options["seed"],
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs a local stub of the (Azure) OpenAI chat completions endpoint, for benchmarking the GPT views without "
+        "spending quota. Point the backend at it with the printed OPENAI_* environment variables."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--port", type=int, default=8001)
+        add_stub_arguments(parser)
+
+    def handle(self, *args, **options):
+        try:
+            asyncio.run(self._serve(options))
+        except KeyboardInterrupt:
+            pass
+
+    async def _serve(self, options):
+        async with make_stub_server(options, options["port"]):
+            self.stdout.write(f"Stub OpenAI server listening on {openai.api_base}, run the backend with:")
+            self.stdout.write(
+                f"  OPENAI_API_TYPE={openai.api_type} OPENAI_API_BASE={openai.api_base} "
+                f"OPENAI_API_VERSION={openai.api_version} OPENAI_API_KEY={openai.api_key}"
+            )
+            await asyncio.Event().wait()
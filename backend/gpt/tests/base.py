@@ -0,0 +1,8 @@
+class FakeClock:
+    """Clock returning `now`, which the tests move forward themselves."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
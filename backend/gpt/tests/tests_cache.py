@@ -0,0 +1,140 @@
+import os
+import tempfile
+import threading
+
+from asgiref.sync import sync_to_async
+from django.test import SimpleTestCase, TestCase
+
+from authentication.models import CustomUser
+from gpt.tests.base import FakeClock
+from src.utils.cache import CompletionCache, MemoryCacheTier, SQLiteCacheTier, completion_cache, make_key
+from src.utils.gpt import aget_simple_answer, get_gpt_title, get_simple_answer
+from src.utils.stub_openai import StubOpenAIServer
+
+
+class CompletionCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.memory_tier = MemoryCacheTier(max_entries=2, ttl=10, clock=self.clock)
+        self.cache = CompletionCache([self.memory_tier])
+
+    def _sqlite_tier(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return SQLiteCacheTier(os.path.join(directory.name, "cache.sqlite3"), ttl=10, clock=self.clock)
+
+    def test_make_key(self):
+        messages = [{"role": "user", "content": "Hi"}]
+        self.assertEqual(make_key("gpt4", messages, {"a": 1, "b": 2}), make_key("gpt4", messages, {"b": 2, "a": 1}))
+        self.assertNotEqual(make_key("gpt4", messages, {"a": 1}), make_key("gpt35", messages, {"a": 1}))
+        self.assertNotEqual(make_key("gpt4", messages, {"a": 1}), make_key("gpt4", messages, {"a": 2}))
+
+    def test_lru_eviction(self):
+        self.cache.set("a", ["A"])
+        self.cache.set("b", ["B"])
+        self.cache.get("a")
+        self.cache.set("c", ["C"])
+        self.assertEqual(self.cache.get("a"), ["A"])
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.stats(), {"hits": 2, "misses": 1, "memory_hits": 2})
+
+    def test_ttl(self):
+        self.cache.set("a", ["A"])
+        self.clock.now += 9
+        self.assertEqual(self.cache.get("a"), ["A"])
+        self.clock.now += 1
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(len(self.memory_tier), 0)
+
+    def test_sqlite_tier(self):
+        sqlite_tier = self._sqlite_tier()
+        CompletionCache([self.memory_tier, sqlite_tier]).set("a", ["A", "B"])
+
+        cache = CompletionCache(
+            [MemoryCacheTier(clock=self.clock), SQLiteCacheTier(sqlite_tier.path, clock=self.clock)]
+        )
+        self.assertEqual(cache.get("a"), ["A", "B"])
+        self.assertEqual(cache.get("a"), ["A", "B"])
+        self.assertEqual(cache.stats(), {"hits": 2, "misses": 0, "memory_hits": 1, "sqlite_hits": 1})
+
+        self.clock.now += 10
+        self.assertIsNone(SQLiteCacheTier(sqlite_tier.path, clock=self.clock).get("a"))
+
+    def test_stream_replays_chunks(self):
+        calls = []
+
+        def create_chunks():
+            calls.append(1)
+            yield from ["Hello", " world"]
+
+        self.assertEqual(list(self.cache.stream("a", create_chunks)), ["Hello", " world"])
+        self.assertEqual(list(self.cache.stream("a", create_chunks)), ["Hello", " world"])
+        self.assertEqual(len(calls), 1)
+
+    def test_interrupted_stream_is_not_cached(self):
+        def create_chunks():
+            yield "Hello"
+            raise ConnectionError
+
+        with self.assertRaises(ConnectionError):
+            list(self.cache.stream("a", create_chunks))
+        self.assertIsNone(self.cache.get("a"))
+
+    async def test_async_stream_reads_tiers_off_event_loop(self):
+        threads = []
+
+        class RecordingTier(MemoryCacheTier):
+            def get(self, key):
+                threads.append(threading.get_ident())
+                return super().get(key)
+
+            def set(self, key, chunks):
+                threads.append(threading.get_ident())
+                super().set(key, chunks)
+
+        async def create_chunks():
+            yield "Hello"
+
+        cache = CompletionCache([RecordingTier(clock=self.clock)])
+        for _ in range(2):
+            self.assertEqual([chunk async for chunk in cache.astream("a", create_chunks)], ["Hello"])
+        self.assertEqual(len(threads), 3)
+        self.assertNotIn(threading.get_ident(), threads)
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 1, "memory_hits": 1})
+
+    def test_disabled(self):
+        cache = CompletionCache([self.memory_tier], enabled=False)
+        cache.set("a", ["A"])
+        self.assertIsNone(cache.get("a"))
+
+
+class CachedCompletionsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.mock_user = CustomUser.objects.create(email="mock@email.com", is_active=True)
+
+    def setUp(self):
+        completion_cache.clear()
+        completion_cache.reset_stats()
+
+    async def test_repeated_questions_hit_upstream_once(self):
+        async with StubOpenAIServer(chunks_count=3) as upstream:
+            first_answer = [chunk async for chunk in aget_simple_answer("Hi what up?")]
+            second_answer = [chunk async for chunk in aget_simple_answer("Hi what up?")]
+            sync_answer = await sync_to_async(list)(get_simple_answer("Hi what up?"))
+        self.assertEqual(first_answer, [upstream.chunk] * 3)
+        self.assertEqual(second_answer, first_answer)
+        self.assertEqual(sync_answer, first_answer)
+        self.assertEqual(len(upstream.requests), 1)
+
+    async def test_repeated_titles_hit_upstream_once(self):
+        async with StubOpenAIServer(chunks_count=3) as upstream:
+            titles = [await sync_to_async(get_gpt_title)("Hi what up?", "Hello!") for _ in range(2)]
+        self.assertEqual(titles, [upstream.content] * 2)
+        self.assertEqual(len(upstream.requests), 1)
+
+    def test_cache_stats_view(self):
+        self.client.force_login(self.mock_user)
+        completion_cache.get("missing")
+        response = self.client.get("/gpt/cache_stats/")
+        self.assertEqual(response.json()["misses"], 1)
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.test import SimpleTestCase, TestCase
+
+from authentication.models import CustomUser
+from gpt.tests.base import FakeClock
+from src.utils.cache import completion_cache
+from src.utils.gpt import aget_conversation_answer, get_simple_answer
+from src.utils.http_pool import UpstreamPool, upstream_pool
+from src.utils.stub_openai import StubOpenAIServer
+
+
+class UpstreamPoolTests(SimpleTestCase):
+    def setUp(self):
+        completion_cache.clear()
+        upstream_pool.reset_stats()
+
+    async def test_async_calls_reuse_connections(self):
+        conversation = [{"role": "user", "content": "Hi what up?"}]
+        async with StubOpenAIServer(chunks_count=3) as upstream:
+            for _ in range(3):
+                self.assertEqual(
+                    "".join([chunk async for chunk in aget_conversation_answer(conversation, "gpt4")]), upstream.content
+                )
+        stats = upstream_pool.stats()
+        self.assertEqual((stats["async_requests"], stats["async_new_connections"]), (3, 1))
+        self.assertEqual(stats["async_reused_connections"], 2)
+
+    async def test_sync_calls_reuse_connections(self):
+        async with StubOpenAIServer(chunks_count=3):
+            for idx in range(3):
+                await sync_to_async(list)(get_simple_answer(f"Question {idx}"))
+        stats = upstream_pool.stats()
+        self.assertEqual((stats["sync_new_connections"], stats["sync_reused_connections"]), (1, 2))
+
+    async def test_idle_connections_are_evicted(self):
+        clock = FakeClock()
+        pool = UpstreamPool(keepalive=10, clock=clock)
+        async with StubOpenAIServer() as upstream:
+            get = sync_to_async(lambda: pool.session.get(upstream.url).close())
+            await get()
+            clock.now += 5
+            await get()
+            clock.now += 11
+            await get()
+        pool.close()
+        stats = pool.stats()
+        self.assertEqual((stats["sync_new_connections"], stats["sync_reused_connections"]), (2, 1))
+        self.assertEqual(stats["sync_evicted_connections"], 1)
+
+    async def test_sync_calls_wait_for_free_connection(self):
+        pool = UpstreamPool(max_connections_per_host=1)
+        connected = threading.Event()
+
+        def hold_connection(url):
+            response = pool.session.get(url, stream=True)
+            connected.set()
+            time.sleep(0.1)
+            response.content
+            response.close()
+
+        def wait_for_connection(url):
+            connected.wait(5)
+            pool.session.get(url).close()
+
+        async with StubOpenAIServer() as upstream:
+            await asyncio.gather(
+                sync_to_async(hold_connection, thread_sensitive=False)(upstream.url),
+                sync_to_async(wait_for_connection, thread_sensitive=False)(upstream.url),
+            )
+        pool.close()
+        stats = pool.stats()
+        self.assertEqual((stats["sync_new_connections"], stats["sync_reused_connections"]), (1, 1))
+
+    async def test_prewarm(self):
+        pool = UpstreamPool(prewarm=2)
+        async with StubOpenAIServer():
+            await sync_to_async(pool.prewarm)()
+            await pool.get_aiosession()
+            _, _, prewarm_task = pool._aiosessions[asyncio.get_running_loop()]
+            await prewarm_task
+        pool.close()
+        stats = pool.stats()
+        self.assertGreaterEqual(stats["sync_new_connections"], 1)
+        self.assertEqual(stats["sync_new_connections"] + stats["sync_reused_connections"], 2)
+        self.assertEqual(stats["async_requests"], 2)
+
+
+class PoolStatsViewTests(TestCase):
+    def test_pool_stats_view(self):
+        self.client.force_login(CustomUser.objects.create(email="mock@email.com", is_active=True))
+        response = self.client.get("/gpt/pool_stats/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("async_reused_connections", response.json())
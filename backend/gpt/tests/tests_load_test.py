@@ -0,0 +1,69 @@
+import time
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from authentication.models import CustomUser
+from gpt import views
+from src.libs import openai
+from src.utils.cache import completion_cache
+from src.utils.gpt import aget_simple_answer
+from src.utils.rate_limit import rate_limiter
+from src.utils.stub_openai import StubOpenAIServer
+
+
+class StubOpenAIServerTests(TestCase):
+    def setUp(self):
+        completion_cache.clear()
+        self.addCleanup(completion_cache.clear)
+
+    async def test_latency(self):
+        async with StubOpenAIServer(chunks_count=1, chunk_delay=0, latency=0.2):
+            start = time.perf_counter()
+            [chunk async for chunk in aget_simple_answer("Hi what up?")]
+        self.assertGreaterEqual(time.perf_counter() - start, 0.2)
+
+    async def test_error_injection(self):
+        async with StubOpenAIServer(error_rate=1, error_status=429) as upstream:
+            with self.assertRaises(openai.error.RateLimitError):
+                [chunk async for chunk in aget_simple_answer("Hi what up?")]
+        self.assertEqual(upstream.errors_count, 1)
+
+
+class LoadTestCommandTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.mock_user = CustomUser.objects.create(email="mock@email.com", is_active=True)
+
+    def _call(self, *args):
+        stdout = StringIO()
+        call_command(
+            "loadtest_gpt", "--email", "mock@email.com", "--host", "testserver", "--chunks", "3", *args, stdout=stdout
+        )
+        return [line.split() for line in stdout.getvalue().splitlines()[1:]]
+
+    def test_reports_streams(self):
+        rows = self._call("--users", "1", "3", "--requests", "2")
+        self.assertEqual(
+            [row[:4] for row in rows],
+            [
+                [endpoint, users, str(int(users) * 2), "0"]
+                for users in ["1", "3"]
+                for endpoint in ["question", "conversation"]
+            ],
+        )
+
+    def test_shared_limiter_is_left_as_it_is(self):
+        enabled = rate_limiter.enabled
+        self._call("--users", "1", "--requests", "1", "--endpoints", "question")
+        self.assertIs(views.rate_limiter, rate_limiter)
+        self.assertEqual(rate_limiter.enabled, enabled)
+
+    def test_counts_errors(self):
+        rows = self._call("--users", "2", "--requests", "1", "--endpoints", "question", "--error-rate", "1")
+        self.assertEqual(rows[0][:4], ["question", "2", "0", "2"])
+
+    def test_unknown_user(self):
+        with self.assertRaises(CommandError):
+            call_command("loadtest_gpt", "--email", "unknown@email.com", stdout=StringIO())
@@ -0,0 +1,155 @@
+import gc
+import json
+import os
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+
+from authentication.models import CustomUser
+from gpt.tests.base import FakeClock
+from gpt.views import _stream_response
+from src.utils.cache import completion_cache
+from src.utils.rate_limit import MemoryRateLimitStore, RateLimited, RateLimiter, SQLiteRateLimitStore
+from src.utils.scheduler import Priority
+from src.utils.stub_openai import StubOpenAIServer
+
+
+class RateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = RateLimiter(MemoryRateLimitStore(), tokens_per_minute=600, max_streams=2, clock=self.clock)
+
+    def test_tokens_are_charged_when_finished(self):
+        usage = self.limiter.start(1, "gpt4", prompt_tokens=100)
+        self.assertEqual(self.limiter.remaining(1, "gpt4"), 600)
+        usage.finish("Hello there")
+        self.assertEqual(self.limiter.remaining(1, "gpt4"), 600 - 100 - 2)
+        usage.finish("Hello there")
+        self.assertEqual(self.limiter.remaining(1, "gpt4"), 600 - 100 - 2)
+
+    def test_empty_bucket_is_refilled(self):
+        self.limiter.start(1, "gpt4", prompt_tokens=700).finish("")
+        with self.assertRaises(RateLimited) as context:
+            self.limiter.start(1, "gpt4")
+        self.assertEqual(context.exception.retry_after, 11)
+        self.limiter.start(1, "gpt35").cancel()
+        self.limiter.start(2, "gpt4").cancel()
+
+        self.clock.now += 11
+        usage = self.limiter.start(1, "gpt4")
+        self.assertEqual(
+            usage.headers(), {"X-RateLimit-Limit": "600", "X-RateLimit-Remaining": "10", "X-RateLimit-Reset": "59"}
+        )
+        usage.cancel()
+        self.clock.now += 100
+        self.assertEqual(self.limiter.remaining(1, "gpt4"), 600)
+
+    def test_concurrent_streams(self):
+        usages = [self.limiter.start(1, "gpt4"), self.limiter.start(1, "gpt35")]
+        with self.assertRaises(RateLimited):
+            self.limiter.start(1, "gpt4")
+        self.limiter.start(2, "gpt4").cancel()
+        usages[0].cancel()
+        self.limiter.start(1, "gpt4").cancel()
+
+    def test_abandoned_streams_expire(self):
+        self.limiter.start(1, "gpt4")
+        self.limiter.start(1, "gpt4")
+        self.clock.now += 3600
+        self.limiter.start(1, "gpt4").cancel()
+
+    def test_disabled(self):
+        limiter = RateLimiter(MemoryRateLimitStore(), tokens_per_minute=0, max_streams=0)
+        usage = limiter.start(1, "gpt4", prompt_tokens=100)
+        usage.finish("Hello")
+        self.assertEqual(usage.headers(), {})
+        self.assertIsNone(limiter.remaining(1, "gpt4"))
+
+        # a call let through while disabled ends without a stream once the limits are enabled again
+        usage = limiter.start(1, "gpt4", prompt_tokens=100)
+        limiter.enabled = True
+        usage.cancel()
+
+    def test_sqlite_store_is_shared(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "rate_limit.sqlite3")
+            workers = [
+                RateLimiter(SQLiteRateLimitStore(path), tokens_per_minute=600, max_streams=1, clock=self.clock)
+                for _ in range(2)
+            ]
+            usage = workers[0].start(1, "gpt4", prompt_tokens=100)
+            with self.assertRaises(RateLimited):
+                workers[1].start(1, "gpt4")
+            usage.finish("")
+            self.assertEqual(workers[1].remaining(1, "gpt4"), 500)
+            workers[1].start(1, "gpt4").cancel()
+
+
+class RateLimitedViewsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.mock_user = CustomUser.objects.create(email="mock@email.com", is_active=True)
+
+    def setUp(self):
+        completion_cache.clear()
+        self.client.force_login(self.mock_user)
+        self.async_client.force_login(self.mock_user)
+        self.limiter = RateLimiter(MemoryRateLimitStore(), tokens_per_minute=600, max_streams=1)
+        patcher = mock.patch("gpt.views.rate_limiter", self.limiter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_conversation_is_charged(self):
+        data = json.dumps({"conversation": [{"role": "user", "content": "Hi what up?"}], "model": "gpt4"})
+        async with StubOpenAIServer(chunks_count=3) as upstream:
+            response = await self.async_client.post("/gpt/conversation/", data, content_type="application/json")
+            self.assertEqual(b"".join([chunk async for chunk in response.streaming_content]).decode(), upstream.content)
+        self.assertEqual(response["X-RateLimit-Limit"], "600")
+        self.assertEqual(response["X-RateLimit-Remaining"], "600")
+        self.assertLess(self.limiter.remaining(self.mock_user.pk, "gpt-4-0613"), 600)
+        self.assertEqual(self.limiter.remaining(self.mock_user.pk, "gpt-35-turbo-0613"), 600)
+
+    async def test_cached_answer_is_not_charged(self):
+        data = json.dumps({"user_question": "Hi what up?"})
+        async with StubOpenAIServer(chunks_count=3) as upstream:
+            response = await self.async_client.post("/gpt/question/", data, content_type="application/json")
+            b"".join([chunk async for chunk in response.streaming_content])
+            remaining = self.limiter.remaining(self.mock_user.pk, "gpt-35-turbo-0613")
+            self.assertLess(remaining, 600)
+
+            response = await self.async_client.post("/gpt/question/", data, content_type="application/json")
+            b"".join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(upstream.requests), 1)
+        self.assertEqual(self.limiter.remaining(self.mock_user.pk, "gpt-35-turbo-0613"), remaining)
+
+    async def test_response_never_streamed_ends_the_stream(self):
+        usage = self.limiter.start(self.mock_user.pk, "gpt-4-0613")
+        # the test client keeps the responses it returns, the view is called without it
+        response = await _stream_response(lambda reservation: None, usage, "gpt-4-0613", Priority.CHAT)
+        with self.assertRaises(RateLimited):
+            self.limiter.start(self.mock_user.pk, "gpt-4-0613")
+        del response
+        gc.collect()
+        self.limiter.start(self.mock_user.pk, "gpt-4-0613").cancel()
+        self.assertEqual(self.limiter.remaining(self.mock_user.pk, "gpt-4-0613"), 600)
+
+    async def test_conversation_over_limit_is_rejected(self):
+        self.limiter.start(self.mock_user.pk, "gpt-4-0613", prompt_tokens=1000).finish("")
+        data = json.dumps({"conversation": [{"role": "user", "content": "Hi what up?"}], "model": "gpt4"})
+        async with StubOpenAIServer() as upstream:
+            response = await self.async_client.post("/gpt/conversation/", data, content_type="application/json")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "41")
+        self.assertEqual(upstream.requests, [])
+
+    def test_title_over_stream_limit_is_rejected(self):
+        self.limiter.start(self.mock_user.pk, "gpt-4-0613")
+        data = json.dumps({"user_question": "Hi what up?", "chatbot_response": "Hello!"})
+        response = self.client.post("/gpt/title/", data, content_type="application/json")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "1")
+
+    def test_rate_limit_view(self):
+        response = self.client.get("/gpt/rate_limit/")
+        self.assertEqual(response.json()["gpt4"], 600)
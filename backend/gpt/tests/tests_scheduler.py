@@ -0,0 +1,130 @@
+import asyncio
+import json
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+
+from authentication.models import CustomUser
+from src.utils.cache import completion_cache
+from src.utils.scheduler import EngineScheduler, Priority, SchedulerOverloaded
+
+
+class EngineSchedulerTests(SimpleTestCase):
+    def test_concurrency_cap(self):
+        scheduler = EngineScheduler(max_concurrency=1, max_wait=5)
+        events = []
+
+        def call(name):
+            with scheduler.slot("gpt4", Priority.TITLE):
+                events.append(f"{name} start")
+                events.append(f"{name} end")
+
+        with scheduler.slot("gpt4", Priority.CHAT):
+            thread = threading.Thread(target=call, args=("title",))
+            thread.start()
+            with scheduler.slot("gpt35", Priority.CHAT):
+                events.append("other engine")
+            self.assertEqual(scheduler.stats()["gpt4"]["waiting"], 1)
+            events.append("chat end")
+        thread.join()
+
+        self.assertEqual(events, ["other engine", "chat end", "title start", "title end"])
+        self.assertEqual(scheduler.stats()["gpt4"], {"active": 0, "waiting": 0, "calls": 2, "queued": 1, "rejected": 0})
+
+    async def test_priorities(self):
+        scheduler = EngineScheduler(max_concurrency=1, max_wait=5)
+        order = []
+
+        async def call(priority):
+            async with scheduler.aslot("gpt4", priority):
+                order.append(priority)
+
+        async with scheduler.aslot("gpt4", Priority.CHAT):
+            tasks = [
+                asyncio.create_task(call(priority)) for priority in [Priority.TITLE, Priority.QUESTION, Priority.CHAT]
+            ]
+            await asyncio.sleep(0.01)
+        await asyncio.gather(*tasks)
+        self.assertEqual(order, [Priority.CHAT, Priority.QUESTION, Priority.TITLE])
+
+    def test_full_queue_is_rejected(self):
+        scheduler = EngineScheduler(max_concurrency=1, max_queue=0, max_wait=2.5)
+        with scheduler.slot("gpt4", Priority.CHAT):
+            with self.assertRaises(SchedulerOverloaded) as context:
+                with scheduler.slot("gpt4", Priority.CHAT):
+                    pass
+        self.assertEqual(context.exception.retry_after, 3)
+        self.assertEqual(scheduler.stats()["gpt4"]["rejected"], 1)
+
+    async def test_wait_is_bounded(self):
+        scheduler = EngineScheduler(max_concurrency=1, max_wait=0.05)
+        async with scheduler.aslot("gpt4", Priority.CHAT):
+            with self.assertRaises(SchedulerOverloaded):
+                async with scheduler.aslot("gpt4", Priority.CHAT):
+                    pass
+            self.assertEqual(scheduler.stats()["gpt4"]["waiting"], 0)
+        async with scheduler.aslot("gpt4", Priority.CHAT):
+            self.assertEqual(scheduler.stats()["gpt4"]["active"], 1)
+
+    async def test_cancelled_waiter_leaves_queue(self):
+        scheduler = EngineScheduler(max_concurrency=1, max_wait=5)
+
+        async def call():
+            async with scheduler.aslot("gpt4", Priority.CHAT):
+                pass
+
+        async with scheduler.aslot("gpt4", Priority.CHAT):
+            task = asyncio.create_task(call())
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.assertEqual(scheduler.stats()["gpt4"]["waiting"], 0)
+        self.assertEqual(scheduler.stats()["gpt4"]["active"], 0)
+
+    async def test_reservation(self):
+        scheduler = EngineScheduler(max_concurrency=1, max_queue=0, max_wait=1)
+        reservation = await scheduler.areserve("gpt4", Priority.CHAT)
+        with self.assertRaises(SchedulerOverloaded):
+            await scheduler.areserve("gpt4", Priority.CHAT)
+        async with scheduler.aslot("gpt4", Priority.CHAT, reservation):
+            self.assertEqual(scheduler.stats()["gpt4"]["active"], 1)
+        reservation.release()
+        self.assertEqual(scheduler.stats()["gpt4"], {"active": 0, "waiting": 0, "calls": 1, "queued": 0, "rejected": 1})
+
+    def test_engine_concurrency(self):
+        scheduler = EngineScheduler(max_concurrency=1, engine_max_concurrency={"gpt-4-0613": 2})
+        with scheduler.slot("gpt-4-0613", Priority.CHAT), scheduler.slot("gpt-4-0613", Priority.CHAT):
+            self.assertEqual(scheduler.stats()["gpt-4-0613"]["active"], 2)
+
+
+OVERLOADED_SCHEDULER = EngineScheduler(max_concurrency=0, max_queue=0, max_wait=1)
+
+
+@mock.patch("gpt.views.scheduler", OVERLOADED_SCHEDULER)
+@mock.patch("src.utils.gpt.scheduler", OVERLOADED_SCHEDULER)
+class OverloadedViewsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.mock_user = CustomUser.objects.create(email="mock@email.com", is_active=True)
+
+    def setUp(self):
+        completion_cache.clear()
+        self.client.force_login(self.mock_user)
+        self.async_client.force_login(self.mock_user)
+
+    def _assert_overloaded(self, response):
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "1")
+
+    async def test_conversation_is_rejected(self):
+        conversation = [{"role": "user", "content": "Hi what up?"}]
+        data = json.dumps({"conversation": conversation, "model": "gpt4"})
+        self._assert_overloaded(
+            await self.async_client.post("/gpt/conversation/", data, content_type="application/json")
+        )
+
+    def test_title_is_rejected(self):
+        data = json.dumps({"user_question": "Hi what up?", "chatbot_response": "Hello!"})
+        self._assert_overloaded(self.client.post("/gpt/title/", data, content_type="application/json"))
@@ -0,0 +1,135 @@
+import asyncio
+import threading
+
+from asgiref.sync import sync_to_async
+from django.test import SimpleTestCase
+
+from src.utils.cache import completion_cache
+from src.utils.gpt import aget_simple_answer, get_gpt_title
+from src.utils.single_flight import SingleFlight, single_flight
+from src.utils.stub_openai import StubOpenAIServer
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        self.single_flight = SingleFlight()
+
+    def test_concurrent_streams_share_one_call(self):
+        calls = []
+        release = threading.Event()
+
+        def create_chunks():
+            calls.append(1)
+            yield "Hello"
+            release.wait(5)
+            yield " world"
+
+        first_stream = self.single_flight.stream("a", create_chunks)
+        self.assertEqual(next(first_stream), "Hello")
+        second_stream = self.single_flight.stream("a", create_chunks)
+        self.assertEqual(next(second_stream), "Hello")
+        release.set()
+        self.assertEqual(list(first_stream), [" world"])
+        self.assertEqual(list(second_stream), [" world"])
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.single_flight.stats(), {"upstream_calls": 1, "coalesced_calls": 1})
+
+    def test_finished_call_is_not_shared(self):
+        self.assertEqual(list(self.single_flight.stream("a", lambda: iter(["A"]))), ["A"])
+        self.assertEqual(list(self.single_flight.stream("a", lambda: iter(["B"]))), ["B"])
+        self.assertEqual(self.single_flight.stats(), {"upstream_calls": 2, "coalesced_calls": 0})
+
+    def test_error_is_raised_to_every_subscriber(self):
+        release = threading.Event()
+
+        def create_chunks():
+            yield "Hello"
+            release.wait(5)
+            raise ConnectionError
+
+        streams = [self.single_flight.stream("a", create_chunks) for _ in range(2)]
+        self.assertEqual([next(stream) for stream in streams], ["Hello", "Hello"])
+        release.set()
+        for stream in streams:
+            with self.assertRaises(ConnectionError):
+                list(stream)
+
+    async def test_concurrent_async_streams_share_one_call(self):
+        calls = []
+
+        async def create_chunks():
+            calls.append(1)
+            for chunk in ["Hello", " world"]:
+                await asyncio.sleep(0.01)
+                yield chunk
+
+        async def collect(stream):
+            return [chunk async for chunk in stream]
+
+        results = await asyncio.gather(*[collect(self.single_flight.astream("a", create_chunks)) for _ in range(5)])
+        self.assertEqual(results, [["Hello", " world"]] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.single_flight.stats(), {"upstream_calls": 1, "coalesced_calls": 4})
+
+    async def test_async_error_is_raised_to_every_subscriber(self):
+        async def create_chunks():
+            await asyncio.sleep(0.01)
+            raise ConnectionError
+            yield
+
+        async def collect(stream):
+            return [chunk async for chunk in stream]
+
+        results = await asyncio.gather(
+            *[collect(self.single_flight.astream("a", create_chunks)) for _ in range(2)], return_exceptions=True
+        )
+        self.assertTrue(all(isinstance(result, ConnectionError) for result in results))
+
+    async def test_abandoned_async_call_is_cancelled(self):
+        closed = asyncio.Event()
+
+        async def create_chunks():
+            try:
+                yield "Hello"
+                await asyncio.sleep(5)
+                yield " world"
+            finally:
+                closed.set()
+
+        streams = [self.single_flight.astream("a", create_chunks) for _ in range(2)]
+        self.assertEqual([await anext(stream) for stream in streams], ["Hello", "Hello"])
+        await streams[0].aclose()
+        await asyncio.sleep(0.01)
+        self.assertFalse(closed.is_set())
+        await streams[1].aclose()
+        await asyncio.wait_for(closed.wait(), 1)
+
+        async def create_other_chunks():
+            yield "Hi"
+
+        self.assertEqual([chunk async for chunk in self.single_flight.astream("a", create_other_chunks)], ["Hi"])
+        self.assertEqual(self.single_flight.stats(), {"upstream_calls": 2, "coalesced_calls": 1})
+
+
+class CoalescedCompletionsTests(SimpleTestCase):
+    def setUp(self):
+        completion_cache.clear()
+        single_flight.reset_stats()
+
+    async def test_concurrent_questions_hit_upstream_once(self):
+        async def collect():
+            return [chunk async for chunk in aget_simple_answer("Hi what up?")]
+
+        async with StubOpenAIServer(chunks_count=3) as upstream:
+            answers = await asyncio.gather(*[collect() for _ in range(5)])
+        self.assertEqual(answers, [[upstream.chunk] * 3] * 5)
+        self.assertEqual(len(upstream.requests), 1)
+        self.assertEqual(single_flight.stats(), {"upstream_calls": 1, "coalesced_calls": 4})
+
+    async def test_concurrent_titles_hit_upstream_once(self):
+        get_title = sync_to_async(get_gpt_title, thread_sensitive=False)
+        async with StubOpenAIServer(chunks_count=10) as upstream:
+            titles = await asyncio.gather(*[get_title("Hi what up?", "Hello!") for _ in range(3)])
+        self.assertEqual(titles, [upstream.content] * 3)
+        self.assertEqual(len(upstream.requests), 1)
@@ -0,0 +1,60 @@
+from django.test import SimpleTestCase
+
+from src.utils.gpt import ANSWER_TOKENS, GPT_VERSIONS, SYSTEM_MESSAGE, trim_conversation
+from src.utils.tokens import count_message_tokens, count_messages_tokens, count_tokens
+
+
+class TokensTests(SimpleTestCase):
+    def test_count_tokens(self):
+        self.assertEqual(count_tokens(""), 0)
+        self.assertEqual(count_tokens("Hello world"), 2)
+        self.assertEqual(count_tokens("12345678"), 3)
+        self.assertGreater(count_tokens("Hello world " * 100), count_tokens("Hello world " * 10))
+
+    def test_count_messages_tokens(self):
+        messages = [{"role": "user", "content": "Hi what up?"}, {"role": "assistant", "content": "Hello!"}]
+        self.assertEqual(
+            count_messages_tokens(messages),
+            sum(count_tokens(m["role"]) + count_tokens(m["content"]) + 3 for m in messages) + 3,
+        )
+
+    def test_message_tokens_are_cached(self):
+        count_message_tokens.cache_clear()
+        count_message_tokens("user", "Hi what up?")
+        count_message_tokens("user", "Hi what up?")
+        self.assertEqual(count_message_tokens.cache_info().hits, 1)
+
+
+class TrimConversationTests(SimpleTestCase):
+    def setUp(self):
+        self.conversation = [
+            {"role": ["user", "assistant"][idx % 2], "content": f"Message {idx} " + "lorem ipsum " * 200}
+            for idx in range(100)
+        ]
+
+    def _fits(self, messages, model):
+        return count_messages_tokens([SYSTEM_MESSAGE, *messages]) + ANSWER_TOKENS <= GPT_VERSIONS[model].context_limit
+
+    def test_short_conversation_is_kept(self):
+        self.assertEqual(trim_conversation(self.conversation[:2], "gpt35"), self.conversation[:2])
+
+    def test_oldest_messages_are_dropped(self):
+        for model in GPT_VERSIONS:
+            with self.subTest(model=model):
+                trimmed = trim_conversation(self.conversation, model)
+                first_kept_idx = len(self.conversation) - len(trimmed)
+                self.assertEqual(trimmed, self.conversation[first_kept_idx:])
+                self.assertTrue(self._fits(trimmed, model))
+                dropped_message = self.conversation[first_kept_idx - 1]
+                self.assertFalse(self._fits([dropped_message, *trimmed], model))
+
+    def test_larger_context_keeps_more_messages(self):
+        counts = [
+            len(trim_conversation(self.conversation, model)) for model in ["gpt35", "gpt4", "gpt35-16k", "gpt4-32k"]
+        ]
+        self.assertEqual(counts, sorted(counts))
+        self.assertLess(counts[0], counts[-1])
+
+    def test_latest_message_is_always_kept(self):
+        message = {"role": "user", "content": "lorem ipsum " * 10000}
+        self.assertEqual(trim_conversation([*self.conversation[:2], message], "gpt35"), [message])
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import warnings
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.test import TestCase, TransactionTestCase
+
+from authentication.models import CustomUser
+from chat.models import Conversation, Message, Role, Version
+from src.utils.cache import completion_cache
+from src.utils.gpt import GPT_VERSIONS
+from src.utils.scheduler import scheduler
+from src.utils.stub_openai import StubOpenAIServer
+
+
+class AsyncStreamingViewsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.mock_user = CustomUser.objects.create(email="mock@email.com", is_active=True)
+        cls.conversation = Conversation.objects.create(title="Test title", user=cls.mock_user)
+        version = Version.objects.create(conversation=cls.conversation)
+        for role, content in [("user", "Hi what up?"), ("assistant", "Hello, how can I help you?")]:
+            Message.objects.create(version=version, role=Role.objects.get_or_create(name=role)[0], content=content)
+        cls.conversation.active_version = version
+        cls.conversation.save()
+
+    def setUp(self):
+        self.async_client.force_login(self.mock_user)
+
+    async def _post(self, path, data):
+        return await self.async_client.post(path, data=json.dumps(data), content_type="application/json")
+
+    @staticmethod
+    async def _content(response):
+        return b"".join([chunk async for chunk in response.streaming_content]).decode()
+
+    async def test_get_conversation_streams_answer(self):
+        conversation = [{"role": "user", "content": "Hi what up?"}]
+        async with StubOpenAIServer(chunks_count=5) as upstream:
+            response = await self._post("/gpt/conversation/", {"conversation": conversation, "model": "gpt4"})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(await self._content(response), upstream.content)
+
+    async def test_get_answer_streams_answer(self):
+        async with StubOpenAIServer(chunks_count=5) as upstream:
+            response = await self._post("/gpt/question/", {"user_question": "Hi what up?"})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(await self._content(response), upstream.content)
+
+    async def test_question_slot_is_freed_when_client_goes_away(self):
+        async def read(streaming_content, received):
+            async for chunk in streaming_content:
+                received.set()
+
+        engine = GPT_VERSIONS["gpt35"].engine
+        await sync_to_async(completion_cache.clear)()
+        async with StubOpenAIServer(chunks_count=50, chunk_delay=0.05):
+            response = await self._post("/gpt/question/", {"user_question": "Tell me a long story"})
+            received = asyncio.Event()
+            task = asyncio.create_task(read(response.streaming_content, received))
+            await received.wait()
+            self.assertEqual(scheduler.stats()[engine]["active"], 1)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            # the upstream call is cancelled with its last subscriber, long before the end of the answer
+            await asyncio.sleep(0.1)
+            self.assertEqual(scheduler.stats()[engine]["active"], 0)
+
+    async def test_get_conversation_by_id_builds_history(self):
+        async with StubOpenAIServer(chunks_count=5) as upstream:
+            response = await self._post(
+                f"/gpt/conversation/{self.conversation.id}/", {"message": "Tell me a joke", "model": "gpt35"}
+            )
+            self.assertEqual(await self._content(response), upstream.content)
+
+        self.assertEqual(
+            upstream.requests[0]["messages"],
+            [
+                {"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": "Hi what up?"},
+                {"role": "assistant", "content": "Hello, how can I help you?"},
+                {"role": "user", "content": "Tell me a joke"},
+            ],
+        )
+
+    async def test_get_conversation_by_id_without_message(self):
+        async with StubOpenAIServer(chunks_count=5) as upstream:
+            response = await self._post(f"/gpt/conversation/{self.conversation.id}/", {"model": "gpt35"})
+            await self._content(response)
+        self.assertEqual(
+            upstream.requests[0]["messages"][-1], {"role": "assistant", "content": "Hello, how can I help you?"}
+        )
+
+    async def test_get_conversation_by_id_of_other_user(self):
+        other_user = await CustomUser.objects.acreate(email="other@email.com", is_active=True)
+        await self.async_client.aforce_login(other_user)
+        response = await self._post(f"/gpt/conversation/{self.conversation.id}/", {"model": "gpt35"})
+        self.assertEqual(response.status_code, 404)
+
+    async def test_unknown_model(self):
+        for data in [{"message": "Tell me a joke"}, {"message": "Tell me a joke", "model": "gpt5"}]:
+            response = await self._post(f"/gpt/conversation/{self.conversation.id}/", data)
+            self.assertEqual(response.status_code, 400)
+        response = await self._post("/gpt/conversation/", {"conversation": [], "model": "gpt5"})
+        self.assertEqual(response.status_code, 400)
+
+    async def test_invalid_json(self):
+        response = await self.async_client.post("/gpt/question/", data="{", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+    async def test_get_not_allowed(self):
+        response = await self.async_client.get("/gpt/conversation/")
+        self.assertEqual(response.status_code, 405)
+
+    async def test_login_required(self):
+        await self.async_client.alogout()
+        response = await self._post("/gpt/question/", {"user_question": "Hi what up?"})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.url.startswith(settings.LOGIN_URL))
+
+
+class WSGIStreamingViewsTests(TransactionTestCase):
+    """The streaming views served by a sync handler, e.g. `manage.py runserver`, running the view in an event loop."""
+
+    # the sessions are read from the replica alias of the production database profile
+    databases = "__all__"
+
+    def setUp(self):
+        completion_cache.clear()
+        self.client.force_login(CustomUser.objects.create(email="mock@email.com", is_active=True))
+
+    def _post(self, path, data):
+        response = self.client.post(path, data=json.dumps(data), content_type="application/json")
+        with warnings.catch_warnings():
+            # the response is consumed in an event loop of its own, the way WSGI servers iterate it
+            warnings.filterwarnings("ignore", message="StreamingHttpResponse must consume asynchronous iterators")
+            return response.status_code, b"".join(response).decode()
+
+    async def test_answers_are_streamed_whole(self):
+        conversation = [{"role": "user", "content": "Hi what up?"}]
+        async with StubOpenAIServer(chunks_count=20) as upstream:
+            for path, data in [
+                ("/gpt/question/", {"user_question": "Hi what up?"}),
+                ("/gpt/conversation/", {"conversation": conversation, "model": "gpt4"}),
+            ]:
+                # a thread without a running event loop, like the threads of a WSGI server
+                self.assertEqual(await asyncio.to_thread(self._post, path, data), (200, upstream.content))
+        for version in [GPT_VERSIONS["gpt35"], GPT_VERSIONS["gpt4"]]:
+            self.assertEqual(scheduler.stats()[version.engine]["active"], 0)
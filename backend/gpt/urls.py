@@ -5,6 +5,11 @@ from gpt import views
 urlpatterns = [
     path("", views.gpt_root_view),
     path("title/", views.get_title),
+    path("cache_stats/", views.get_cache_stats),
+    path("pool_stats/", views.get_pool_stats),
+    path("scheduler_stats/", views.get_scheduler_stats),
+    path("rate_limit/", views.get_rate_limit),
     path("question/", views.get_answer),
     path("conversation/", views.get_conversation),
+    path("conversation/<uuid:pk>/", views.get_conversation_by_id),
 ]
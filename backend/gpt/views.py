@@ -1,8 +1,32 @@
+import json
+import weakref
+from typing import AsyncIterator, Callable, Optional
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth.decorators import login_required
+from django.core.exceptions import ValidationError
 from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_POST
 from rest_framework.decorators import api_view
 
-from src.utils.gpt import get_conversation_answer, get_gpt_title, get_simple_answer
+from chat.models import Conversation
+from chat.utils.answers import StreamedAnswer, answer_writer
+from chat.utils.history import get_conversation_history
+from gpt.decorators import alogin_required
+from src.utils.cache import completion_cache
+from src.utils.gpt import (
+    GPT_VERSIONS,
+    SYSTEM_MESSAGE,
+    aget_conversation_answer,
+    aget_simple_answer,
+    get_gpt_title,
+    trim_conversation,
+)
+from src.utils.http_pool import upstream_pool
+from src.utils.rate_limit import RateLimited, Usage, rate_limiter
+from src.utils.scheduler import Priority, Reservation, SchedulerOverloaded, scheduler
+from src.utils.single_flight import single_flight
+from src.utils.tokens import count_messages_tokens
 
 
 @api_view(["GET"])
@@ -14,21 +38,231 @@ def gpt_root_view(request):
 @api_view(["POST"])
 def get_title(request):
     data = request.data
-    title = get_gpt_title(data["user_question"], data["chatbot_response"])
-    return JsonResponse({"content": title})
+    prompt = [
+        {"role": "user", "content": data["user_question"]},
+        {"role": "assistant", "content": data["chatbot_response"]},
+    ]
+    try:
+        usage = rate_limiter.start(request.user.pk, GPT_VERSIONS["gpt35"].engine, count_messages_tokens(prompt))
+    except RateLimited as e:
+        return _rate_limited_response(e)
+
+    try:
+        title = get_gpt_title(data["user_question"], data["chatbot_response"])
+    except SchedulerOverloaded as e:
+        usage.cancel()
+        return _overloaded_response(e)
+    except BaseException:
+        usage.cancel()
+        raise
+    usage.finish(title)
+    return JsonResponse({"content": title}, headers=usage.headers())
 
 
 @login_required
-@api_view(["POST"])
-def get_answer(request):
-    data = request.data
-    return StreamingHttpResponse(get_simple_answer(data["user_question"], stream=True), content_type="text/html")
+@api_view(["GET"])
+def get_cache_stats(request):
+    return JsonResponse({**completion_cache.stats(), **single_flight.stats()})
 
 
 @login_required
-@api_view(["POST"])
-def get_conversation(request):
-    data = request.data
-    return StreamingHttpResponse(
-        get_conversation_answer(data["conversation"], data["model"], stream=True), content_type="text/html"
+@api_view(["GET"])
+def get_pool_stats(request):
+    return JsonResponse(upstream_pool.stats())
+
+
+@login_required
+@api_view(["GET"])
+def get_scheduler_stats(request):
+    return JsonResponse(scheduler.stats())
+
+
+@login_required
+@api_view(["GET"])
+def get_rate_limit(request):
+    """Returns the tokens left to the user for each model, without taking any."""
+    return JsonResponse(
+        {model: rate_limiter.remaining(request.user.pk, version.engine) for model, version in GPT_VERSIONS.items()}
+    )
+
+
+# The streaming views are async, so under ASGI every stream is a coroutine instead of a worker thread held for the
+# whole generation
+
+
+@alogin_required
+@require_POST
+async def get_answer(request):
+    data = _load_json(request)
+    if data is None:
+        return JsonResponse({"detail": "JSON parse error"}, status=400)
+    messages = [{"role": "user", "content": data["user_question"]}]
+    try:
+        usage = await _start_usage(request, "gpt35", messages)
+    except RateLimited as e:
+        return _rate_limited_response(e)
+    return await _stream_response(
+        lambda reservation: aget_simple_answer(data["user_question"], reservation),
+        usage,
+        GPT_VERSIONS["gpt35"].engine,
+        Priority.QUESTION,
+    )
+
+
+@alogin_required
+@require_POST
+async def get_conversation(request):
+    data = _load_json(request)
+    if data is None:
+        return JsonResponse({"detail": "JSON parse error"}, status=400)
+    if data.get("model") not in GPT_VERSIONS:
+        return _unknown_model_response()
+    answer = None
+    if data.get("persist"):
+        # the answer is stored in the active version of the conversation, the question is expected to be there already
+        user = await request.auser()
+        try:
+            conversation = await Conversation.objects.filter(user=user, pk=data.get("conversation_id")).afirst()
+        except ValidationError:  # not a UUID
+            conversation = None
+        if conversation is None:
+            return JsonResponse({"detail": "Conversation not found"}, status=404)
+        if conversation.active_version_id is None:
+            return JsonResponse({"detail": "Active version not set for this conversation."}, status=400)
+        answer = StreamedAnswer(conversation.active_version_id)
+    try:
+        usage = await _start_usage(request, data["model"], data["conversation"])
+    except RateLimited as e:
+        return _rate_limited_response(e)
+    return await _stream_response(
+        lambda reservation: aget_conversation_answer(data["conversation"], data["model"], reservation),
+        usage,
+        GPT_VERSIONS[data["model"]].engine,
+        Priority.CHAT,
+        answer,
     )
+
+
+@alogin_required
+@require_POST
+async def get_conversation_by_id(request, pk):
+    """
+    Variant of `get_conversation` taking only the new user message, the conversation history is taken from the active
+    version of the conversation. The message is optional, e.g. when regenerating the last answer. With `persist`, the
+    message and the answer are stored in the active version as well.
+    """
+    data = _load_json(request)
+    if data is None:
+        return JsonResponse({"detail": "JSON parse error"}, status=400)
+    if data.get("model") not in GPT_VERSIONS:
+        return _unknown_model_response()
+
+    user = await request.auser()
+    conversation = await Conversation.objects.select_related("active_version").filter(user=user, pk=pk).afirst()
+    if conversation is None:
+        return JsonResponse({"detail": "Conversation not found"}, status=404)
+
+    messages = await sync_to_async(get_conversation_history)(conversation)
+    if data.get("message"):
+        messages = [*messages, {"role": "user", "content": data["message"]}]
+    answer = None
+    if data.get("persist"):
+        if conversation.active_version_id is None:
+            return JsonResponse({"detail": "Active version not set for this conversation."}, status=400)
+        answer = StreamedAnswer(conversation.active_version_id, question=data.get("message") or None)
+    try:
+        usage = await _start_usage(request, data["model"], messages)
+    except RateLimited as e:
+        return _rate_limited_response(e)
+    return await _stream_response(
+        lambda reservation: aget_conversation_answer(messages, data["model"], reservation),
+        usage,
+        GPT_VERSIONS[data["model"]].engine,
+        Priority.CHAT,
+        answer,
+    )
+
+
+async def _start_usage(request, model: str, messages: list[dict[str, str]]) -> Usage:
+    """Lets the request through the rate limits of the user, charging the prompt as it is sent to the model."""
+    user = await request.auser()
+    prompt_tokens = count_messages_tokens([SYSTEM_MESSAGE, *trim_conversation(messages, model)])
+    # the limits may be kept in a SQLite file, so they are not checked on the event loop
+    return await sync_to_async(rate_limiter.start, thread_sensitive=False)(
+        user.pk, GPT_VERSIONS[model].engine, prompt_tokens
+    )
+
+
+async def _stream_response(
+    chunks_factory: Callable[[Reservation], AsyncIterator[str]],
+    usage: Usage,
+    engine: str,
+    priority: Priority,
+    answer: Optional[StreamedAnswer] = None,
+):
+    """
+    Streams the chunks of `chunks_factory(reservation)` once a slot of the engine is reserved for them, so that a
+    request rejected by the scheduler is answered with 503 instead of an empty stream. The chunks are only read by the
+    response: under WSGI the view runs in an event loop of its own, closed once it returns. The slot is released once
+    the stream ends, the client going away included. The tokens of the answer are charged to the user once the stream
+    ends, unless no upstream call was made for it, e.g. for a cached answer. The budget left is sent in the
+    `X-RateLimit-*` headers. An `answer` to be stored is handed over to the answer writer while it is streamed and once
+    the stream ends, its message id is sent in the `X-Message-Id` header.
+    """
+    try:
+        reservation = await scheduler.areserve(engine, priority)
+    except SchedulerOverloaded as e:
+        await sync_to_async(usage.cancel, thread_sensitive=False)()
+        return _overloaded_response(e)
+    except BaseException:
+        await sync_to_async(usage.cancel, thread_sensitive=False)()
+        raise
+
+    async def stream():
+        chunks = chunks_factory(reservation)
+        chunks_so_far = []
+        try:
+            async for chunk in chunks:
+                chunks_so_far.append(chunk)
+                # the writer only takes the answer, the database is written by its own thread
+                if answer is not None and answer.append(chunk):
+                    answer_writer.flush(answer)
+                yield chunk
+        finally:
+            await chunks.aclose()
+            reservation.release()
+            if answer is not None:
+                answer_writer.flush(answer, finished=True)
+            if reservation.used:
+                await sync_to_async(usage.finish, thread_sensitive=False)("".join(chunks_so_far))
+            else:
+                await sync_to_async(usage.cancel, thread_sensitive=False)()
+
+    headers = usage.headers()
+    if answer is not None:
+        headers["X-Message-Id"] = str(answer.message_id)
+    response = StreamingHttpResponse(stream(), content_type="text/html", headers=headers)
+    # a response which is never streamed, e.g. when the client went away before, does not keep the slot or the stream
+    # of the user either
+    weakref.finalize(response, reservation.release)
+    weakref.finalize(response, usage.cancel)
+    return response
+
+
+def _unknown_model_response():
+    return JsonResponse({"detail": f"Unknown model, expected one of: {', '.join(GPT_VERSIONS)}"}, status=400)
+
+
+def _overloaded_response(error: SchedulerOverloaded):
+    return JsonResponse({"detail": str(error)}, status=503, headers={"Retry-After": str(error.retry_after)})
+
+
+def _rate_limited_response(error: RateLimited):
+    return JsonResponse({"detail": str(error)}, status=429, headers={"Retry-After": str(error.retry_after)})
+
+
+def _load_json(request):
+    try:
+        return json.loads(request.body)
+    except ValueError:
+        return None
@@ -0,0 +1,225 @@
+"""
+Cache of LLM completions.
+
+Completions are cached as the list of their streamed chunks under a key made of the engine, the messages and the
+sampling parameters, so cached streams are replayed chunk by chunk through the same generator interface. The cache is
+made of tiers checked in order: an in-memory LRU with TTL and an optional SQLite file shared between processes. Hits in
+a lower tier are copied to the upper ones.
+
+It is configured with environment variables:
+
+- `GPT_CACHE_TTL` - seconds completions are cached for, 0 disables the cache - default: 3600
+- `GPT_CACHE_MAX_ENTRIES` - completions kept in memory - default: 1024
+- `GPT_CACHE_PATH` - path of the SQLite file of the disk tier, no disk tier if not set
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+from typing import AsyncIterable, Callable, Iterable, Iterator, Optional, Protocol
+
+from asgiref.sync import sync_to_async
+
+__all__ = ["CompletionCache", "MemoryCacheTier", "SQLiteCacheTier", "completion_cache", "make_key"]
+
+
+class CacheTier(Protocol):
+    name: str
+
+    def get(self, key: str) -> Optional[list[str]]:
+        ...
+
+    def set(self, key: str, chunks: list[str]) -> None:
+        ...
+
+    def clear(self) -> None:
+        ...
+
+
+class MemoryCacheTier:
+    """In-memory LRU cache whose entries expire `ttl` seconds after being set."""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[list[str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, chunks = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return chunks
+
+    def set(self, key: str, chunks: list[str]) -> None:
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, chunks)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCacheTier:
+    """Cache stored in a SQLite file, so it survives restarts and is shared between processes."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str, ttl: float = 3600, clock: Callable[[], float] = time.time):
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, chunks TEXT NOT NULL, expires_at REAL)"
+            )
+
+    def get(self, key: str) -> Optional[list[str]]:
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT chunks FROM completions WHERE key = ? AND expires_at > ?", (key, self.clock())
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def set(self, key: str, chunks: list[str]) -> None:
+        now = self.clock()
+        with self._connect() as connection:
+            connection.execute("DELETE FROM completions WHERE expires_at <= ?", (now,))
+            connection.execute(
+                "INSERT OR REPLACE INTO completions (key, chunks, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(chunks), now + self.ttl),
+            )
+
+    def clear(self) -> None:
+        with self._connect() as connection:
+            connection.execute("DELETE FROM completions")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Yields a connection committing on exit and closed afterwards."""
+        with closing(sqlite3.connect(self.path, timeout=5)) as connection, connection:
+            yield connection
+
+
+class CompletionCache:
+    """
+    Tiered cache of completions counting its hits and misses.
+
+    Examples
+    --------
+    >>> cache = CompletionCache([MemoryCacheTier()])
+    >>> key = make_key("gpt-35-turbo-0613", [{"role": "user", "content": "Hi"}], {"temperature": 0.7})
+    >>> for chunk in cache.stream(key, lambda: iter(["Hello", "!"])):
+    ...     print(chunk)
+    """
+
+    def __init__(self, tiers: list[CacheTier], enabled: bool = True):
+        self.tiers = tiers
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters = {}
+        self.reset_stats()
+
+    @classmethod
+    def from_env(cls) -> "CompletionCache":
+        ttl = float(os.getenv("GPT_CACHE_TTL", 3600))
+        tiers = [MemoryCacheTier(int(os.getenv("GPT_CACHE_MAX_ENTRIES", 1024)), ttl)]
+        if os.getenv("GPT_CACHE_PATH"):
+            tiers.append(SQLiteCacheTier(os.getenv("GPT_CACHE_PATH"), ttl))
+        return cls(tiers, enabled=ttl > 0)
+
+    def get(self, key: str) -> Optional[list[str]]:
+        """Returns the cached chunks of the completion, copying them to the tiers above the one they were found in."""
+        if not self.enabled:
+            return None
+        for idx, tier in enumerate(self.tiers):
+            chunks = tier.get(key)
+            if chunks is not None:
+                for upper_tier in self.tiers[:idx]:
+                    upper_tier.set(key, chunks)
+                self._count("hits", f"{tier.name}_hits")
+                return chunks
+        self._count("misses")
+        return None
+
+    def set(self, key: str, chunks: list[str]) -> None:
+        if self.enabled:
+            for tier in self.tiers:
+                tier.set(key, chunks)
+
+    def stream(self, key: str, chunks_factory: Callable[[], Iterable[str]]) -> Iterator[str]:
+        """
+        Yields the cached chunks of the completion, or the chunks of `chunks_factory()` which are cached once the
+        completion is fully streamed.
+        """
+        chunks = self.get(key)
+        if chunks is not None:
+            yield from chunks
+            return
+
+        chunks = []
+        for chunk in chunks_factory():
+            chunks.append(chunk)
+            yield chunk
+        self.set(key, chunks)
+
+    async def astream(self, key: str, chunks_factory: Callable[[], AsyncIterable[str]]) -> AsyncIterable[str]:
+        """Async counterpart of `stream`, the tiers are read and written in a worker thread, off the event loop."""
+        chunks = await sync_to_async(self.get, thread_sensitive=False)(key)
+        if chunks is not None:
+            for chunk in chunks:
+                yield chunk
+            return
+
+        chunks = []
+        async for chunk in chunks_factory():
+            chunks.append(chunk)
+            yield chunk
+        await sync_to_async(self.set, thread_sensitive=False)(key, chunks)
+
+    def stats(self) -> dict[str, int]:
+        """Returns the hit and miss counters, together with the hits of each tier."""
+        with self._lock:
+            return dict(self._counters)
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._counters = {"hits": 0, "misses": 0, **{f"{tier.name}_hits": 0 for tier in self.tiers}}
+
+    def clear(self) -> None:
+        for tier in self.tiers:
+            tier.clear()
+
+    def _count(self, *names: str) -> None:
+        with self._lock:
+            for name in names:
+                self._counters[name] += 1
+
+
+def make_key(engine: str, messages: list[dict[str, str]], params: dict) -> str:
+    """Returns the cache key of a completion request."""
+    data = json.dumps({"engine": engine, "messages": messages, "params": params}, sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+completion_cache = CompletionCache.from_env()
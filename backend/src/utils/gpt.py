@@ -1,6 +1,15 @@
+import json
 from dataclasses import dataclass
+from typing import AsyncIterator, Optional
 
 from src.libs import openai
+from src.utils.cache import completion_cache, make_key
+from src.utils.http_pool import upstream_pool
+from src.utils.scheduler import Priority, Reservation, scheduler
+from src.utils.single_flight import single_flight
+from src.utils.tokens import count_message_tokens, count_messages_tokens
+
+upstream_pool.install()
 
 GPT_40_PARAMS = dict(
     temperature=0.7,
@@ -12,34 +21,100 @@ GPT_40_PARAMS = dict(
 )
 
 
+SYSTEM_MESSAGE = {"role": "system", "content": "You are a helpful assistant."}
+ANSWER_TOKENS = 1024  # part of the context window kept free for the answer
+
+
 @dataclass
 class GPTVersion:
     name: str
     engine: str
+    context_limit: int  # tokens of the prompt and the answer together
 
 
 GPT_VERSIONS = {
-    "gpt35": GPTVersion("gpt35", "gpt-35-turbo-0613"),
-    "gpt35-16k": GPTVersion("gpt35-16k", "gpt-35-turbo-16k"),
-    "gpt4": GPTVersion("gpt4", "gpt-4-0613"),
-    "gpt4-32k": GPTVersion("gpt4-32k", "gpt4-32k-0613"),
+    "gpt35": GPTVersion("gpt35", "gpt-35-turbo-0613", 4096),
+    "gpt35-16k": GPTVersion("gpt35-16k", "gpt-35-turbo-16k", 16384),
+    "gpt4": GPTVersion("gpt4", "gpt-4-0613", 8192),
+    "gpt4-32k": GPTVersion("gpt4-32k", "gpt4-32k-0613", 32768),
 }
 
 
+def trim_conversation(conversation: list[dict[str, str]], model: str) -> list[dict[str, str]]:
+    """
+    Drops the oldest messages of the conversation that do not fit in the context window of the model, together with
+    the system message and `ANSWER_TOKENS` left for the answer. The latest message is always kept.
+
+    Parameters
+    ----------
+    conversation : list[dict[str, str]]
+        The role and content of each message, without the system message.
+    model : str
+        The key of the model in `GPT_VERSIONS`.
+
+    Returns
+    -------
+    list[dict[str, str]]
+        The latest messages of the conversation fitting in the context window.
+    """
+    budget = GPT_VERSIONS[model].context_limit - ANSWER_TOKENS - count_messages_tokens([SYSTEM_MESSAGE])
+    first_kept_idx = len(conversation)
+    for message in reversed(conversation):
+        budget -= count_message_tokens(message["role"], message["content"])
+        if budget < 0 and first_kept_idx < len(conversation):
+            break
+        first_kept_idx -= 1
+    return conversation[first_kept_idx:]
+
+
 def get_simple_answer(prompt: str, stream: bool = True):
     kwargs = {**GPT_40_PARAMS, **dict(stream=stream)}
-
-    for resp in openai.ChatCompletion.create(
-        engine=GPT_VERSIONS["gpt35"].engine,
-        messages=[{"role": "system", "content": "You are a helpful assistant."}, {"role": "user", "content": prompt}],
-        **kwargs,
-    ):
-        choices = resp.get("choices", [])
-        if not choices:
-            continue
-        chunk = choices.pop()["delta"].get("content")
-        if chunk:
+    engine = GPT_VERSIONS["gpt35"].engine
+    messages = [SYSTEM_MESSAGE, {"role": "user", "content": prompt}]
+
+    def create_chunks():
+        with scheduler.slot(engine, Priority.QUESTION):
+            for resp in openai.ChatCompletion.create(engine=engine, messages=messages, **kwargs):
+                chunk = _get_chunk(resp)
+                if chunk:
+                    yield chunk
+
+    key = _get_cache_key(engine, messages)
+    yield from completion_cache.stream(key, lambda: single_flight.stream(key, create_chunks))
+
+
+async def aget_simple_answer(prompt: str, reservation: Optional[Reservation] = None) -> AsyncIterator[str]:
+    """
+    Async counterpart of `get_simple_answer`. The upstream call runs in the slot of `reservation` if one was taken
+    already, which is released right away if the answer is cached or being generated for another caller.
+    """
+    engine = GPT_VERSIONS["gpt35"].engine
+    messages = [SYSTEM_MESSAGE, {"role": "user", "content": prompt}]
+
+    async def create_chunks():
+        nonlocal reservation
+        taken, reservation = reservation, None
+        async with scheduler.aslot(engine, Priority.QUESTION, taken):
+            async with upstream_pool.aiosession():
+                response = await openai.ChatCompletion.acreate(
+                    engine=engine, messages=messages, **{**GPT_40_PARAMS, **dict(stream=True)}
+                )
+            async for resp in response:
+                chunk = _get_chunk(resp)
+                if chunk:
+                    yield chunk
+
+    key = _get_cache_key(engine, messages)
+    try:
+        async for chunk in completion_cache.astream(key, lambda: single_flight.astream(key, create_chunks)):
+            # the upstream call of this caller took the reservation before its first chunk, if it made one
+            if reservation is not None:
+                reservation.release()
+                reservation = None
             yield chunk
+    finally:
+        if reservation is not None:
+            reservation.release()
 
 
 def get_gpt_title(prompt: str, response: str):
@@ -49,29 +124,103 @@ def get_gpt_title(prompt: str, response: str):
         "resulting title. Always return some raw title and nothing more."
     )
     usr_msg = f'user_question: "{prompt}"\n' f'chatbot_response: "{response}"'
+    engine = GPT_VERSIONS["gpt35"].engine
+    messages = [{"role": "system", "content": sys_msg}, {"role": "user", "content": usr_msg}]
 
-    response = openai.ChatCompletion.create(
-        engine=GPT_VERSIONS["gpt35"].engine,
-        messages=[{"role": "system", "content": sys_msg}, {"role": "user", "content": usr_msg}],
-        **GPT_40_PARAMS,
-    )
+    def create_chunks():
+        with scheduler.slot(engine, Priority.TITLE):
+            response = openai.ChatCompletion.create(engine=engine, messages=messages, **GPT_40_PARAMS)
+        return [response["choices"][0]["message"]["content"]]
 
-    result = response["choices"][0]["message"]["content"].replace('"', "")
+    key = _get_cache_key(engine, messages)
+    result = "".join(completion_cache.stream(key, lambda: single_flight.stream(key, create_chunks))).replace('"', "")
     return result
 
 
+def get_gpt_titles(conversations: list[tuple[str, str]]) -> list[str]:
+    """
+    Makes the titles of several conversations with one upstream call, falling back to a call per conversation if the
+    answer is not a list with a title for each of them.
+
+    Parameters
+    ----------
+    conversations : list[tuple[str, str]]
+        The user's question and chatbot's first response of each conversation.
+
+    Returns
+    -------
+    list[str]
+        The title of each conversation.
+    """
+    if len(conversations) == 1:
+        return [get_gpt_title(*conversations[0])]
+
+    sys_msg: str = (
+        "As an AI Assistant your goal is to make very short titles, few words max each, for conversations between user "
+        "and chatbot. You will be given a JSON list with the user's question and chatbot's first response of each "
+        "conversation and you will return only a JSON list of the resulting titles, in the same order. Always return "
+        "some raw titles and nothing more."
+    )
+    usr_msg = json.dumps(
+        [{"user_question": prompt, "chatbot_response": response} for prompt, response in conversations]
+    )
+    engine = GPT_VERSIONS["gpt35"].engine
+    with scheduler.slot(engine, Priority.TITLE):
+        response = openai.ChatCompletion.create(
+            engine=engine,
+            messages=[{"role": "system", "content": sys_msg}, {"role": "user", "content": usr_msg}],
+            **GPT_40_PARAMS,
+        )
+
+    try:
+        titles = json.loads(response["choices"][0]["message"]["content"])
+    except ValueError:
+        titles = None
+    if not isinstance(titles, list) or len(titles) != len(conversations) or not all(isinstance(t, str) for t in titles):
+        return [get_gpt_title(prompt, response) for prompt, response in conversations]
+    return [title.replace('"', "") for title in titles]
+
+
 def get_conversation_answer(conversation: list[dict[str, str]], model: str, stream: bool = True):
     kwargs = {**GPT_40_PARAMS, **dict(stream=stream)}
     engine = GPT_VERSIONS[model].engine
 
-    for resp in openai.ChatCompletion.create(
-        engine=engine,
-        messages=[{"role": "system", "content": "You are a helpful assistant."}, *conversation],
-        **kwargs,
-    ):
-        choices = resp.get("choices", [])
-        if not choices:
-            continue
-        chunk = choices.pop()["delta"].get("content")
-        if chunk:
-            yield chunk
+    with scheduler.slot(engine, Priority.CHAT):
+        for resp in openai.ChatCompletion.create(
+            engine=engine,
+            messages=[SYSTEM_MESSAGE, *trim_conversation(conversation, model)],
+            **kwargs,
+        ):
+            chunk = _get_chunk(resp)
+            if chunk:
+                yield chunk
+
+
+async def aget_conversation_answer(
+    conversation: list[dict[str, str]], model: str, reservation: Optional[Reservation] = None
+) -> AsyncIterator[str]:
+    """Async counterpart of `get_conversation_answer`, running in the slot of `reservation` if one was taken already."""
+    engine = GPT_VERSIONS[model].engine
+    async with scheduler.aslot(engine, Priority.CHAT, reservation):
+        async with upstream_pool.aiosession():
+            response = await openai.ChatCompletion.acreate(
+                engine=engine,
+                messages=[SYSTEM_MESSAGE, *trim_conversation(conversation, model)],
+                **{**GPT_40_PARAMS, **dict(stream=True)},
+            )
+        async for resp in response:
+            chunk = _get_chunk(resp)
+            if chunk:
+                yield chunk
+
+
+def _get_cache_key(engine: str, messages: list[dict[str, str]]) -> str:
+    sampling_params = {name: value for name, value in GPT_40_PARAMS.items() if name != "stream"}
+    return make_key(engine, messages, sampling_params)
+
+
+def _get_chunk(resp) -> Optional[str]:
+    choices = resp.get("choices", [])
+    if not choices:
+        return None
+    return choices.pop()["delta"].get("content")
@@ -0,0 +1,244 @@
+"""
+Pooled keep-alive HTTP connections for the upstream LLM calls.
+
+By default the `openai` client makes a `requests` session per thread, recreated every few minutes, and a new aiohttp
+session, so new connections, for every async call. The pool shares one `requests` session between the threads and one
+aiohttp session per event loop (under ASGI, the only one of the process), both limiting the connections per host and
+closing the ones idle for too long. It counts the connections made and reused.
+
+It is configured with environment variables:
+
+- `GPT_POOL_MAX_CONNECTIONS` - connections open at once by the async session - default: 100
+- `GPT_POOL_MAX_CONNECTIONS_PER_HOST` - connections to a host, a stream holds one until it ends and the sync calls
+  wait for a free one once all are in use - default: 100
+- `GPT_POOL_KEEPALIVE` - seconds idle connections are kept open for - default: 30
+- `GPT_POOL_PREWARM` - connections opened to `OPENAI_API_BASE` in advance, when the server starts and when the session
+  of an event loop is made - default: 0
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from src.libs import openai
+
+__all__ = ["UpstreamPool", "upstream_pool"]
+
+logger = logging.getLogger(__name__)
+
+
+class _CountingPoolMixin:
+    """Counts the connections of an urllib3 pool made and reused, closing the ones idle for too long."""
+
+    upstream_pool: "UpstreamPool"
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        idle_time = self.upstream_pool.clock() - getattr(conn, "released_at", float("inf"))
+        if conn.is_connected and idle_time > self.upstream_pool.keepalive:
+            conn.close()
+            self.upstream_pool.count("sync_evicted_connections")
+        self.upstream_pool.count("sync_reused_connections" if conn.is_connected else "sync_new_connections")
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn.released_at = self.upstream_pool.clock()
+        super()._put_conn(conn)
+
+
+class _PooledAdapter(HTTPAdapter):
+    def __init__(self, upstream_pool: "UpstreamPool", **kwargs):
+        self.upstream_pool = upstream_pool
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        attrs = {"upstream_pool": self.upstream_pool}
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": type("CountingHTTPConnectionPool", (_CountingPoolMixin, HTTPConnectionPool), attrs),
+            "https": type("CountingHTTPSConnectionPool", (_CountingPoolMixin, HTTPSConnectionPool), attrs),
+        }
+
+
+class _SharedSession(requests.Session):
+    """Session shared between the threads, which `openai` does not close when it recreates its sessions."""
+
+    def close(self) -> None:
+        pass
+
+    def close_pools(self) -> None:
+        super().close()
+
+
+class _CountingConnector(aiohttp.TCPConnector):
+    def __init__(self, upstream_pool: "UpstreamPool", **kwargs):
+        self.upstream_pool = upstream_pool
+        super().__init__(**kwargs)
+
+    async def connect(self, req, traces, timeout):
+        self.upstream_pool.count("async_requests")
+        return await super().connect(req, traces, timeout)
+
+    async def _create_connection(self, req, traces, timeout):
+        self.upstream_pool.count("async_new_connections")
+        return await super()._create_connection(req, traces, timeout)
+
+
+class UpstreamPool:
+    """
+    Connection pools of the upstream calls, installed with `install` for the sync calls and `aiosession` for the async
+    ones.
+
+    Examples
+    --------
+    >>> upstream_pool.install()
+    >>> async with upstream_pool.aiosession():
+    ...     response = await openai.ChatCompletion.acreate(engine=engine, messages=messages, stream=True)
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_connections_per_host: int = 100,
+        keepalive: float = 30,
+        prewarm: int = 0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.keepalive = keepalive
+        self.prewarm_count = prewarm
+        self.clock = clock
+        self.session = _SharedSession()
+        # threads wait for a free connection once all of them are in use, rather than open ones the pool cannot keep
+        adapter = _PooledAdapter(self, pool_maxsize=max_connections_per_host, pool_block=True, max_retries=2)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._aiosessions = {}
+        self._lock = threading.Lock()
+        self._counters = {}
+        self.reset_stats()
+
+    @classmethod
+    def from_env(cls) -> "UpstreamPool":
+        return cls(
+            max_connections=int(os.getenv("GPT_POOL_MAX_CONNECTIONS", 100)),
+            max_connections_per_host=int(os.getenv("GPT_POOL_MAX_CONNECTIONS_PER_HOST", 100)),
+            keepalive=float(os.getenv("GPT_POOL_KEEPALIVE", 30)),
+            prewarm=int(os.getenv("GPT_POOL_PREWARM", 0)),
+        )
+
+    def install(self) -> None:
+        """Makes the sync `openai` calls use the shared session."""
+        openai.requestssession = self.session
+
+    @asynccontextmanager
+    async def aiosession(self) -> AsyncIterator[aiohttp.ClientSession]:
+        """Makes the async `openai` calls made within the context use the session of the running event loop."""
+        session = await self.get_aiosession()
+        token = openai.aiosession.set(session)
+        try:
+            yield session
+        finally:
+            openai.aiosession.reset(token)
+
+    async def get_aiosession(self) -> aiohttp.ClientSession:
+        """
+        Returns the session of the running event loop, made on the first call. It is closed when the event loop shuts
+        down its async generators, which `asyncio.run` does before closing it.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            for closed_loop in [other_loop for other_loop in self._aiosessions if other_loop.is_closed()]:
+                del self._aiosessions[closed_loop]
+            entry = self._aiosessions.get(loop)
+
+        if entry is None:
+            connector = _CountingConnector(
+                self,
+                limit=self.max_connections,
+                limit_per_host=self.max_connections_per_host,
+                keepalive_timeout=self.keepalive,
+            )
+            session = aiohttp.ClientSession(connector=connector)
+            keeper = self._keep_aiosession(session)
+            await keeper.__anext__()
+            prewarm_task = None
+            if self.prewarm_count and openai.api_base:
+                prewarm_task = loop.create_task(self._aprewarm(session))
+            entry = (session, keeper, prewarm_task)
+            with self._lock:
+                self._aiosessions[loop] = entry
+        return entry[0]
+
+    def prewarm(self) -> None:
+        """Opens `prewarm_count` connections of the shared session to the OpenAI endpoint."""
+        if not self.prewarm_count or not openai.api_base:
+            return
+        with ThreadPoolExecutor(self.prewarm_count) as executor:
+            for result in executor.map(self._head, [openai.api_base] * self.prewarm_count):
+                if isinstance(result, Exception):
+                    logger.warning("Prewarming the upstream connections failed: %s", result)
+                    break
+
+    def stats(self) -> dict[str, int]:
+        """Returns the requests made and the connections made, reused and evicted by the sync and async sessions."""
+        with self._lock:
+            counters = dict(self._counters)
+        counters["async_reused_connections"] = counters["async_requests"] - counters["async_new_connections"]
+        return counters
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._counters = {
+                "sync_new_connections": 0,
+                "sync_reused_connections": 0,
+                "sync_evicted_connections": 0,
+                "async_requests": 0,
+                "async_new_connections": 0,
+            }
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def close(self) -> None:
+        self.session.close_pools()
+
+    async def _keep_aiosession(self, session: aiohttp.ClientSession):
+        """Async generator living as long as the event loop, closing the session when the loop finalizes it."""
+        try:
+            while True:
+                yield
+        finally:
+            await session.close()
+
+    async def _aprewarm(self, session: aiohttp.ClientSession) -> None:
+        async def head():
+            async with session.head(openai.api_base):
+                pass
+
+        results = await asyncio.gather(*(head() for _ in range(self.prewarm_count)), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            logger.warning("Prewarming the upstream connections failed: %s", errors[0])
+
+    def _head(self, url: str):
+        try:
+            return self.session.head(url, timeout=10).close()
+        except requests.RequestException as e:
+            return e
+
+
+upstream_pool = UpstreamPool.from_env()
@@ -0,0 +1,103 @@
+"""
+Query plan checks for tests.
+
+`assert_no_full_scans` captures the queries run in its block, asks SQLite for the plan of each of them with
+`EXPLAIN QUERY PLAN` and fails if any of them scans a whole table instead of searching an index, so that a changed
+query or a dropped index is noticed before the tables grow. Scans of subqueries, CTEs and virtual tables, e.g. the
+full-text search index, are not table scans. Other databases are not checked.
+"""
+
+import re
+from contextlib import contextmanager
+from typing import Iterable, Iterator
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.test.utils import CaptureQueriesContext
+
+__all__ = ["assert_no_full_scans", "explain_query_plan", "find_full_scans"]
+
+_EXPLAINED_STATEMENTS = ("SELECT", "WITH", "UPDATE", "DELETE")
+# e.g. "SCAN chat_message" or "SCAN chat_message USING INDEX ...", but not "SCAN chat_message_fts VIRTUAL TABLE ..."
+_SCAN_PATTERN = re.compile(r"^SCAN (?P<table>\w+)(?: AS \w+)?(?! VIRTUAL TABLE)(?: USING (?:COVERING )?INDEX \w+)?$")
+
+
+def explain_query_plan(sql: str, connection: BaseDatabaseWrapper) -> list[str]:
+    """
+    Returns the steps of the plan of a query.
+
+    Parameters
+    ----------
+    sql : str
+        The query, with its parameters inlined as in `connection.queries`.
+    connection : BaseDatabaseWrapper
+        The SQLite connection the query is planned on.
+
+    Returns
+    -------
+    list[str]
+        The details of the plan steps, e.g. "SEARCH chat_message USING INDEX ... (version_id=?)".
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+        return [row[3] for row in cursor.fetchall()]
+
+
+def find_full_scans(
+    queries: Iterable[str], connection: BaseDatabaseWrapper, allowed_tables: Iterable[str] = ()
+) -> list[tuple[str, str]]:
+    """
+    Finds the full table scans in the plans of queries.
+
+    Parameters
+    ----------
+    queries : Iterable[str]
+        The queries, with their parameters inlined as in `connection.queries`.
+    connection : BaseDatabaseWrapper
+        The SQLite connection the queries are planned on.
+    allowed_tables : Iterable[str]
+        Tables which may be scanned, e.g. small lookup tables.
+
+    Returns
+    -------
+    list[tuple[str, str]]
+        The queries with full table scans together with the scanning plan step.
+    """
+    tables = set(connection.introspection.table_names()) - set(allowed_tables)
+    full_scans = []
+    for sql in queries:
+        if not sql.lstrip().upper().startswith(_EXPLAINED_STATEMENTS):
+            continue
+        for step in explain_query_plan(sql, connection):
+            match = _SCAN_PATTERN.match(step)
+            if match and match["table"] in tables:
+                full_scans.append((sql, step))
+    return full_scans
+
+
+@contextmanager
+def assert_no_full_scans(using: str = DEFAULT_DB_ALIAS, allowed_tables: Iterable[str] = ()) -> Iterator[None]:
+    """
+    Fails if a query run in the block scans a whole table.
+
+    Parameters
+    ----------
+    using : str
+        Alias of the database the queries are run on.
+    allowed_tables : Iterable[str]
+        Tables which may be scanned, e.g. small lookup tables.
+
+    Raises
+    ------
+    AssertionError
+        If a full table scan is found, listing the queries and their scanning steps.
+    """
+    connection = connections[using]
+    with CaptureQueriesContext(connection) as context:
+        yield
+    if connection.vendor != "sqlite":
+        return
+    full_scans = find_full_scans((query["sql"] for query in context.captured_queries), connection, allowed_tables)
+    if full_scans:
+        details = "\n".join(f"{step}\n    {sql}" for sql, step in full_scans)
+        raise AssertionError(f"{len(full_scans)} full table scans found:\n{details}")
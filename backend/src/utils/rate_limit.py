@@ -0,0 +1,256 @@
+"""
+Rate limiting of the GPT calls of each user.
+
+Every user has a token bucket per engine, holding up to a minute of tokens and refilled continuously. A call is let
+through while the bucket is not empty, and charged with the tokens of its prompt and answer once it is finished, so the
+bucket may go below zero after a long answer and stays closed until refilled. Streamed answers replayed from the
+completion cache, or generated by the call of another request, are not charged, titles are. The streams of a user
+running at once are capped as well. The buckets and streams are kept in memory, or in a SQLite file shared by the
+workers of the server.
+
+It is configured with environment variables:
+
+- `GPT_RATE_LIMIT_TOKENS_PER_MINUTE` - tokens a user may use per minute and engine, 0 disables the limits
+  - default: 40000
+- `GPT_RATE_LIMIT_STREAMS` - calls a user may run at once - default: 3
+- `GPT_RATE_LIMIT_PATH` - path of the SQLite file shared by the workers, the limits are per process if not set
+"""
+
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing, contextmanager
+from typing import Callable, Iterator, Optional, Protocol
+
+from src.utils.tokens import count_tokens
+
+__all__ = ["MemoryRateLimitStore", "RateLimited", "RateLimiter", "SQLiteRateLimitStore", "Usage", "rate_limiter"]
+
+STREAM_LEASE_TTL = 600  # seconds after which a stream not released, e.g. by a killed worker, stops counting
+
+
+class RateLimited(Exception):
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimitStore(Protocol):
+    def update_bucket(self, key: str, capacity: float, rate: float, cost: float, now: float) -> float:
+        """Refills the bucket up to `capacity` at `rate` tokens per second, takes `cost` and returns the tokens left."""
+        ...
+
+    def acquire_stream(self, user_key: str, limit: int, now: float) -> Optional[str]:
+        """Returns the id of a new stream of the user, None if the user already runs `limit` streams."""
+        ...
+
+    def release_stream(self, stream_id: str) -> None:
+        ...
+
+
+class MemoryRateLimitStore:
+    """Limits kept in memory, so every process has its own."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def update_bucket(self, key: str, capacity: float, rate: float, cost: float, now: float) -> float:
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate) - cost
+            self._buckets[key] = (tokens, now)
+            return tokens
+
+    def acquire_stream(self, user_key: str, limit: int, now: float) -> Optional[str]:
+        with self._lock:
+            streams = self._streams.setdefault(user_key, {})
+            for stream_id in [stream_id for stream_id, expires_at in streams.items() if expires_at <= now]:
+                del streams[stream_id]
+            if len(streams) >= limit:
+                return None
+            stream_id = uuid.uuid4().hex
+            streams[stream_id] = now + STREAM_LEASE_TTL
+            return f"{user_key}:{stream_id}"
+
+    def release_stream(self, stream_id: str) -> None:
+        user_key, _, stream_id = stream_id.rpartition(":")
+        with self._lock:
+            self._streams.get(user_key, {}).pop(stream_id, None)
+
+
+class SQLiteRateLimitStore:
+    """Limits stored in a SQLite file, so the workers of the server share them."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS streams (id TEXT PRIMARY KEY, user_key TEXT NOT NULL, expires_at REAL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS streams_user_key ON streams (user_key)")
+
+    def update_bucket(self, key: str, capacity: float, rate: float, cost: float, now: float) -> float:
+        with self._connect() as connection:
+            row = connection.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated_at = row or (capacity, now)
+            tokens = min(capacity, tokens + (now - updated_at) * rate) - cost
+            connection.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)", (key, tokens, now)
+            )
+            return tokens
+
+    def acquire_stream(self, user_key: str, limit: int, now: float) -> Optional[str]:
+        with self._connect() as connection:
+            connection.execute("DELETE FROM streams WHERE user_key = ? AND expires_at <= ?", (user_key, now))
+            (count,) = connection.execute("SELECT COUNT(*) FROM streams WHERE user_key = ?", (user_key,)).fetchone()
+            if count >= limit:
+                return None
+            stream_id = uuid.uuid4().hex
+            connection.execute(
+                "INSERT INTO streams (id, user_key, expires_at) VALUES (?, ?, ?)",
+                (stream_id, user_key, now + STREAM_LEASE_TTL),
+            )
+            return stream_id
+
+    def release_stream(self, stream_id: str) -> None:
+        with self._connect() as connection:
+            connection.execute("DELETE FROM streams WHERE id = ?", (stream_id,))
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Yields a connection in a write transaction, so the read and update of a limit are atomic."""
+        with closing(sqlite3.connect(self.path, timeout=5, isolation_level=None)) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+
+class Usage:
+    """A call let through by the limiter, to be finished with its answer or cancelled if it was not made."""
+
+    def __init__(self, limiter: "RateLimiter", bucket_key: str, stream_id: Optional[str], prompt_tokens: int):
+        self.limiter = limiter
+        self.bucket_key = bucket_key
+        self.stream_id = stream_id
+        self.prompt_tokens = prompt_tokens
+        self.remaining = 0.0
+        self._finished = False
+
+    def headers(self) -> dict[str, str]:
+        """Returns the rate limit headers, with the tokens left when the call was let through."""
+        if not self.limiter.enabled:
+            return {}
+        refill_time = (self.limiter.capacity - self.remaining) / self.limiter.rate
+        return {
+            "X-RateLimit-Limit": str(self.limiter.tokens_per_minute),
+            "X-RateLimit-Remaining": str(max(0, math.floor(self.remaining))),
+            "X-RateLimit-Reset": str(max(0, math.ceil(refill_time))),
+        }
+
+    def finish(self, answer: str) -> None:
+        """Charges the tokens of the prompt and answer, and ends the stream."""
+        self._end(self.prompt_tokens + count_tokens(answer))
+
+    def cancel(self) -> None:
+        """Ends the stream without charging anything."""
+        self._end(0)
+
+    def _end(self, tokens: int) -> None:
+        # a call let through while the limits were disabled has no stream and is not charged
+        if self._finished or self.stream_id is None:
+            return
+        self._finished = True
+        try:
+            if tokens:
+                self.limiter.store.update_bucket(
+                    self.bucket_key, self.limiter.capacity, self.limiter.rate, tokens, self.limiter.clock()
+                )
+        finally:
+            self.limiter.store.release_stream(self.stream_id)
+
+
+class RateLimiter:
+    """
+    Token buckets per user and engine, and caps of the streams per user.
+
+    Examples
+    --------
+    >>> usage = rate_limiter.start(user.pk, "gpt-4-0613", prompt_tokens=120)
+    >>> answer = "".join(get_conversation_answer(conversation, "gpt4"))
+    >>> usage.finish(answer)
+    """
+
+    def __init__(
+        self,
+        store: RateLimitStore,
+        tokens_per_minute: int = 40000,
+        max_streams: int = 3,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.store = store
+        self.tokens_per_minute = tokens_per_minute
+        self.max_streams = max_streams
+        self.clock = clock
+        self.enabled = tokens_per_minute > 0
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        path = os.getenv("GPT_RATE_LIMIT_PATH")
+        return cls(
+            SQLiteRateLimitStore(path) if path else MemoryRateLimitStore(),
+            tokens_per_minute=int(os.getenv("GPT_RATE_LIMIT_TOKENS_PER_MINUTE", 40000)),
+            max_streams=int(os.getenv("GPT_RATE_LIMIT_STREAMS", 3)),
+        )
+
+    @property
+    def capacity(self) -> float:
+        return float(self.tokens_per_minute)
+
+    @property
+    def rate(self) -> float:
+        return self.tokens_per_minute / 60
+
+    def remaining(self, user_id, engine: str) -> Optional[int]:
+        """Returns the tokens left to the user for the engine, None if the limits are disabled."""
+        if not self.enabled:
+            return None
+        tokens = self.store.update_bucket(f"{user_id}:{engine}", self.capacity, self.rate, 0, self.clock())
+        return max(0, math.floor(tokens))
+
+    def start(self, user_id, engine: str, prompt_tokens: int = 0) -> Usage:
+        """
+        Lets a call of the user through, or raises `RateLimited` if the bucket of the engine is empty or the user runs
+        too many streams.
+        """
+        bucket_key = f"{user_id}:{engine}"
+        if not self.enabled:
+            return Usage(self, bucket_key, None, prompt_tokens)
+
+        now = self.clock()
+        remaining = self.store.update_bucket(bucket_key, self.capacity, self.rate, 0, now)
+        if remaining <= 0:
+            retry_after = max(1, math.ceil((1 - remaining) / self.rate))
+            raise RateLimited(f"Token limit of {engine} exceeded, retry in {retry_after} s", retry_after)
+
+        stream_id = self.store.acquire_stream(str(user_id), self.max_streams, now)
+        if stream_id is None:
+            raise RateLimited(f"Only {self.max_streams} answers can be generated at once", 1)
+
+        usage = Usage(self, bucket_key, stream_id, prompt_tokens)
+        usage.remaining = remaining
+        return usage
+
+
+rate_limiter = RateLimiter.from_env()
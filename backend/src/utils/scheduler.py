@@ -0,0 +1,236 @@
+"""
+Scheduling of the upstream LLM calls.
+
+Every engine runs at most `max_concurrency` calls at once, the others wait in a queue served by priority, so the quick
+title calls are not starved by a burst of chat streams and an overloaded deployment is not hammered harder. When the
+queue of an engine is full, or a call waits longer than `max_wait`, `SchedulerOverloaded` is raised and the views answer
+503 with a `Retry-After` header.
+
+It is configured with environment variables:
+
+- `GPT_MAX_CONCURRENCY` - calls running at once per engine - default: 16
+- `GPT_MAX_CONCURRENCY_<ENGINE>` - calls running at once for an engine, e.g. `GPT_MAX_CONCURRENCY_GPT_4_0613`
+- `GPT_MAX_QUEUE` - calls waiting per engine, further ones are rejected - default: 64
+- `GPT_MAX_WAIT` - seconds a call waits before being rejected - default: 10
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import re
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from enum import IntEnum
+from typing import AsyncIterator, Callable, Iterator, Optional
+
+__all__ = ["EngineScheduler", "Priority", "Reservation", "SchedulerOverloaded", "scheduler"]
+
+
+class Priority(IntEnum):
+    """Priority classes of the upstream calls, the lower the sooner they are served."""
+
+    CHAT = 0
+    QUESTION = 1
+    TITLE = 2
+
+
+class SchedulerOverloaded(Exception):
+    def __init__(self, engine: str, retry_after: int):
+        super().__init__(f"Too many requests to {engine}, retry in {retry_after} s")
+        self.engine = engine
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    def __init__(self, wake: Callable[[], None]):
+        self.wake = wake
+        self.granted = False
+
+
+class Reservation:
+    """Slot of an engine taken ahead of the call running in it, see `EngineScheduler.areserve`."""
+
+    def __init__(self, scheduler: "EngineScheduler", engine: str):
+        self.scheduler = scheduler
+        self.engine = engine
+        # set once a call runs in the slot, it stays unset if the answer is cached or generated for another caller
+        self.used = False
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self) -> None:
+        """Frees the slot, only the first call does."""
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self.scheduler._release(self.engine)
+
+
+class _EngineQueue:
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self.active = 0
+        self.waiters = []
+        self.counters = {"calls": 0, "queued": 0, "rejected": 0}
+
+
+class EngineScheduler:
+    """
+    Per-engine concurrency limits of the upstream calls, shared by the sync and async callers.
+
+    Examples
+    --------
+    >>> with scheduler.slot("gpt-4-0613", Priority.TITLE):
+    ...     response = openai.ChatCompletion.create(engine="gpt-4-0613", messages=messages)
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 16,
+        max_queue: int = 64,
+        max_wait: float = 10,
+        engine_max_concurrency: Optional[dict[str, int]] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.engine_max_concurrency = {
+            _get_env_name(engine): value for engine, value in (engine_max_concurrency or {}).items()
+        }
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._order = itertools.count()
+
+    @classmethod
+    def from_env(cls) -> "EngineScheduler":
+        prefix = "GPT_MAX_CONCURRENCY_"
+        return cls(
+            max_concurrency=int(os.getenv("GPT_MAX_CONCURRENCY", 16)),
+            max_queue=int(os.getenv("GPT_MAX_QUEUE", 64)),
+            max_wait=float(os.getenv("GPT_MAX_WAIT", 10)),
+            engine_max_concurrency={
+                name.removeprefix(prefix): int(value) for name, value in os.environ.items() if name.startswith(prefix)
+            },
+        )
+
+    @property
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.max_wait))
+
+    @contextmanager
+    def slot(self, engine: str, priority: Priority) -> Iterator[None]:
+        """Runs the block as one of the calls of the engine, waiting for a free slot if there is none."""
+        event = threading.Event()
+        waiter = _Waiter(event.set)
+        if not self._enqueue(engine, priority, waiter) and not event.wait(self.max_wait):
+            self._give_up(engine, waiter)
+        try:
+            yield
+        finally:
+            self._release(engine)
+
+    @asynccontextmanager
+    async def aslot(
+        self, engine: str, priority: Priority, reservation: Optional[Reservation] = None
+    ) -> AsyncIterator[None]:
+        """Async counterpart of `slot`, the block runs in the slot of `reservation` if one was taken already."""
+        if reservation is None:
+            reservation = await self.areserve(engine, priority)
+        reservation.used = True
+        try:
+            yield
+        finally:
+            reservation.release()
+
+    async def areserve(self, engine: str, priority: Priority) -> Reservation:
+        """
+        Waits for a slot of the engine and returns it, held until it is released. It lets a call be rejected before it
+        starts, e.g. before the headers of a streamed answer are sent, and run later in another event loop.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = _Waiter(lambda: loop.call_soon_threadsafe(_resolve, future))
+        if not self._enqueue(engine, priority, waiter):
+            try:
+                await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+            except asyncio.TimeoutError:
+                self._give_up(engine, waiter)
+            except asyncio.CancelledError:
+                if not self._cancel(engine, waiter):
+                    self._release(engine)
+                raise
+        return Reservation(self, engine)
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """Returns the running and waiting calls of each engine, together with the calls made, queued and rejected."""
+        with self._lock:
+            return {
+                engine: {"active": queue.active, "waiting": len(queue.waiters), **queue.counters}
+                for engine, queue in self._queues.items()
+            }
+
+    def _get_queue(self, engine: str) -> _EngineQueue:
+        queue = self._queues.get(engine)
+        if queue is None:
+            max_concurrency = self.engine_max_concurrency.get(_get_env_name(engine), self.max_concurrency)
+            queue = self._queues[engine] = _EngineQueue(max_concurrency)
+        return queue
+
+    def _enqueue(self, engine: str, priority: Priority, waiter: _Waiter) -> bool:
+        """Takes a slot and returns True if one is free, otherwise queues the waiter and returns False."""
+        with self._lock:
+            queue = self._get_queue(engine)
+            if queue.active < queue.max_concurrency and not queue.waiters:
+                queue.active += 1
+                queue.counters["calls"] += 1
+                return True
+            if len(queue.waiters) >= self.max_queue:
+                queue.counters["rejected"] += 1
+                raise SchedulerOverloaded(engine, self.retry_after)
+            heapq.heappush(queue.waiters, (priority, next(self._order), waiter))
+            queue.counters["queued"] += 1
+            return False
+
+    def _cancel(self, engine: str, waiter: _Waiter) -> bool:
+        """Removes the waiter from the queue, returns False if it was granted a slot in the meantime."""
+        with self._lock:
+            if waiter.granted:
+                return False
+            queue = self._queues[engine]
+            queue.waiters = [entry for entry in queue.waiters if entry[2] is not waiter]
+            heapq.heapify(queue.waiters)
+            return True
+
+    def _give_up(self, engine: str, waiter: _Waiter) -> None:
+        """Rejects a call which waited too long, unless it was granted a slot in the meantime."""
+        if self._cancel(engine, waiter):
+            with self._lock:
+                self._queues[engine].counters["rejected"] += 1
+            raise SchedulerOverloaded(engine, self.retry_after)
+
+    def _release(self, engine: str) -> None:
+        """Hands the slot over to the first waiter, or frees it."""
+        with self._lock:
+            queue = self._queues[engine]
+            if queue.waiters:
+                _, _, waiter = heapq.heappop(queue.waiters)
+                waiter.granted = True
+                queue.counters["calls"] += 1
+                waiter.wake()
+            else:
+                queue.active -= 1
+
+
+def _get_env_name(engine: str) -> str:
+    return re.sub(r"[^A-Z0-9]", "_", engine.upper())
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+scheduler = EngineScheduler.from_env()
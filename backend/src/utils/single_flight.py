@@ -0,0 +1,157 @@
+"""
+Coalescing of identical concurrent LLM requests.
+
+The first caller of a key starts the upstream call, which runs in a background thread (or an asyncio task) and buffers
+its chunks. Every caller of the same key, the first one included, is a subscriber replaying the buffered chunks and
+waiting for new ones, so a subscriber going away does not affect the others. Once the call is finished, the next caller
+of the key starts a new one. An asyncio call is cancelled once all of its subscribers went away, freeing its scheduler
+slot, the next caller of the key starts a new one as well.
+"""
+
+import asyncio
+import threading
+from contextlib import aclosing
+from typing import AsyncIterable, AsyncIterator, Callable, Iterable, Iterator, Optional
+
+__all__ = ["SingleFlight", "single_flight"]
+
+
+class _Flight:
+    def __init__(self, condition):
+        self.chunks = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.condition = condition
+        self.task = None
+        self.subscribers = 0
+
+    def is_ready(self, chunks_count: int) -> bool:
+        return self.done or len(self.chunks) > chunks_count
+
+
+class SingleFlight:
+    """
+    Shares one call of a chunks factory between the concurrent callers with the same key.
+
+    Examples
+    --------
+    >>> for chunk in single_flight.stream(key, lambda: get_chunks_from_upstream()):
+    ...     print(chunk)
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._async_flights = {}
+        self._lock = threading.Lock()
+        self._counters = {}
+        self.reset_stats()
+
+    def stream(self, key: str, chunks_factory: Callable[[], Iterable[str]]) -> Iterator[str]:
+        """Yields the chunks of the call in flight for the key, starting it in a background thread if there is none."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight(threading.Condition())
+                threading.Thread(target=self._run, args=(key, flight, chunks_factory), daemon=True).start()
+                self._counters["upstream_calls"] += 1
+            else:
+                self._counters["coalesced_calls"] += 1
+
+        chunks_count = 0
+        while True:
+            with flight.condition:
+                flight.condition.wait_for(lambda: flight.is_ready(chunks_count))
+                chunks, done = flight.chunks[chunks_count:], flight.done
+            yield from chunks
+            chunks_count += len(chunks)
+            if done:
+                break
+        if flight.error is not None:
+            raise flight.error
+
+    async def astream(self, key: str, chunks_factory: Callable[[], AsyncIterable[str]]) -> AsyncIterator[str]:
+        """
+        Async counterpart of `stream`, the call runs in an asyncio task. Calls are only shared within an event loop, as
+        under WSGI every request runs in an event loop of its own.
+        """
+        flight_key = (asyncio.get_running_loop(), key)
+        with self._lock:
+            flight = self._async_flights.get(flight_key)
+            if flight is None:
+                flight = self._async_flights[flight_key] = _Flight(asyncio.Condition())
+                flight.task = asyncio.create_task(self._arun(flight_key, flight, chunks_factory))
+                self._counters["upstream_calls"] += 1
+            else:
+                self._counters["coalesced_calls"] += 1
+            flight.subscribers += 1
+
+        try:
+            chunks_count = 0
+            while True:
+                async with flight.condition:
+                    await flight.condition.wait_for(lambda: flight.is_ready(chunks_count))
+                    chunks, done = flight.chunks[chunks_count:], flight.done
+                for chunk in chunks:
+                    yield chunk
+                chunks_count += len(chunks)
+                if done:
+                    break
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            with self._lock:
+                flight.subscribers -= 1
+                abandoned = not flight.subscribers and not flight.done
+                if abandoned and self._async_flights.get(flight_key) is flight:
+                    del self._async_flights[flight_key]
+            if abandoned:
+                flight.task.cancel()
+
+    def stats(self) -> dict[str, int]:
+        """Returns the number of upstream calls made and of the calls which joined a call in flight."""
+        with self._lock:
+            return dict(self._counters)
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._counters = {"upstream_calls": 0, "coalesced_calls": 0}
+
+    def _run(self, key: str, flight: _Flight, chunks_factory: Callable[[], Iterable[str]]) -> None:
+        try:
+            for chunk in chunks_factory():
+                with flight.condition:
+                    flight.chunks.append(chunk)
+                    flight.condition.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            with self._lock:
+                del self._flights[key]
+            with flight.condition:
+                flight.done = True
+                flight.condition.notify_all()
+
+    async def _arun(self, flight_key: tuple, flight: _Flight, chunks_factory: Callable[[], AsyncIterable[str]]) -> None:
+        try:
+            # closed right away when the call is cancelled, so that it leaves its scheduler slot at once
+            async with aclosing(chunks_factory()) as chunks:
+                async for chunk in chunks:
+                    async with flight.condition:
+                        flight.chunks.append(chunk)
+                        flight.condition.notify_all()
+        except asyncio.CancelledError as e:
+            flight.error = e
+            raise
+        except Exception as e:
+            flight.error = e
+        finally:
+            with self._lock:
+                # an abandoned call is dropped by its last subscriber already
+                if self._async_flights.get(flight_key) is flight:
+                    del self._async_flights[flight_key]
+            async with flight.condition:
+                flight.done = True
+                flight.condition.notify_all()
+
+
+single_flight = SingleFlight()
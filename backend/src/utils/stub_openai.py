@@ -0,0 +1,116 @@
+import asyncio
+import json
+import random
+from typing import Callable, Optional
+
+import aiohttp.web
+
+from src.libs import openai
+
+OPENAI_SETTINGS = ["api_type", "api_base", "api_version", "api_key"]
+
+
+class StubOpenAIServer:
+    """
+    Local stand-in for the (Azure) OpenAI chat completions endpoint, used by the streaming benchmarks and tests.
+
+    It streams `chunks_count` chunks of `chunk` content, sleeping `chunk_delay` seconds before each of them, and points
+    the `openai` client at itself while entered. Every response is delayed by a latency drawn from a normal distribution
+    of `latency` mean and `latency_jitter` standard deviation, and a share `error_rate` of the requests is answered with
+    an `error_status` error. The content of non-streamed answers is `reply(request_body)` if `reply` is given. It also
+    records the request bodies and counts the streams it serves concurrently.
+
+    Examples
+    --------
+    >>> async with StubOpenAIServer(chunks_count=3) as upstream:
+    ...     async for chunk in aget_simple_answer("Hi"):
+    ...         pass
+    """
+
+    def __init__(
+        self,
+        chunks_count: int = 20,
+        chunk_delay: float = 0.01,
+        chunk: str = "Lorem ipsum ",
+        latency: float = 0,
+        latency_jitter: float = 0,
+        error_rate: float = 0,
+        error_status: int = 500,
+        port: int = 0,
+        seed: Optional[int] = None,
+        reply: Optional[Callable[[dict], str]] = None,
+    ):
+        self.chunks_count = chunks_count
+        self.chunk_delay = chunk_delay
+        self.chunk = chunk
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.port = port
+        self.reply = reply
+        self.requests = []
+        self.errors_count = 0
+        self.active_streams = 0
+        self.max_active_streams = 0
+        self.url = None
+        self._runner = None
+        self._previous_settings = {}
+        self._random = random.Random(seed)
+
+    async def __aenter__(self) -> "StubOpenAIServer":
+        app = aiohttp.web.Application()
+        app.router.add_post("/openai/deployments/{engine}/chat/completions", self._chat_completions)
+        self._runner = aiohttp.web.AppRunner(app)
+        await self._runner.setup()
+        await aiohttp.web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+        self.url = "http://%s:%s" % self._runner.addresses[0][:2]
+
+        self._previous_settings = {name: getattr(openai, name) for name in OPENAI_SETTINGS}
+        openai.api_type, openai.api_base, openai.api_version, openai.api_key = "azure", self.url, "2023-05-15", "stub"
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        for name, value in self._previous_settings.items():
+            setattr(openai, name, value)
+        await self._runner.cleanup()
+
+    @property
+    def content(self) -> str:
+        """The whole answer streamed for every request."""
+        return self.chunk * self.chunks_count
+
+    async def _chat_completions(self, request: aiohttp.web.Request) -> aiohttp.web.StreamResponse:
+        data = await request.json()
+        self.requests.append(data)
+        await asyncio.sleep(max(0.0, self._random.gauss(self.latency, self.latency_jitter)))
+        if self._random.random() < self.error_rate:
+            self.errors_count += 1
+            error = {"code": str(self.error_status), "message": "Error injected by the stub server"}
+            return aiohttp.web.json_response({"error": error}, status=self.error_status)
+
+        if not data.get("stream"):
+            await asyncio.sleep(self.chunk_delay * self.chunks_count)
+            message = {"role": "assistant", "content": self.content if self.reply is None else self.reply(data)}
+            return aiohttp.web.json_response({"choices": [{"index": 0, "message": message}]})
+
+        response = aiohttp.web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        self.active_streams += 1
+        self.max_active_streams = max(self.max_active_streams, self.active_streams)
+        try:
+            await response.write(self._event({"choices": []}))
+            for _ in range(self.chunks_count):
+                await asyncio.sleep(self.chunk_delay)
+                await response.write(self._event({"choices": [{"index": 0, "delta": {"content": self.chunk}}]}))
+            await response.write(b"data: [DONE]\n\n")
+        except ConnectionResetError:
+            # the client went away before the end of the stream
+            pass
+        finally:
+            self.active_streams -= 1
+        return response
+
+    @staticmethod
+    def _event(data: dict) -> bytes:
+        return f"data: {json.dumps(data)}\n\n".encode()
@@ -0,0 +1,85 @@
+"""
+Offline estimate of the number of tokens of chat messages.
+
+The estimate follows the pre-tokenization of the cl100k_base encoding used by the gpt-3.5 and gpt-4 models: text is
+split into words, digit groups, punctuation and whitespace runs, and long pieces are assumed to take a token per few
+characters. It needs neither the tokenizer files nor network access, and is only meant for keeping prompts within the
+context limits of the models, not for billing.
+"""
+
+import re
+from functools import lru_cache
+
+__all__ = ["count_message_tokens", "count_messages_tokens", "count_tokens"]
+
+TOKENS_PER_MESSAGE = 3  # every message is wrapped in <|start|>{role}\n{content}<|end|>\n
+TOKENS_PER_REPLY = 3  # every reply is primed with <|start|>assistant<|message|>
+CHARS_PER_WORD_TOKEN = 6
+CHARS_PER_SYMBOL_TOKEN = 2
+
+_PIECE_PATTERN = re.compile(r"'(?:[sdmt]|ll|ve|re)| ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]+|\s+", re.IGNORECASE)
+
+
+def count_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens of a text.
+
+    Parameters
+    ----------
+    text : str
+        The text to be counted.
+
+    Returns
+    -------
+    int
+        The estimated number of tokens.
+    """
+    tokens = 0
+    for piece in _PIECE_PATTERN.findall(text):
+        if not piece.isascii():
+            tokens += len(piece)
+        elif piece[-1].isalpha():
+            tokens += -(-len(piece) // CHARS_PER_WORD_TOKEN)
+        elif piece[-1].isdigit() or piece.isspace():
+            tokens += 1
+        else:
+            tokens += -(-len(piece) // CHARS_PER_SYMBOL_TOKEN)
+    return tokens
+
+
+@lru_cache(maxsize=4096)
+def count_message_tokens(role: str, content: str) -> int:
+    """
+    Estimates the number of tokens a single message takes in the prompt, cached by role and content so that only new
+    messages are counted on each turn of a conversation.
+
+    Parameters
+    ----------
+    role : str
+        The role of the message.
+    content : str
+        The content of the message.
+
+    Returns
+    -------
+    int
+        The estimated number of tokens including the message formatting.
+    """
+    return TOKENS_PER_MESSAGE + count_tokens(role) + count_tokens(content)
+
+
+def count_messages_tokens(messages: list[dict[str, str]]) -> int:
+    """
+    Estimates the number of prompt tokens of a chat completion request.
+
+    Parameters
+    ----------
+    messages : list[dict[str, str]]
+        The role and content of each message.
+
+    Returns
+    -------
+    int
+        The estimated number of prompt tokens.
+    """
+    return sum(count_message_tokens(message["role"], message["content"]) for message in messages) + TOKENS_PER_REPLY